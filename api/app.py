@@ -10,7 +10,6 @@ from datetime import timedelta
 from typing import Any, Literal, OrderedDict, cast
 from uuid import uuid4
 
-import redis
 from flask import (
     Flask,
     Response,
@@ -22,9 +21,9 @@ from flask import (
     send_from_directory,
     session,
 )
-from flask_compress import Compress
 from flask_httpauth import HTTPBasicAuth
 from flask_restful import Api, Resource, reqparse
+from flask_restful.representations.json import output_json
 from flask_session import Session
 from passlib.hash import pbkdf2_sha256  # pyright: ignore[reportAttributeAccessIssue]
 from PIL import Image
@@ -32,6 +31,41 @@ from pywebpush import webpush
 from rich.console import Console
 from rich.logging import RichHandler
 
+from image_meta import computeImageMeta
+from image_store import (
+    IMAGE_FOLDER,
+    imageETag,
+    isImmutable,
+    locateImage,
+    removeImage,
+    storeImagePath,
+)
+from ingredients import normaliseName
+from query_profile import profiler
+from ratelimit import RateLimiter
+from redis_clients import (
+    NOTIFICATIONS_DB,
+    RATE_LIMIT_DB,
+    SHOPPING_LISTS_DB,
+    UNIQUE_RECIPES_DB,
+    pingAll,
+    redisClient,
+)
+from response_compression import CompressionPolicy
+from sessions import configureSessions, revokeSession
+from shopping_list import ShoppingListIndex, ShoppingListStore
+from timing import TimedJSONProvider, initTiming, phase
+from unique_recipes import UNIQUE_RECIPE_TTL, packUniqueRecipe, unpackUniqueRecipe
+from uploads import (
+    UPLOAD_MAX_BYTES,
+    UploadError,
+    appendUpload,
+    createUpload,
+    discardUpload,
+    getUpload,
+    partPath,
+    removeUpload,
+)
 from util import Database
 
 assert "FLASK_KEY" in os.environ, "Missing env variable FLASK_KEY"
@@ -40,25 +74,43 @@ assert "PUSH_PUBLIC_KEY" in os.environ, "Missing env variable PUSH_PUBLIC_KEY"
 assert "PUSH_PRIVATE_KEY" in os.environ, "Missing env variable PUSH_PRIVATE_KEY"
 
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
 app.secret_key = bytes(os.environ["FLASK_KEY"], "utf-8").decode("unicode_escape")
 app.config["SESSION_TYPE"] = "redis"
-app.config["SESSION_REDIS"] = redis.Redis(host="redis", port=6379, db=2)
+app.config["SESSION_REDIS"] = redisClient(SHOPPING_LISTS_DB)
 app.config["SESSION_COOKIE_SAMESITE"] = "Strict"
 app.config["SESSION_COOKIE_SECURE"] = True
 app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(days=365)
 app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 365 * 24 * 60 * 60
+# werkzeug stops reading (413) beyond this, leaves room for the multipart framing
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES + 1024 * 1024
 
 
 api = Api(app)
-Compress(app)
 auth = HTTPBasicAuth()
 db = Database()
 
 Session(app)
-redisNotificationsDB = redis.StrictRedis(host="redis", port=6379, db=0)
-redisUniqueRecipeDB = redis.StrictRedis(host="redis", port=6379, db=1)
-redisShoppingListDB = redis.StrictRedis(
-    host="redis", port=6379, db=2, decode_responses=True
+sessionRevocations = configureSessions(app, app.config["SESSION_REDIS"])
+initTiming(app)
+CompressionPolicy(app)
+
+
+@api.representation("application/json")
+def outputJson(data, code, headers=None):
+    with phase("json"):
+        return output_json(data, code, headers)
+
+
+redisNotificationsDB = redisClient(NOTIFICATIONS_DB)
+# shared recipes are written once and read by everyone the link is sent to
+redisUniqueRecipeDB = redisClient(UNIQUE_RECIPES_DB, cached=True)
+redisShoppingListDB = redisClient(SHOPPING_LISTS_DB, decode=True)
+# subscribers of the list event streams, kept apart from the request pool
+redisShoppingListStreams = redisClient(SHOPPING_LISTS_DB, decode=True, stream=True)
+shoppingListStore = ShoppingListStore(redisClient(SHOPPING_LISTS_DB))
+shoppingListIndex = ShoppingListIndex(
+    redisShoppingListDB, redisClient(SHOPPING_LISTS_DB, decode=True, cached=True)
 )
 
 # Shared shopping lists are referenced by a client-generated UUID. We match that
@@ -77,13 +129,16 @@ logger = logging.getLogger("recipes.api")
 logger.handlers = [RichHandler(logging.INFO, markup=True, console=Console(width=250))]
 logger.setLevel(logging.INFO)
 
+rateLimiter = RateLimiter(redisClient(RATE_LIMIT_DB), logger)
+
 
 @auth.verify_password
 def verify_password(username: str, password: str):
     hash = db.getPasswordHash(username)
     if hash is None:
         return False
-    return pbkdf2_sha256.verify(password, hash)
+    with phase("auth"):
+        return pbkdf2_sha256.verify(password, hash)
 
 
 # remove the www-authenticate header to avoid browsers opening basic auth dialogs
@@ -96,29 +151,52 @@ def remove_header(response):
 
 @auth.error_handler
 def unauthorized():
+    revokeSession(sessionRevocations, session)
     session["userName"] = None
     session["id"] = None
     return make_response(jsonify({"message": "Unauthorized access"}), 401)
 
 
+def noWriteAccess():
+    return make_response(jsonify({"error": "no write access"}), 403)
+
+
+def writeRejected(userName, notFound):
+    """Response for a write that matched no row.
+
+    Write access is checked inside the write statements, only when they fail is
+    it looked up to tell a read-only user (403) from a missing row.
+    """
+    if not db.hasWriteAccess(userName):
+        return noWriteAccess()
+    return notFound
+
+
 @app.route("/test-uptime", methods=["GET"])
 @auth.login_required
 def test_uptime():
     # login requires db connection, check if redis is also reachable
-    redisShoppingListDB.ping()
+    pingAll()
     return "", 200
 
 
+def basicAuthUsername():
+    return request.authorization.username if request.authorization else None
+
+
 @app.route("/login", methods=["GET"])
+@rateLimiter.limited("login", basicAuthUsername)
 @auth.login_required
 def login():
     session["userName"] = auth.username()
     session["id"] = str(uuid4())
+    session.permanent = True
     return make_response(jsonify({"message": "Logged in"}), 200)
 
 
 @app.route("/logout", methods=["GET"])
 def logout():
+    revokeSession(sessionRevocations, session)
     session["userName"] = None
     session["id"] = None
     return make_response(jsonify({}), 200)
@@ -128,6 +206,32 @@ def sessionGet(key: Literal["userName", "id"], default: Any = None):
     return session.get(key, default)  # type: ignore
 
 
+def isAdminRequest():
+    """Monitoring endpoints are only served with the ADMIN_SECRET header."""
+    secret = os.environ.get("ADMIN_SECRET")
+    return (
+        secret is not None
+        and "admin-secret" in request.headers
+        and hmac.compare_digest(
+            request.headers["admin-secret"].encode(), secret.encode()
+        )
+    )
+
+
+@app.route("/admin/queries", methods=["GET"])
+def queryProfile():
+    if not isAdminRequest():
+        return unauthorized()
+    return jsonify(profiler.report())
+
+
+@app.route("/admin/ratelimit", methods=["GET"])
+def rateLimitStats():
+    if not isAdminRequest():
+        return unauthorized()
+    return jsonify(rateLimiter.stats())
+
+
 @app.route("/status", methods=["GET"])
 def status():
     userName = sessionGet("userName")
@@ -145,43 +249,59 @@ def status():
         return unauthorized()
 
 
+@app.route("/bootstrap", methods=["GET"])
+def bootstrap():
+    userName = sessionGet("userName")
+    if userName is None:
+        return unauthorized()
+    body = db.getBootstrap(userName)
+    if body is None:
+        return unauthorized()
+    return Response(body, mimetype="application/json")
+
+
+@app.route("/changes", methods=["GET"])
+def changeFeed():
+    """Live changes of the user's group as server-sent events, see changes.py."""
+    userName = sessionGet("userName")
+    if userName is None:
+        return unauthorized()
+    groupId = db.getGroupId(userName)
+    if groupId == -1:
+        return unauthorized()
+    # sent by the browser when it reconnects, `since` for the first connection
+    version = request.headers.get("Last-Event-ID") or request.args.get("since")
+    resp = Response(db.changes.stream(groupId, version), mimetype="text/event-stream")
+    resp.headers["X-Accel-Buffering"] = "No"
+    resp.headers["Cache-Control"] = "no-transform"  # for npm dev
+    return resp
+
+
 @app.route("/shoppingLists", methods=["GET", "POST", "DELETE"])
 def listOfshoppingLists():
     user_name = sessionGet("userName")
     if user_name is None:
         return unauthorized()
 
-    key = f"lists:{user_name}"
     if request.method == "GET":
-        if redisShoppingListDB.llen(key) == 0:
-            redisShoppingListDB.lpush(
-                key, json.dumps({"id": user_name, "name": "Private"})
-            )
-        lists = cast(list, redisShoppingListDB.lrange(key, 0, -1))
-        decoded = [json.loads(x) for x in lists]
-        return jsonify(decoded)
-    elif request.method == "POST":
-        if request.json is None or "id" not in request.json:
-            return make_response(jsonify({"error": "Expected 'id' key"}), 400)
+        return jsonify(shoppingListIndex.getLists(user_name))
+    if request.json is None or "id" not in request.json:
+        return make_response(jsonify({"error": "Expected 'id' key"}), 400)
+    if request.method == "POST":
         if "name" not in request.json:
             return make_response(jsonify({"error": "Expected 'name' key"}), 400)
-        # make sure the list is unique
-        redisShoppingListDB.lrem(key, 0, json.dumps(request.json))
-        redisShoppingListDB.lpush(key, json.dumps(request.json))
+        shoppingListIndex.addList(
+            user_name, str(request.json["id"]), str(request.json["name"])
+        )
     else:
-        if request.json is None or "id" not in request.json:
-            return make_response(jsonify({"error": "Expected 'id' key"}), 400)
-        if "name" not in request.json:
-            return make_response(jsonify({"error": "Expected 'name' key"}), 400)
-        redisShoppingListDB.lrem(key, 0, json.dumps(request.json))
+        shoppingListIndex.removeList(user_name, str(request.json["id"]))
     return make_response("", 200)
 
 
 def shoppinglist_stream(list_id: str):
-    data = redisShoppingListDB.hvals(list_id)
-    data = [json.loads(x) for x in data]  # type: ignore
+    data = shoppingListStore.getItems(list_id)
     yield "data: %s\n\n" % json.dumps(data)
-    pubsub = redisShoppingListDB.pubsub()
+    pubsub = redisShoppingListStreams.pubsub()
     pubsub.subscribe(list_id)
     for message in pubsub.listen():
         if message["type"] == "message":
@@ -212,7 +332,7 @@ def verifyShoppingListJson(requestJson: Any | None):
     return True
 
 
-def handleShoppingList(list_id: str):
+def handleShoppingList(list_id: str, public_id: str):
     if request.method == "GET":
         resp = Response(shoppinglist_stream(list_id), mimetype="text/event-stream")
         resp.headers["X-Accel-Buffering"] = "No"
@@ -223,17 +343,17 @@ def handleShoppingList(list_id: str):
         verify = verifyShoppingListJson(requestJson)
         if verify is not True:
             return verify
-        for item in requestJson:
-            redisShoppingListDB.hset(list_id, item["id"], json.dumps(item))
+        shoppingListStore.setItems(list_id, requestJson)
     elif request.method == "DELETE":
         requestJson: Any = request.json
         verify = verifyShoppingListJson(requestJson)
         if verify is not True:
             return verify
-        for item in requestJson:
-            redisShoppingListDB.hdel(list_id, item["id"])
-    data = redisShoppingListDB.hvals(list_id)
-    data = [json.loads(x) for x in data]  # type: ignore
+        shoppingListStore.deleteItems(list_id, [item["id"] for item in requestJson])
+    data = shoppingListStore.maintain(list_id)
+    user_name = sessionGet("userName")
+    if user_name is not None:
+        shoppingListIndex.touch(user_name, public_id)
     toPublish = {}
     toPublish["data"] = json.dumps(data)
     redisShoppingListDB.publish(list_id, json.dumps(toPublish))
@@ -244,7 +364,7 @@ def handleShoppingList(list_id: str):
 def privateShoppingList():
     user_name = sessionGet("userName")
     if user_name is not None:
-        return handleShoppingList(user_name)
+        return handleShoppingList(user_name, user_name)
     else:
         return unauthorized()
 
@@ -270,7 +390,23 @@ def publicShoppingList(list_id: str):
     key = resolveShoppingListKey(list_id)
     if key is None:
         return unauthorized()
-    return handleShoppingList(key)
+    return handleShoppingList(key, list_id)
+
+
+@app.route("/shoppingList/archive", methods=["GET"])
+def privateShoppingListArchive():
+    user_name = sessionGet("userName")
+    if user_name is None:
+        return unauthorized()
+    return jsonify(shoppingListStore.getArchive(user_name))
+
+
+@app.route("/shoppingLists/<string:list_id>/archive", methods=["GET"])
+def publicShoppingListArchive(list_id: str):
+    key = resolveShoppingListKey(list_id)
+    if key is None:
+        return unauthorized()
+    return jsonify(shoppingListStore.getArchive(key))
 
 
 @app.route("/webpush_public_key", methods=["GET"])
@@ -323,9 +459,10 @@ def addSubscription():
 
 @app.route("/uniqueRecipes/<string:uuid>", methods=["GET"])
 def getUniqueRecipe(uuid: str):
-    if not redisUniqueRecipeDB.exists(uuid):
+    stored = cast(bytes | None, redisUniqueRecipeDB.get(uuid))
+    if stored is None:
         return make_response("", 404)
-    return make_response(jsonify(json.loads(redisUniqueRecipeDB.get(uuid))), 200)  # type: ignore
+    return Response(unpackUniqueRecipe(stored), mimetype="application/json")
 
 
 @app.route("/uniqueRecipes", methods=["POST"])
@@ -334,10 +471,15 @@ def addUniqueRecipe():
     if userName is None:
         return unauthorized()
     requestData = request.json
-    uuid = str(uuid4())
-    redisUniqueRecipeDB.set(uuid, json.dumps(requestData))
-    redisUniqueRecipeDB.expire(uuid, 60 * 60 * 24 * 30)  # 30 days valid
-    return make_response(jsonify({"createdId": uuid}), 200)
+    # the id is derived from the canonical content, so sharing the same recipe
+    # again reuses the existing entry and only refreshes its TTL, the blob is
+    # not rewritten (which would also invalidate it in the client-side caches)
+    payload = json.dumps(requestData, sort_keys=True, separators=(",", ":")).encode()
+    createdId = hashlib.sha256(payload).hexdigest()[:32]
+    packed = packUniqueRecipe(payload)
+    if not redisUniqueRecipeDB.set(createdId, packed, ex=UNIQUE_RECIPE_TTL, nx=True):
+        redisUniqueRecipeDB.expire(createdId, UNIQUE_RECIPE_TTL)
+    return make_response(jsonify({"createdId": createdId}), 200)
 
 
 class UserListAPI(Resource):
@@ -349,6 +491,9 @@ class UserListAPI(Resource):
         return db.getUsers(userName, args["checksum"])
 
     def post(self):
+        limited = rateLimiter.check("register")
+        if limited is not None:
+            return limited
         reqParser = reqparse.RequestParser()
         reqParser.add_argument(
             "username",
@@ -370,6 +515,13 @@ class UserListAPI(Resource):
                 jsonify({"message": "The username is too short (3 chars minimum)."}),
                 400,
             )
+        # Basic auth can not carry it and it separates the namespaces of the
+        # redis keys, a private shopping list is keyed by the bare username
+        if ":" in args["username"]:
+            return make_response(
+                jsonify({"message": "The username must not contain ':'."}),
+                400,
+            )
         if len(args["password"]) < 8:
             return make_response(
                 jsonify({"message": "The password is too short (8 chars minimum)."}),
@@ -409,13 +561,14 @@ class CommentListAPI(Resource):
         userName = sessionGet("userName")
         if userName is None:
             return unauthorized()
-        if not db.hasWriteAccess(userName):
-            return make_response(jsonify({"error": "no write access"}), 403)
         args = self.reqparse.parse_args()
         try:
-            return db.addComment(userName, args["text"], args["recipeId"])
+            result = db.addComment(userName, args["text"], args["recipeId"])
         except Exception as e:
             return make_response(jsonify({"error": str(e)}), 500)
+        if result is None:
+            return noWriteAccess()
+        return result
 
 
 class CommentAPI(Resource):
@@ -439,26 +592,65 @@ class CommentAPI(Resource):
         userName = sessionGet("userName")
         if userName is None:
             return unauthorized()
-        if not db.hasWriteAccess(userName):
-            return make_response(jsonify({"error": "no write access"}), 403)
         args = self.reqparse.parse_args()
         if db.updateComment(userName, commentId, args["text"]):
             return make_response("", 200)
         else:
-            return make_response(jsonify({"error": "No comment updated"}), 404)
+            return writeRejected(
+                userName,
+                make_response(jsonify({"error": "No comment updated"}), 404),
+            )
 
     def delete(self, commentId: int):
         userName = sessionGet("userName")
         if userName is None:
             return unauthorized()
-        if not db.hasWriteAccess(userName):
-            return make_response(jsonify({"error": "no write access"}), 403)
         result = db.deleteComment(userName, commentId)
         if result == 0:
-            return make_response("", 404)
+            return writeRejected(userName, make_response("", 404))
         return make_response("", 204)
 
 
+class RecipeCommentsAPI(Resource):
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument("after", type=int, default=0, location="args")
+        self.reqparse.add_argument("limit", type=int, default=50, location="args")
+
+    def get(self, recipeId: int):
+        userName = sessionGet("userName")
+        if userName is None:
+            return unauthorized()
+        args = self.reqparse.parse_args()
+        limit = min(max(args["limit"], 1), 200)
+        return db.getRecipeComments(userName, recipeId, args["after"], limit)
+
+
+class RecipeCoverageAPI(Resource):
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument(
+            "ingredient",
+            type=str,
+            action="append",
+            required=True,
+            help="No ingredient provided",
+            location="args",
+        )
+        self.reqparse.add_argument("limit", type=int, default=50, location="args")
+
+    def get(self):
+        userName = sessionGet("userName")
+        if userName is None:
+            return unauthorized()
+        args = self.reqparse.parse_args()
+        names = sorted({normaliseName(i) for i in args["ingredient"]} - {""})
+        if not names:
+            return make_response(jsonify({"error": "No ingredient provided"}), 400)
+        limit = min(max(args["limit"], 1), 200)
+        return db.getRecipesByIngredients(userName, names[:100], limit)
+
+
 class RecipeListAPI(Resource):
     def __init__(self):
         self.reqparse = reqparse.RequestParser()
@@ -500,8 +692,9 @@ class RecipeListAPI(Resource):
         userName = sessionGet("userName")
         if userName is None:
             return unauthorized()
-        if not db.hasWriteAccess(userName):
-            return make_response(jsonify({"error": "no write access"}), 403)
+        limited = rateLimiter.check("addRecipe", userName)
+        if limited is not None:
+            return limited
         args = self.reqparse.parse_args()
         result = db.insertRecipe(
             userName,
@@ -522,9 +715,7 @@ class RecipeListAPI(Resource):
             )
             t.start()
             return result
-        return make_response(
-            jsonify({"error": "The recipe has not been inserted"}), 500
-        )
+        return noWriteAccess()
 
 
 class RecipeAPI(Resource):
@@ -574,8 +765,6 @@ class RecipeAPI(Resource):
         userName = sessionGet("userName")
         if userName is None:
             return unauthorized()
-        if not db.hasWriteAccess(userName):
-            return make_response(jsonify({"error": "no write access"}), 403)
         args = self.reqparse.parse_args()
         result = db.updateRecipe(
             recipeId,
@@ -589,17 +778,18 @@ class RecipeAPI(Resource):
         if result:
             return make_response("", 200)
         else:
-            return make_response(jsonify({"error": "No recipe updated"}), 404)
+            return writeRejected(
+                userName,
+                make_response(jsonify({"error": "No recipe updated"}), 404),
+            )
 
     def delete(self, recipeId: int):
         userName = sessionGet("userName")
         if userName is None:
             return unauthorized()
-        if not db.hasWriteAccess(userName):
-            return make_response(jsonify({"error": "no write access"}), 403)
-        result = db.deleteRecipe(userName, recipeId, IMAGE_FOLDER)
+        result = db.deleteRecipe(userName, recipeId)
         if result == 0:
-            return make_response("", 404)
+            return writeRejected(userName, make_response("", 404))
         return make_response("", 204)
 
 
@@ -622,20 +812,66 @@ class CategoryListAPI(Resource):
         userName = sessionGet("userName")
         if userName is None:
             return unauthorized()
-        if not db.hasWriteAccess(userName):
-            return make_response(jsonify({"error": "no write access"}), 403)
         args = self.reqparse.parse_args()
         result = db.insertCategory(userName, args["name"])
         if result is not None:
             return result
-        return make_response(jsonify({"error": "an error occurred"}), 501)
+        return noWriteAccess()
 
 
 # images
-IMAGE_FOLDER = "../images/"
-
 # guard against decompression-bomb images (PIL raises DecompressionBombError above)
 Image.MAX_IMAGE_PIXELS = 64_000_000
+# internal nginx location serving IMAGE_FOLDER (see proxy/nginx.conf), when set
+# original images are handed off with X-Accel-Redirect instead of sent by python
+IMAGE_ACCEL_PREFIX = os.environ.get("IMAGE_ACCEL_PREFIX")
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+# larger boxes are clamped, thumbnail() never scales up and every distinct box
+# is another resize and another cached variant
+IMAGE_MAX_SIZE = 2048
+
+
+def imageCaching(response, name: str, etag: str):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    if isImmutable(name):
+        response.cache_control.max_age = IMAGE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+def storeImage(file) -> str:
+    """Store an uploaded image as JPEG under the hash of the uploaded bytes."""
+    hash = hashlib.sha256()
+    fb = file.read(65536)
+    while len(fb) > 0:
+        hash.update(fb)
+        fb = file.read(65536)
+    name = hash.hexdigest() + ".jpg"
+    file.seek(0)
+    jpg = Image.open(file).convert("RGB")
+    logger.info(jpg)
+    path = storeImagePath(name)
+    try:
+        jpg.save(path, exif=jpg.getexif())
+    except (ValueError, OSError) as e:
+        logger.error(e)
+        jpg.save(path)
+    try:
+        db.addImageMeta(name, computeImageMeta(path))
+    except Exception as e:
+        # the image is usable without, `manage_images.py meta` fills it in later
+        logger.error(f"no metadata for {name}: {e}")
+    return name
+
+
+def imageCreated(name: str):
+    response = jsonify({"name": name})
+    response.status_code = 201
+    response.autocorrect_location_header = False
+    return response
 
 
 class ImageListAPI(Resource):
@@ -644,54 +880,154 @@ class ImageListAPI(Resource):
         if userName is None:
             return unauthorized()
         if not db.hasWriteAccess(userName):
-            return make_response(jsonify({"error": "no write access"}), 403)
+            return noWriteAccess()
         if "image" not in request.files:
             return make_response(jsonify({"error": "No image"}), 400)
         file = request.files["image"]
         if file:
             try:
-                hash = hashlib.sha256()
-                fb = file.read(65536)
-                while len(fb) > 0:
-                    hash.update(fb)
-                    fb = file.read(65536)
-                name = hash.hexdigest() + ".jpg"
-                jpg = Image.open(file.stream).convert("RGB")
-                logger.info(jpg)
-                try:
-                    jpg.save(IMAGE_FOLDER + name, exif=jpg.getexif())
-                except (ValueError, OSError) as e:
-                    logger.error(e)
-                    jpg.save(IMAGE_FOLDER + name)
-                response = jsonify({"name": name})
-                response.status_code = 201
-                response.autocorrect_location_header = False
-                return response
+                return imageCreated(storeImage(file.stream))
             except (IOError, Image.DecompressionBombError) as e:
                 logger.error(e)
                 return make_response(jsonify({"error": "File isn't an image"}), 400)
 
 
+def uploadError(e: UploadError):
+    return make_response(jsonify({"error": e.message}), e.status)
+
+
+class UploadListAPI(Resource):
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument(
+            "size", type=int, required=True, help="No size provided", location="json"
+        )
+
+    def post(self):
+        userName = sessionGet("userName")
+        if userName is None:
+            return unauthorized()
+        if not db.hasWriteAccess(userName):
+            return noWriteAccess()
+        args = self.reqparse.parse_args()
+        try:
+            uploadId = createUpload(userName, args["size"])
+        except UploadError as e:
+            return uploadError(e)
+        return make_response(jsonify({"id": uploadId, "offset": 0}), 201)
+
+
+class UploadAPI(Resource):
+    def get(self, uploadId: str):
+        userName = sessionGet("userName")
+        if userName is None:
+            return unauthorized()
+        try:
+            offset, size = getUpload(userName, uploadId)
+        except UploadError as e:
+            return uploadError(e)
+        response = make_response(jsonify({"offset": offset, "size": size}), 200)
+        response.headers["Upload-Offset"] = str(offset)
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    def patch(self, uploadId: str):
+        userName = sessionGet("userName")
+        if userName is None:
+            return unauthorized()
+        try:
+            offset = int(request.headers["Upload-Offset"])
+        except (KeyError, ValueError):
+            return make_response(jsonify({"error": "No Upload-Offset"}), 400)
+        try:
+            received, size = appendUpload(
+                userName, uploadId, offset, request.stream, request.content_length
+            )
+        except UploadError as e:
+            return uploadError(e)
+        if received < size:
+            response = make_response("", 204)
+            response.headers["Upload-Offset"] = str(received)
+            return response
+        try:
+            with open(partPath(uploadId), "rb") as f:
+                return imageCreated(storeImage(f))
+        except (IOError, Image.DecompressionBombError) as e:
+            logger.error(e)
+            return make_response(jsonify({"error": "File isn't an image"}), 400)
+        finally:
+            discardUpload(uploadId)
+
+    def delete(self, uploadId: str):
+        userName = sessionGet("userName")
+        if userName is None:
+            return unauthorized()
+        try:
+            removeUpload(userName, uploadId)
+        except UploadError as e:
+            return uploadError(e)
+        return make_response("", 204)
+
+
+def parseImageSize(args) -> tuple[int, int] | None:
+    """The box (w, h) to resize into, None for the original.
+
+    Raises ValueError unless both are positive integers.
+    """
+    if "w" not in args and "h" not in args:
+        return None
+    size = (int(args["w"]), int(args["h"]))
+    if min(size) <= 0:
+        raise ValueError(size)
+    return (min(size[0], IMAGE_MAX_SIZE), min(size[1], IMAGE_MAX_SIZE))
+
+
 class ImageAPI(Resource):
 
     def get(self, name: str):
+        relPath = locateImage(name)
+        if relPath is None:
+            abort(404)
         try:
-            w = int(request.args["w"])  # type: ignore
-            h = int(request.args["h"])  # type: ignore
+            size = parseImageSize(request.args)
         except (KeyError, ValueError):
-            return send_from_directory(IMAGE_FOLDER, name)
+            return make_response(
+                jsonify({"error": "w and h must be positive integers"}), 400
+            )
+        # answered before reading or resizing the image
+        etag = imageETag(name, relPath, size)
+        if request.if_none_match.contains_weak(etag):
+            return imageCaching(make_response("", 304), name, etag)
+        if size is None:
+            if IMAGE_ACCEL_PREFIX:
+                response = make_response("", 200)
+                response.headers["X-Accel-Redirect"] = IMAGE_ACCEL_PREFIX + relPath
+                response.mimetype = "image/jpeg"
+                return imageCaching(response, name, etag)
+            response = send_from_directory(IMAGE_FOLDER, relPath, etag=False)
+            return imageCaching(response, name, etag)
+        limited = rateLimiter.check("resizeImage", sessionGet("userName"))
+        if limited is not None:
+            return limited
 
         try:
-            im = Image.open(IMAGE_FOLDER + name)
-            im.thumbnail((w, h))
+            with phase("imageDecode"):
+                im = Image.open(IMAGE_FOLDER + relPath)
+                im.load()
+            with phase("imageResize"):
+                im.thumbnail(size)
             output = io.BytesIO()
-            try:
-                im.save(output, format="JPEG", exif=im.getexif())
-            except (ValueError, OSError) as e:
-                logger.error(e)
-                im.save(output, format="JPEG")
+            with phase("imageEncode"):
+                try:
+                    im.save(output, format="JPEG", exif=im.getexif())
+                except (ValueError, OSError) as e:
+                    logger.error(e)
+                    im.save(output, format="JPEG")
             output.seek(0)
-            return send_file(output, download_name="img.jpg", mimetype="image/jpeg")
+            response = send_file(
+                output, download_name="img.jpg", mimetype="image/jpeg", etag=False
+            )
+            return imageCaching(response, name, etag)
         except (IOError, Image.DecompressionBombError):
             abort(404)
 
@@ -699,20 +1035,31 @@ class ImageAPI(Resource):
         userName = sessionGet("userName")
         if userName is None:
             return unauthorized()
-        if not db.hasWriteAccess(userName):
-            return make_response(jsonify({"error": "no write access"}), 403)
-        if not os.path.exists(IMAGE_FOLDER + name):
+        writable, referenced = db.getImageDeletion(userName, name)
+        if not writable:
+            return noWriteAccess()
+        if locateImage(name) is None:
             return make_response("", 404)
-        os.remove(IMAGE_FOLDER + name)
+        # another recipe may still use the same content, the GC collects it later
+        if not referenced:
+            removeImage(name)
         return make_response(jsonify(), 200)
 
 
 api.add_resource(UserListAPI, "/users", endpoint="users")
 api.add_resource(RecipeListAPI, "/recipes", endpoint="recipes")
 api.add_resource(RecipeAPI, "/recipes/<int:recipeId>", endpoint="recipe")
+api.add_resource(
+    RecipeCoverageAPI, "/recipes/byIngredients", endpoint="recipesByIngredients"
+)
+api.add_resource(
+    RecipeCommentsAPI, "/recipes/<int:recipeId>/comments", endpoint="recipeComments"
+)
 api.add_resource(CommentListAPI, "/comments", endpoint="comments")
 api.add_resource(CommentAPI, "/comments/<int:commentId>", endpoint="comment")
 api.add_resource(CategoryListAPI, "/categories", endpoint="categories")
+api.add_resource(UploadListAPI, "/uploads", endpoint="uploads")
+api.add_resource(UploadAPI, "/uploads/<string:uploadId>", endpoint="upload")
 api.add_resource(ImageListAPI, "/images", endpoint="images")
 api.add_resource(ImageAPI, "/images/<string:name>", endpoint="image")
 
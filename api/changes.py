@@ -0,0 +1,148 @@
+"""Per-group change log of users, categories, recipes and comments.
+
+Every committed `Database` mutation appends {kind, op, id} to the redis stream
+"changes:<groupId>" (db 4, see redis_clients.py). The stream entry id is the
+change's version: versions only grow, so a client that remembers the last one it
+saw can ask for everything after it.
+
+/changes sends the log of the user's group as server-sent events, one "change"
+event per entry with the version as event id. Browsers resend the last id as
+Last-Event-ID when they reconnect, so nothing is missed across reconnects. If
+the entries after that version were already trimmed (the stream keeps roughly
+CHANGE_LOG_LENGTH entries) a "reset" event tells the client to reload instead.
+
+Waiting streams are woken in-process by `append` and re-read the stream; changes
+appended by another process are picked up with the next HEARTBEAT_SECONDS
+heartbeat at the latest.
+"""
+
+import json
+import logging
+import threading
+from collections.abc import Iterator
+from typing import Any, Literal, NamedTuple, cast
+
+import redis
+from rich.console import Console
+from rich.logging import RichHandler
+
+CHANGE_LOG_LENGTH = 1000
+# also keeps proxies from closing an idle stream
+HEARTBEAT_SECONDS = 25
+
+Op = Literal["insert", "update", "delete"]
+
+logger = logging.getLogger("recipes.changes")
+logger.handlers = [RichHandler(logging.INFO, markup=True, console=Console(width=250))]
+logger.setLevel(logging.INFO)
+
+
+class Change(NamedTuple):
+    version: str
+    kind: str
+    op: str
+    id: int
+
+
+def changeKey(groupId: int) -> str:
+    return f"changes:{groupId}"
+
+
+def parseVersion(version: str) -> tuple[int, int] | None:
+    ms, _, seq = version.partition("-")
+    if not ms.isdigit() or not (seq or "0").isdigit():
+        return None
+    return int(ms), int(seq or 0)
+
+
+def formatEvent(event: str, version: str, data: Any) -> str:
+    return f"event: {event}\nid: {version}\ndata: {json.dumps(data)}\n\n"
+
+
+class ChangeLog:
+    def __init__(self, r: redis.StrictRedis):
+        # expects a client with decode_responses=True
+        self.r = r
+        # number of changes appended per group by this process, for waking streams
+        self.appended: dict[int, int] = {}
+        self.condition = threading.Condition()
+
+    def append(self, groupId: int, kind: str, op: Op, id: int) -> str | None:
+        """Log a committed change, returns its version.
+
+        The change is already committed, so a failure only costs clients the live
+        update and is logged instead of raised.
+        """
+        try:
+            version = cast(
+                str,
+                self.r.xadd(
+                    changeKey(groupId),
+                    {"kind": kind, "op": op, "id": id},
+                    maxlen=CHANGE_LOG_LENGTH,
+                    approximate=True,
+                ),
+            )
+        except redis.RedisError as e:
+            logger.warning(f"change not logged, {groupId=} {kind=} {op=} {id=}: {e}")
+            return None
+        with self.condition:
+            self.appended[groupId] = self.appended.get(groupId, 0) + 1
+            self.condition.notify_all()
+        return version
+
+    def latest(self, groupId: int) -> str:
+        entries = cast(list, self.r.xrevrange(changeKey(groupId), count=1))
+        return entries[0][0] if entries else "0-0"
+
+    def since(self, groupId: int, version: str) -> list[Change] | None:
+        """The changes after `version`, None if some of them were already trimmed."""
+        key = changeKey(groupId)
+        after = parseVersion(version)
+        if after is None:
+            return None
+        try:
+            info = cast(dict[str, Any], self.r.xinfo_stream(key))
+        except redis.ResponseError:
+            # nothing logged for the group yet
+            return []
+        trimmed = parseVersion(str(info.get("max-deleted-entry-id") or "0-0"))
+        if trimmed is not None and after < trimmed:
+            return None
+        entries = cast(list, self.r.xrange(key, min=f"({after[0]}-{after[1]}"))
+        return [
+            Change(entryId, fields["kind"], fields["op"], int(fields["id"]))
+            for entryId, fields in entries
+        ]
+
+    def wait(self, groupId: int, seen: int, timeout: float) -> int:
+        """Block until this process appended to the group after `seen`, or timeout."""
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.appended.get(groupId, 0) != seen, timeout
+            )
+            return self.appended.get(groupId, 0)
+
+    def stream(self, groupId: int, version: str | None) -> Iterator[str]:
+        """Server-sent events of the group's changes after `version`.
+
+        Without a version the stream starts at the current end of the log, its
+        first event ("ready") carries that version.
+        """
+        seen = self.appended.get(groupId, 0)
+        if version is None:
+            version = self.latest(groupId)
+            yield formatEvent("ready", version, {"version": version})
+        while True:
+            changes = self.since(groupId, version)
+            if changes is None:
+                version = self.latest(groupId)
+                yield formatEvent("reset", version, {"version": version})
+                changes = []
+            for change in changes:
+                version = change.version
+                yield formatEvent("change", version, change._asdict())
+            appended = self.wait(groupId, seen, HEARTBEAT_SECONDS)
+            if appended == seen:
+                yield ": heartbeat\n\n"
+            seen = appended
@@ -0,0 +1,69 @@
+"""Metadata of stored images, embedded in recipe responses.
+
+Clients know an image's size, dominant colour and a tiny blurred preview
+before loading it, so the recipe grid can lay out and paint immediately and
+only fetch the thumbnails scrolled into view. Computed when an image is stored
+(see `storeImage` in app.py) and by `manage_images.py meta` for older files,
+kept in the `image` table (see migrations.py).
+"""
+
+import base64
+import io
+import os
+from typing import TypedDict, cast
+
+from PIL import Image, ImageOps
+
+# longest side of the preview, it is scaled up and blurred by the client
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+
+ORIENTATION_TAG = 0x0112
+# orientations that turn the image by 90 degrees
+ROTATED = {5, 6, 7, 8}
+
+
+class ImageMeta(TypedDict):
+    width: int
+    height: int
+    bytes: int
+    color: str
+    placeholder: str
+
+
+def dominantColor(im: Image.Image) -> str:
+    """Most common colour after reducing the image to a small palette, as #rrggbb."""
+    small = im.convert("RGB").resize((64, 64)).quantize(8)
+    palette = small.getpalette() or []
+    colors = small.getcolors() or [(1, 0)]
+    # a palette image reports palette indexes
+    index = cast(int, max(colors)[1])
+    r, g, b = palette[index * 3 : index * 3 + 3]
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def placeholder(im: Image.Image) -> str:
+    """A tiny JPEG of the image as data URI."""
+    preview = im.convert("RGB")
+    preview.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    output = io.BytesIO()
+    preview.save(output, format="JPEG", quality=PLACEHOLDER_QUALITY, optimize=True)
+    return "data:image/jpeg;base64," + base64.b64encode(output.getvalue()).decode()
+
+
+def computeImageMeta(path: str) -> ImageMeta:
+    """Metadata of the stored JPEG at `path`, sizes as displayed (EXIF rotation applied)."""
+    with Image.open(path) as im:
+        width, height = im.size
+        if im.getexif().get(ORIENTATION_TAG) in ROTATED:
+            width, height = height, width
+        # decode at a fraction of the resolution, only a few pixels are needed
+        im.draft("RGB", (128, 128))
+        preview = ImageOps.exif_transpose(im)
+        return {
+            "width": width,
+            "height": height,
+            "bytes": os.path.getsize(path),
+            "color": dominantColor(preview),
+            "placeholder": placeholder(preview),
+        }
@@ -0,0 +1,156 @@
+"""Content-addressed image store, sharded by hash prefix.
+
+Uploaded images are named "<sha256>.jpg" and stored as
+IMAGE_FOLDER/<first two hex chars>/<name>, so no single directory grows to tens
+of thousands of entries. Files that still sit flat in IMAGE_FOLDER (from before
+the sharded layout) are found through a fallback lookup until
+`manage_images.py migrate` has moved them.
+"""
+
+import logging
+import os
+import re
+import time
+from typing import Iterable, Iterator
+
+from rich.console import Console
+from rich.logging import RichHandler
+
+IMAGE_FOLDER = "../images/"
+
+IMAGE_NAME_RE = re.compile(r"[0-9a-f]{64}\.jpg")
+
+# part of the ETag of resized images, bump it when the resize output changes
+RESIZE_VERSION = 1
+
+# uploads are only referenced by a recipe once the recipe is saved, so fresh
+# unreferenced files are left alone by the garbage collector for this long
+GC_GRACE_SECONDS = 24 * 60 * 60
+
+logger = logging.getLogger("recipes.images")
+logger.handlers = [RichHandler(logging.INFO, markup=True, console=Console(width=250))]
+logger.setLevel(logging.INFO)
+
+
+def shardPath(name: str) -> str:
+    """Relative path of `name` inside IMAGE_FOLDER in the sharded layout."""
+    if IMAGE_NAME_RE.fullmatch(name):
+        return f"{name[:2]}/{name}"
+    return name
+
+
+def locateImage(name: str) -> str | None:
+    """Relative path of an existing image, checking the sharded then the flat layout."""
+    if "/" in name or name.startswith("."):
+        return None
+    for relPath in (shardPath(name), name):
+        if os.path.isfile(IMAGE_FOLDER + relPath):
+            return relPath
+    return None
+
+
+def imageETag(name: str, relPath: str, size: tuple[int, int] | None = None) -> str:
+    """Strong ETag of an image or of a resized variant of it.
+
+    Uploads are named after the hash of their content, so the name is the tag.
+    Other files fall back to modification time and file size.
+    """
+    if IMAGE_NAME_RE.fullmatch(name):
+        tag = name[: -len(".jpg")]
+    else:
+        stat = os.stat(IMAGE_FOLDER + relPath)
+        tag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    if size is not None:
+        tag += f"-{size[0]}x{size[1]}-r{RESIZE_VERSION}"
+    return tag
+
+
+def isImmutable(name: str) -> bool:
+    """Whether the content behind `name` can never change."""
+    return IMAGE_NAME_RE.fullmatch(name) is not None
+
+
+def storeImagePath(name: str) -> str:
+    """Path a new image should be written to, creating its shard directory."""
+    relPath = shardPath(name)
+    os.makedirs(os.path.dirname(IMAGE_FOLDER + relPath), exist_ok=True)
+    return IMAGE_FOLDER + relPath
+
+
+def removeImage(name: str) -> int:
+    """Delete an image from the store, returning the number of bytes freed."""
+    relPath = locateImage(name)
+    if relPath is None:
+        return 0
+    path = IMAGE_FOLDER + relPath
+    size = os.path.getsize(path)
+    os.remove(path)
+    return size
+
+
+def iterImages() -> Iterator[tuple[str, str]]:
+    """Yield (name, relative path) for every image in the store, sharded or flat.
+
+    Anything not named like an uploaded image (the backup repo's .git folder,
+    backup.sql, ...) is ignored.
+    """
+    with os.scandir(IMAGE_FOLDER) as top:
+        for entry in top:
+            if entry.is_file() and IMAGE_NAME_RE.fullmatch(entry.name):
+                yield entry.name, entry.name
+            elif entry.is_dir() and re.fullmatch(r"[0-9a-f]{2}", entry.name):
+                with os.scandir(entry.path) as shard:
+                    for image in shard:
+                        if image.is_file() and IMAGE_NAME_RE.fullmatch(image.name):
+                            yield image.name, f"{entry.name}/{image.name}"
+
+
+def migrateToShards(dryRun: bool = False) -> int:
+    """Move flat images into their shard directory. Returns the number moved."""
+    moved = 0
+    for name, relPath in list(iterImages()):
+        if relPath != name:
+            continue
+        target = IMAGE_FOLDER + shardPath(name)
+        if os.path.exists(target):
+            # same name means same content, the flat copy is redundant
+            logger.info(f"duplicate {name}, removing flat copy")
+            if not dryRun:
+                os.remove(IMAGE_FOLDER + name)
+            continue
+        if not dryRun:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.rename(IMAGE_FOLDER + name, target)
+        moved += 1
+    return moved
+
+
+def collectGarbage(
+    referenced: Iterable[str],
+    dryRun: bool = False,
+    graceSeconds: int = GC_GRACE_SECONDS,
+) -> tuple[int, int]:
+    """Mark-and-sweep: remove images no recipe references.
+
+    `referenced` is the mark set (every `recipe.image` value and the images of
+    shared recipes, see manage_images.py). Files younger
+    than `graceSeconds` are kept because they may belong to a recipe that is
+    still being edited. Returns (files removed, bytes reclaimed).
+    """
+    marked = set(referenced)
+    cutoff = time.time() - graceSeconds
+    removed = 0
+    reclaimed = 0
+    for name, relPath in list(iterImages()):
+        if name in marked:
+            continue
+        path = IMAGE_FOLDER + relPath
+        stat = os.stat(path)
+        if stat.st_mtime > cutoff:
+            continue
+        logger.info(f"unreferenced {relPath} ({stat.st_size} bytes)")
+        if not dryRun:
+            os.remove(path)
+        removed += 1
+        reclaimed += stat.st_size
+    return removed, reclaimed
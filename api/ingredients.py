@@ -0,0 +1,136 @@
+"""Parsing of a recipe's free-text ingredients into normalised names.
+
+The ingredients of a recipe are stored as one text, one ingredient per line,
+optionally prefixed with "- "; lines ending with ":" are section headings (see
+the client's Ingredients.tsx). Every other line is split into a leading quantity,
+a known unit and the ingredient name, e.g. "1 1/2 EL Olivenöl, kalt gepresst"
+-> (1.5, "el", "olivenöl").
+
+Names are normalised by lowercasing, dropping parentheses and everything after
+the first comma (preparation notes) and collapsing whitespace. Search terms go
+through `normaliseName` too, so both sides compare equal.
+The parsed rows are stored in `recipe_ingredient` (see migrations.py).
+"""
+
+import re
+from typing import NamedTuple
+
+NAME_LENGTH = 100
+UNIT_LENGTH = 20
+
+UNITS = {
+    # metric
+    "mg",
+    "g",
+    "gr",
+    "kg",
+    "ml",
+    "cl",
+    "dl",
+    "l",
+    # german kitchen units
+    "el",
+    "tl",
+    "msp",
+    "prise",
+    "prisen",
+    "stk",
+    "stück",
+    "pck",
+    "pkg",
+    "packung",
+    "packungen",
+    "päckchen",
+    "dose",
+    "dosen",
+    "becher",
+    "bund",
+    "zehe",
+    "zehen",
+    "scheibe",
+    "scheiben",
+    "tasse",
+    "tassen",
+    "handvoll",
+    "schuss",
+    "glas",
+    "gläser",
+    # english kitchen units
+    "tbsp",
+    "tsp",
+    "cup",
+    "cups",
+    "oz",
+    "lb",
+    "lbs",
+    "pinch",
+    "can",
+    "cans",
+    "clove",
+    "cloves",
+    "slice",
+    "slices",
+}
+
+FRACTIONS = {"½": 0.5, "⅓": 1 / 3, "⅔": 2 / 3, "¼": 0.25, "¾": 0.75, "⅛": 0.125}
+
+NUMBER = r"\d+/\d+|\d+(?:[.,]\d+)?|[½⅓⅔¼¾⅛]"
+# "2", "1,5", "1 1/2", "1½", "2-3" (a range counts with its upper bound)
+QUANTITY_RE = re.compile(
+    rf"^((?:{NUMBER})(?:\s*(?:{NUMBER}))?)(?:\s*[-–]\s*((?:{NUMBER})))?\s*"
+)
+
+
+class Ingredient(NamedTuple):
+    name: str
+    quantity: float | None
+    unit: str | None
+
+
+def parseNumber(text: str) -> float:
+    total = 0.0
+    for part in re.findall(NUMBER, text):
+        if part in FRACTIONS:
+            total += FRACTIONS[part]
+        elif "/" in part:
+            numerator, denominator = part.split("/")
+            total += int(numerator) / int(denominator) if int(denominator) else 0
+        else:
+            total += float(part.replace(",", "."))
+    return total
+
+
+def normaliseName(text: str) -> str:
+    text = re.sub(r"\([^)]*\)", " ", text.lower()).split(",")[0]
+    text = re.sub(r"[^\w\s&'-]", " ", text)
+    return " ".join(text.split())[:NAME_LENGTH]
+
+
+def parseLine(line: str) -> Ingredient | None:
+    line = re.sub(r"^\s*[-*•]\s+", "", line).strip()
+    if not line or line.endswith(":"):
+        return None
+    quantity = None
+    match = QUANTITY_RE.match(line)
+    if match:
+        quantity = parseNumber(match.group(2) or match.group(1))
+        line = line[match.end() :]
+    unit = None
+    first, _, rest = line.partition(" ")
+    if rest and first.lower().rstrip(".") in UNITS:
+        unit = first.lower().rstrip(".")[:UNIT_LENGTH]
+        line = rest
+    name = normaliseName(line)
+    if not name:
+        return None
+    return Ingredient(name, quantity, unit)
+
+
+def parseIngredients(text: str) -> list[Ingredient]:
+    """The ingredients of a recipe in order, headings and empty lines skipped."""
+    ingredients = []
+    for line in text.replace("\r", "").split("\n"):
+        ingredient = parseLine(line)
+        if ingredient is not None:
+            ingredients.append(ingredient)
+    return ingredients
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Maintenance for the image store (see image_store.py).
+
+    docker compose exec api python manage_images.py migrate [--dry-run]
+
+moves images still lying flat in the image folder into their hash-prefix shard.
+Safe to run repeatedly and while the api is serving, lookups fall back to the
+flat layout for files that have not been moved yet.
+
+    docker compose exec api python manage_images.py gc [--dry-run]
+
+removes images that no recipe and no shared recipe (see unique_recipes.py)
+references anymore (abandoned uploads, images replaced in the editor) and
+reports the reclaimed bytes. Uploads younger than a
+day are kept since their recipe may not have been saved yet. Run it e.g. right
+before backup.sh so the backup repo does not keep growing.
+
+    docker compose exec api python manage_images.py meta [--dry-run]
+
+computes the metadata (size, dominant colour, placeholder, see image_meta.py) of
+every image that has none yet and drops the metadata of removed files. New
+uploads get theirs when they are stored, so this backfills older images and can
+be interrupted and rerun.
+"""
+
+import argparse
+
+from image_meta import computeImageMeta
+from image_store import IMAGE_FOLDER, collectGarbage, iterImages, migrateToShards
+from redis_clients import UNIQUE_RECIPES_DB, redisClient
+from unique_recipes import sharedRecipeImages
+from util import Database
+
+
+def backfillMeta(dryRun: bool) -> tuple[int, int]:
+    """Add missing image metadata, returns (images added, stale rows removed)."""
+    db = Database()
+    known = db.getImageMetaNames()
+    added = 0
+    stored = set()
+    for name, relPath in iterImages():
+        stored.add(name)
+        if name in known:
+            continue
+        try:
+            meta = computeImageMeta(IMAGE_FOLDER + relPath)
+        except OSError as e:
+            print(f"skipping {name}: {e}")
+            continue
+        if not dryRun:
+            db.addImageMeta(name, meta)
+        added += 1
+    stale = known - stored
+    if stale and not dryRun:
+        db.deleteImageMeta(stale)
+    return added, len(stale)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Image store maintenance")
+    parser.add_argument("command", choices=["migrate", "gc", "meta"])
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only report, change nothing"
+    )
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        moved = migrateToShards(dryRun=args.dry_run)
+        print(f"done, moved {moved} image(s) into shards")
+    elif args.command == "meta":
+        added, removed = backfillMeta(dryRun=args.dry_run)
+        print(f"done, added metadata of {added} image(s), removed {removed} stale")
+    else:
+        # a shared recipe keeps its image after the recipe itself was deleted
+        referenced = Database().getReferencedImages()
+        referenced |= sharedRecipeImages(redisClient(UNIQUE_RECIPES_DB))
+        removed, reclaimed = collectGarbage(referenced, dryRun=args.dry_run)
+        print(
+            f"done, removed {removed} unreferenced image(s), "
+            f"reclaimed {reclaimed / 1024 / 1024:.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
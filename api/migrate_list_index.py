@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""One-time migration: move "lists:<user>" redis lists into the list index.
+
+The lists a user has opened used to be a redis list of JSON strings (db 2). They
+now live in the "listNames:<user>" hash and "listActivity:<user>" sorted set
+(see ShoppingListIndex in shopping_list.py). The api converts a user's legacy
+key on first access anyway; this script does it for everyone up front, e.g.:
+
+    docker compose exec api python migrate_list_index.py [--dry-run]
+
+Runs in batches and resumes after an interruption, see redis_migration.py.
+Safe to run repeatedly: legacy keys are deleted once converted.
+"""
+
+from typing import Any
+
+from redis.client import Pipeline
+
+from redis_clients import SHOPPING_LISTS_DB
+from redis_migration import KeyMigration, migrationMain
+from shopping_list import legacyListsKey, queueLegacyMigration
+
+
+class ListIndexMigration(KeyMigration):
+    name = "list-index"
+    db = SHOPPING_LISTS_DB
+    match = legacyListsKey("*")
+    keyType = "list"
+
+    def read(self, pipe: Pipeline, key: str):
+        pipe.lrange(key, 0, -1)
+
+    def write(self, pipe: Pipeline, key: str, values: list[Any]):
+        (raw,) = values
+        if raw:
+            queueLegacyMigration(pipe, key[len(legacyListsKey("")) :], raw)
+
+    def migrated(self, key: str, results: list[Any]) -> bool:
+        # the legacy key is deleted last, 0 if the api converted it meanwhile
+        return results[-1] == 1
+
+
+if __name__ == "__main__":
+    migrationMain(ListIndexMigration(), "Move lists:<user> into the list index")
@@ -10,39 +10,52 @@ finds them again.
 Safe to run repeatedly: already-prefixed keys and non-UUID / non-hash keys are
 skipped. Run once after deploying the fix, e.g.:
 
-    docker compose exec api python migrate_shopping_lists.py
+    docker compose exec api python migrate_shopping_lists.py [--dry-run]
+
+Runs in batches and resumes after an interruption, see redis_migration.py.
 
 If skipped, shared lists simply start empty and repopulate as items are re-added.
 """
 
 import re
+from typing import Any
+
+from redis.client import Pipeline
 
-import redis
+from redis_clients import SHOPPING_LISTS_DB
+from redis_migration import KeyMigration, migrationMain
 
 SHOPPING_LIST_ID_RE = re.compile(
     r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE
 )
 
 
-def main() -> None:
-    r = redis.StrictRedis(host="redis", port=6379, db=2, decode_responses=True)
+class SharedListMigration(KeyMigration):
+    name = "shared-lists"
+    db = SHOPPING_LISTS_DB
+    # narrows the scan on the server, the regex is exact
+    match = "????????-????-????-????-????????????"
+    keyType = "hash"
+
+    def select(self, key: str) -> bool:
+        return SHOPPING_LIST_ID_RE.fullmatch(key) is not None
+
+    def read(self, pipe: Pipeline, key: str):
+        pipe.exists(f"shared:{key}")
 
-    migrated = 0
-    for key in r.scan_iter():
-        if not SHOPPING_LIST_ID_RE.fullmatch(key):
-            continue
-        if r.type(key) != "hash":
-            continue
-        target = f"shared:{key}"
-        if r.exists(target):
-            print(f"skip {key}: {target} already exists")
-            continue
-        r.rename(key, target)
-        migrated += 1
-        print(f"renamed {key} -> {target}")
+    def write(self, pipe: Pipeline, key: str, values: list[Any]):
+        if values[0]:
+            print(f"skip {key}: shared:{key} already exists")
+            return
+        # NX in case the list was shared again since the read
+        pipe.renamenx(key, f"shared:{key}")
 
-    print(f"done, migrated {migrated} shared list(s)")
+    def migrated(self, key: str, results: list[Any]) -> bool:
+        (renamed,) = results
+        if not renamed:
+            print(f"skip {key}: shared:{key} was created meanwhile")
+        return bool(renamed)
 
 
 if __name__ == "__main__":
-    main()
+    migrationMain(SharedListMigration(), "Move shared shopping lists to shared:<uuid>")
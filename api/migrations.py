@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""Schema migrations, tracked in the single-row `version` table.
+
+Every migration is a function registered under the schema version it leads to.
+On startup (see start.sh) all migrations above the stored version run in order
+and the version is bumped after each one, so an interrupted run resumes where it
+stopped. MariaDB commits DDL implicitly, so migrations check the current schema
+before altering it and are safe to run twice.
+
+    docker compose exec api python migrations.py
+"""
+
+import time
+
+from ingredients import NAME_LENGTH, UNIT_LENGTH, parseIngredients
+from util import Database, logger
+
+BACKFILL_BATCH = 1000
+
+
+def columnExists(cur, table: str, column: str) -> bool:
+    cur.execute(
+        "SELECT COUNT(*) as c FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s;",
+        [table, column],
+    )
+    return cur.fetchone()["c"] > 0
+
+
+def indexExists(cur, table: str, index: str) -> bool:
+    cur.execute(
+        "SELECT COUNT(*) as c FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s;",
+        [table, index],
+    )
+    return cur.fetchone()["c"] > 0
+
+
+def backfillInBatches(conn, query: str, table: str):
+    """Run `query` (filtering `id >= %s AND id < %s`) in one short transaction per batch."""
+    cur = conn.cursor()
+    cur.execute(f"SELECT COALESCE(MAX(`id`), 0) as m FROM `{table}`;")
+    maxId = cur.fetchone()["m"]
+    start = 0
+    while start <= maxId:
+        cur.execute(query, [start, start + BACKFILL_BATCH])
+        conn.commit()
+        start += BACKFILL_BATCH
+        # give concurrent writers a chance to take the row locks
+        time.sleep(0.01)
+
+
+def denormaliseGroupId(conn):
+    """Store the author's groupId on recipe, comment and category.
+
+    Every list query used to join through `user` to filter by group. With the
+    column and its (groupId, id) / (groupId, editedDate) indexes the group's
+    rows are read straight from the index. The app sets the column on insert;
+    when moving a user to another group, update the groupId of their rows too.
+    """
+    cur = conn.cursor()
+    for table in ("recipe", "comment", "category"):
+        if not columnExists(cur, table, "groupId"):
+            # adding a nullable column at the end is instant, no table copy
+            cur.execute(
+                f"ALTER TABLE `{table}` ADD COLUMN `groupId` int(11) NULL DEFAULT NULL, "
+                "ALGORITHM=INSTANT;"
+            )
+        backfillInBatches(
+            conn,
+            f"UPDATE `{table}` JOIN `user` ON `{table}`.`userId` = `user`.`id` "
+            f"SET `{table}`.`groupId` = `user`.`groupId` "
+            f"WHERE `{table}`.`id` >= %s AND `{table}`.`id` < %s "
+            f"AND `{table}`.`groupId` IS NULL;",
+            table,
+        )
+        indexes = {"group_id": "`groupId`, `id`"}
+        if table != "category":
+            indexes["group_edited"] = "`groupId`, `editedDate`"
+        for name, columns in indexes.items():
+            if not indexExists(cur, table, name):
+                cur.execute(
+                    f"ALTER TABLE `{table}` ADD INDEX `{name}` ({columns}), "
+                    "ALGORITHM=INPLACE, LOCK=NONE;"
+                )
+
+
+def indexIngredients(conn):
+    """Parse every recipe's ingredients into the `recipe_ingredient` side table.
+
+    Rows are keyed by (recipeId, position) and indexed by (groupId, name), so
+    the recipes of a group using an ingredient are found without reading the
+    ingredient texts. `Database` keeps the table current on insert and update,
+    deleting a recipe cascades. The groupId is denormalised like in
+    `denormaliseGroupId`, update it too when moving a user to another group.
+    """
+    cur = conn.cursor()
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS `recipe_ingredient` ("
+        "`recipeId` int(11) NOT NULL, "
+        "`position` int(11) NOT NULL, "
+        "`groupId` int(11) NOT NULL, "
+        f"`name` varchar({NAME_LENGTH}) NOT NULL, "
+        "`quantity` double NULL DEFAULT NULL, "
+        f"`unit` varchar({UNIT_LENGTH}) NULL DEFAULT NULL, "
+        "PRIMARY KEY (`recipeId`, `position`), "
+        "KEY `group_name` (`groupId`, `name`, `recipeId`), "
+        "CONSTRAINT `recipe_ingredient_ibfk_1` FOREIGN KEY (`recipeId`) "
+        "REFERENCES `recipe` (`id`) ON DELETE CASCADE"
+        ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;"
+    )
+    cur.execute("SELECT COALESCE(MAX(`id`), 0) as m FROM `recipe`;")
+    maxId = cur.fetchone()["m"]
+    start = 0
+    while start <= maxId:
+        end = start + BACKFILL_BATCH
+        cur.execute(
+            "SELECT `id`, `groupId`, `ingredients` FROM `recipe` "
+            "WHERE `id` >= %s AND `id` < %s;",
+            [start, end],
+        )
+        rows = [
+            (res["id"], position, res["groupId"], *ingredient)
+            for res in cur.fetchall()
+            for position, ingredient in enumerate(
+                parseIngredients(res["ingredients"]), 1
+            )
+        ]
+        # rerunning a batch replaces its rows
+        cur.execute(
+            "DELETE FROM `recipe_ingredient` WHERE `recipeId` >= %s AND `recipeId` < %s;",
+            [start, end],
+        )
+        if rows:
+            cur.executemany(
+                "INSERT INTO `recipe_ingredient` "
+                "(`recipeId`, `position`, `groupId`, `name`, `quantity`, `unit`) "
+                "VALUES (%s, %s, %s, %s, %s, %s);",
+                rows,
+            )
+        conn.commit()
+        start = end
+        time.sleep(0.01)
+
+
+def addImageMeta(conn):
+    """Table of image metadata, embedded as imageMeta in recipe responses.
+
+    Filled on upload, `manage_images.py meta` backfills existing images (that
+    decodes every file, so it is not done here on startup).
+    """
+    conn.cursor().execute(
+        "CREATE TABLE IF NOT EXISTS `image` ("
+        "`name` varchar(100) NOT NULL, "
+        "`width` int(11) NOT NULL, "
+        "`height` int(11) NOT NULL, "
+        "`bytes` int(11) NOT NULL, "
+        "`color` char(7) NOT NULL, "
+        "`placeholder` varchar(2048) NOT NULL, "
+        "PRIMARY KEY (`name`)"
+        ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;"
+    )
+
+
+def renameColonUsers(conn):
+    """Replace ':' in existing usernames, registration rejects it now.
+
+    A private shopping list is keyed by the bare username in the redis db that
+    also holds "archive:<key>", "listNames:<user>" and the other namespaced
+    keys, a user named e.g. "archive:alice" would address alice's archive. Such
+    users could never log in (Basic auth splits at the first ':'), so no redis
+    data is keyed by their names. The new names are logged to tell the users.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT `id`, `user` FROM `user` WHERE `user` LIKE '%:%';")
+    for res in cur.fetchall():
+        base = res["user"].replace(":", "_")
+        name, suffix = base, 1
+        while True:
+            cur.execute("SELECT COUNT(*) as c FROM `user` WHERE `user` = %s;", [name])
+            if cur.fetchone()["c"] == 0:
+                break
+            suffix += 1
+            name = f"{base}_{suffix}"
+        cur.execute("UPDATE `user` SET `user` = %s WHERE `id` = %s;", [name, res["id"]])
+        logger.info(f"renamed user {res['id']} from {res['user']!r} to {name!r}")
+    conn.commit()
+
+
+MIGRATIONS = {
+    1: denormaliseGroupId,
+    2: indexIngredients,
+    3: addImageMeta,
+    4: renameColonUsers,
+}
+
+
+def currentVersion(cur) -> int:
+    cur.execute("SELECT MAX(`v`) as v FROM `version`;")
+    res = cur.fetchone()
+    return res["v"] if res is not None and res["v"] is not None else 0
+
+
+def setVersion(conn, version: int):
+    cur = conn.cursor()
+    cur.execute("DELETE FROM `version`;")
+    cur.execute("INSERT INTO `version` (`v`) VALUES (%s);", [version])
+    conn.commit()
+
+
+def migrate(conn) -> int:
+    """Apply all pending migrations, returns the resulting schema version."""
+    version = currentVersion(conn.cursor())
+    for target in sorted(MIGRATIONS):
+        if target <= version:
+            continue
+        logger.info(f"migrating schema {version} -> {target}")
+        MIGRATIONS[target](conn)
+        setVersion(conn, target)
+        version = target
+    return version
+
+
+def main() -> None:
+    conn, _, _ = Database().connect()
+    try:
+        version = migrate(conn)
+        print(f"schema at version {version}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Statement profiling for every query `Database` runs.
+
+ProfiledCursor (used for all connections) records per statement fingerprint
+(the query template with whitespace and IN lists collapsed) how often it ran,
+its total and max duration, the rows it returned and which `Database` methods
+issued it. The slowest individual executions are kept in a rolling top-N.
+Executions slower than SLOW_QUERY_MS are logged, and the first slow execution
+of every SELECT fingerprint is EXPLAINed so the plan shows up next to it.
+
+Query arguments are never stored, they can contain password hashes.
+The report is served at /admin/queries.
+"""
+
+import heapq
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import pymysql
+from rich.console import Console
+from rich.logging import RichHandler
+
+from timing import phase
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))
+TOP_N = 20
+
+logger = logging.getLogger("recipes.queries")
+logger.handlers = [RichHandler(logging.INFO, markup=True, console=Console(width=250))]
+logger.setLevel(logging.INFO)
+
+
+def fingerprint(query: str) -> str:
+    query = re.sub(r"\s+", " ", query).strip().rstrip(";")
+    return re.sub(r"IN \((?:%s, )*%s\)", "IN (...)", query)
+
+
+def callingMethod() -> str:
+    """Name of the Database method that issued the current statement."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename.endswith("util.py") and code.co_name != "execute":
+            return code.co_name
+        frame = frame.f_back
+    return "?"
+
+
+class StatementStats:
+    def __init__(self):
+        self.count = 0
+        self.totalMs = 0.0
+        self.maxMs = 0.0
+        self.rows = 0
+        self.methods: set[str] = set()
+        self.explain: list | None = None
+
+
+class QueryProfiler:
+    def __init__(self):
+        self.statements: dict[str, StatementStats] = {}
+        # min-heap of (duration ms, sequence, entry), so the fastest is dropped first
+        self.slowest: list[tuple[float, int, dict]] = []
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def record(self, query: str, durationMs: float, rows: int) -> bool:
+        """Account one execution, returns whether it should be EXPLAINed."""
+        key = fingerprint(query)
+        method = callingMethod()
+        with self.lock:
+            stats = self.statements.setdefault(key, StatementStats())
+            stats.count += 1
+            stats.totalMs += durationMs
+            stats.maxMs = max(stats.maxMs, durationMs)
+            stats.rows += rows
+            stats.methods.add(method)
+            self.sequence += 1
+            entry = {
+                "statement": key,
+                "method": method,
+                "ms": round(durationMs, 2),
+                "rows": rows,
+                "at": time.time(),
+            }
+            if len(self.slowest) < TOP_N:
+                heapq.heappush(self.slowest, (durationMs, self.sequence, entry))
+            elif durationMs > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (durationMs, self.sequence, entry))
+        if durationMs < SLOW_QUERY_MS:
+            return False
+        logger.info(f"slow query ({durationMs:.0f} ms, {rows} rows, {method}): {key}")
+        return stats.explain is None and key.upper().startswith("SELECT")
+
+    def setExplain(self, query: str, plan: list):
+        stats = self.statements.get(fingerprint(query))
+        if stats is not None:
+            stats.explain = plan
+            logger.info(f"plan of {fingerprint(query)}: {plan}")
+
+    def report(self) -> dict:
+        with self.lock:
+            statements = sorted(
+                self.statements.items(), key=lambda item: item[1].totalMs, reverse=True
+            )
+            return {
+                "slowest": [
+                    entry for _, _, entry in sorted(self.slowest, reverse=True)
+                ],
+                "statements": [
+                    {
+                        "statement": key,
+                        "count": stats.count,
+                        "totalMs": round(stats.totalMs, 2),
+                        "avgMs": round(stats.totalMs / stats.count, 2),
+                        "maxMs": round(stats.maxMs, 2),
+                        "rows": stats.rows,
+                        "methods": sorted(stats.methods),
+                        "explain": stats.explain,
+                    }
+                    for key, stats in statements
+                ],
+            }
+
+
+profiler = QueryProfiler()
+
+
+class ProfiledCursor(pymysql.cursors.DictCursor):
+    def execute(self, query, args=None):
+        start = time.perf_counter()
+        with phase("sql"):
+            result = super().execute(query, args)
+        durationMs = (time.perf_counter() - start) * 1000
+        if profiler.record(query, durationMs, self.rowcount):
+            self.explain(query, args)
+        return result
+
+    def explain(self, query, args):
+        assert self.connection is not None
+        try:
+            # a separate cursor, this one still holds the statement's rows
+            with self.connection.cursor(pymysql.cursors.DictCursor) as cur:
+                cur.execute("EXPLAIN " + query, args)
+                profiler.setExplain(query, list(cur.fetchall()))
+        except pymysql.MySQLError as e:
+            logger.info(f"EXPLAIN failed: {e}")
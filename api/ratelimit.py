@@ -0,0 +1,171 @@
+"""Token-bucket admission control for expensive endpoints, stored in redis.
+
+Each limited route has a bucket per client IP and, where known, per user. A
+bucket holds up to `burst` tokens and refills `burst` tokens per `period`
+seconds; every request takes one. An empty bucket answers 429 with a
+Retry-After header instead of reaching the (single) worker's expensive path.
+
+Limits are configured per route in DEFAULT_LIMITS and can be overridden with an
+env variable RATE_LIMIT_<ROUTE>="<burst>/<period seconds>", e.g.
+RATE_LIMIT_LOGIN="10/60". "0/0" disables a route's limit. Invalid values stop
+the api at startup.
+
+Clients are identified by X-Forwarded-For. Every proxy appends the address it
+received the request from, so with TRUSTED_PROXY_HOPS proxies in front of the
+api (our nginx and, in production, the system proxy in front of it) the client
+is the TRUSTED_PROXY_HOPS-th entry from the right. Entries further left are
+whatever the client sent and can not be trusted.
+
+Allowed/rejected counters per route are kept in the "ratelimit:stats" hash.
+If redis is unreachable requests are let through.
+"""
+
+import math
+import os
+import time
+from functools import wraps
+from typing import Callable, NamedTuple
+
+import redis
+from flask import jsonify, make_response, request
+
+STATS_KEY = "ratelimit:stats"
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 1))
+
+
+class Limit(NamedTuple):
+    burst: int
+    period: float
+
+
+DEFAULT_LIMITS = {
+    # PBKDF2 verification
+    "login": Limit(10, 60),
+    # PBKDF2 hashing
+    "register": Limit(5, 60 * 60),
+    # web-push fan-out to the whole group
+    "addRecipe": Limit(30, 60 * 60),
+    # decode, resize and re-encode of an image
+    "resizeImage": Limit(300, 60),
+}
+
+# KEYS[1] stats hash, KEYS[2..] buckets; ARGV burst, refill per ms, now (ms), route
+# a token is only taken if every bucket has one; returns ms until that is the case
+TOKEN_BUCKET_SCRIPT = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local levels = {}
+local wait = 0
+for i = 2, #KEYS do
+    local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    if tokens < 1 then
+        wait = math.max(wait, math.ceil((1 - tokens) / rate))
+    end
+    levels[i] = tokens
+end
+if wait == 0 then
+    redis.call('HINCRBY', KEYS[1], ARGV[4] .. ':allowed', 1)
+else
+    redis.call('HINCRBY', KEYS[1], ARGV[4] .. ':rejected', 1)
+end
+for i = 2, #KEYS do
+    local tokens = levels[i]
+    if wait == 0 then
+        tokens = tokens - 1
+    end
+    redis.call('HSET', KEYS[i], 'tokens', tostring(tokens), 'ts', now)
+    redis.call('PEXPIRE', KEYS[i], math.ceil((burst - tokens) / rate) + 1000)
+end
+return wait
+"""
+
+
+def parseLimit(value: str) -> Limit:
+    """Parse "<burst>/<period seconds>", raises ValueError for invalid limits."""
+    try:
+        burst, period = value.split("/")
+        limit = Limit(int(burst), float(period))
+    except ValueError:
+        raise ValueError(
+            f"expected '<burst>/<period seconds>', got {value!r}"
+        ) from None
+    if limit.burst < 0 or (limit.burst > 0 and not limit.period > 0):
+        raise ValueError(
+            f"burst must be >= 0 and period > 0 (or '0/0' to disable), got {value!r}"
+        )
+    return limit
+
+
+def clientIp(hops: int = TRUSTED_PROXY_HOPS) -> str:
+    """The client's address, as seen by the outermost of `hops` trusted proxies."""
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded and hops > 0:
+        entries = [entry.strip() for entry in forwarded.split(",")]
+        # fewer entries than proxies: the request skipped an outer proxy
+        return entries[-min(hops, len(entries))]
+    return request.remote_addr or "unknown"
+
+
+class RateLimiter:
+    def __init__(self, r: redis.StrictRedis, logger):
+        self.r = r
+        self.logger = logger
+        self.script = r.register_script(TOKEN_BUCKET_SCRIPT)
+        self.limits = dict(DEFAULT_LIMITS)
+        for route in self.limits:
+            override = os.environ.get(f"RATE_LIMIT_{route.upper()}")
+            if override:
+                try:
+                    self.limits[route] = parseLimit(override)
+                except ValueError as e:
+                    raise ValueError(f"RATE_LIMIT_{route.upper()}: {e}") from None
+
+    def check(self, route: str, userName: str | None = None):
+        """Return a 429 response if the caller exhausted the route's buckets."""
+        limit = self.limits.get(route)
+        if limit is None or limit.burst <= 0:
+            return None
+        buckets = [f"ratelimit:{route}:ip:{clientIp()}"]
+        if userName:
+            buckets.append(f"ratelimit:{route}:user:{userName}")
+        try:
+            wait = self.script(
+                keys=[STATS_KEY, *buckets],
+                args=[
+                    limit.burst,
+                    limit.burst / (limit.period * 1000),
+                    int(time.time() * 1000),
+                    route,
+                ],
+            )
+        except redis.RedisError as e:
+            self.logger.error(f"rate limiting {route} failed open: {e}")
+            return None
+        if wait == 0:
+            return None
+        response = make_response(jsonify({"error": "Too many requests"}), 429)
+        response.headers["Retry-After"] = str(math.ceil(int(wait) / 1000))  # type: ignore
+        return response
+
+    def limited(self, route: str, userName: Callable[[], str | None] = lambda: None):
+        """Decorator form of `check`, `userName` is called per request."""
+
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                response = self.check(route, userName())
+                if response is not None:
+                    return response
+                return f(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def stats(self) -> dict[str, int]:
+        stats = self.r.hgetall(STATS_KEY)
+        return {k.decode(): int(v) for k, v in stats.items()}  # type: ignore
@@ -0,0 +1,118 @@
+"""The api's redis clients, configured in one place.
+
+Every user of redis (sessions, push subscriptions, shared recipes, shopping
+lists, rate limiting, the change log and the migration scripts) gets its client
+from `redisClient` instead of building its own. Clients with the same settings
+share one connection pool, so the number of connections per database is bounded by
+REDIS_MAX_CONNECTIONS; a request waits up to REDIS_POOL_TIMEOUT seconds for a
+free connection instead of failing with "Too many connections".
+
+Subscribers that hold a connection for as long as a client stays connected
+(the shopping list event streams) use `stream=True` clients instead. Their pool
+is unbounded and has no read timeout, so open streams never take connections
+from the pools serving requests.
+
+Settings (environment):
+    REDIS_HOST, REDIS_PORT
+    REDIS_MAX_CONNECTIONS          per pool, default 50
+    REDIS_SOCKET_TIMEOUT           seconds for a command, default 5
+    REDIS_CONNECT_TIMEOUT          seconds, default 2
+    REDIS_POOL_TIMEOUT             seconds to wait for a free connection, default 5
+    REDIS_RETRIES                  retries on connection errors and timeouts,
+                                   with exponential backoff, default 3
+    REDIS_HEALTH_CHECK_INTERVAL    idle seconds after which a connection is
+                                   PINGed before it is used, default 30
+    REDIS_CLIENT_CACHE             size of the client-side cache, 0 (default)
+                                   disables it
+
+With REDIS_CLIENT_CACHE the `cached=True` clients speak RESP3 and keep the
+replies of read commands (GET, HGETALL, ZREVRANGE, ...) in process memory. The
+server tracks the keys they read and pushes an invalidation as soon as any
+client changes one, so a cached reply is never served after the write that
+changed it was acknowledged. Only read-mostly keys go through cached clients:
+shared recipes (written once) and the names of a user's shopping lists (changed
+when a list is opened, renamed or removed). Sessions, push subscriptions
+(scanned, never re-read), list items and the lists' activity (both changed on
+every tick of a shopping trip) use plain clients.
+"""
+
+import os
+
+import redis
+from redis.backoff import ExponentialBackoff
+from redis.cache import CacheConfig
+from redis.retry import Retry
+
+# push subscriptions, notifyNewRecipe treats every key in it as one
+NOTIFICATIONS_DB = 0
+UNIQUE_RECIPES_DB = 1
+# shopping lists, their index and flask sessions
+SHOPPING_LISTS_DB = 2
+RATE_LIMIT_DB = 3
+# per-group change logs, see changes.py
+CHANGES_DB = 4
+# checkpoints of redis_migration.py
+MIGRATIONS_DB = 5
+
+REDIS_HOST = os.environ.get("REDIS_HOST", "redis")
+REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 50))
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", 5))
+REDIS_CONNECT_TIMEOUT = float(os.environ.get("REDIS_CONNECT_TIMEOUT", 2))
+REDIS_POOL_TIMEOUT = int(os.environ.get("REDIS_POOL_TIMEOUT", 5))
+REDIS_RETRIES = int(os.environ.get("REDIS_RETRIES", 3))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30))
+REDIS_CLIENT_CACHE = int(os.environ.get("REDIS_CLIENT_CACHE", 0))
+
+pools: dict[tuple[int, bool, bool, bool], redis.ConnectionPool] = {}
+
+
+def createPool(
+    db: int, decode: bool, cached: bool, stream: bool
+) -> redis.ConnectionPool:
+    kwargs: dict = {
+        "host": REDIS_HOST,
+        "port": REDIS_PORT,
+        "db": db,
+        "decode_responses": decode,
+        "socket_connect_timeout": REDIS_CONNECT_TIMEOUT,
+        "socket_keepalive": True,
+        "retry": Retry(ExponentialBackoff(cap=1, base=0.05), REDIS_RETRIES),
+        "retry_on_error": [redis.ConnectionError, redis.TimeoutError],
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+    }
+    if cached:
+        kwargs["protocol"] = 3
+        kwargs["cache_config"] = CacheConfig(max_size=REDIS_CLIENT_CACHE)
+    if stream:
+        # waits for messages indefinitely, one connection per open stream
+        return redis.ConnectionPool(socket_timeout=None, **kwargs)
+    return redis.BlockingConnectionPool(
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        **kwargs,
+    )
+
+
+def redisClient(
+    db: int, decode: bool = False, cached: bool = False, stream: bool = False
+) -> redis.Redis:
+    """A client of database `db`, sharing the pool of clients with the same settings.
+
+    `cached` asks for client-side caching, it is ignored unless REDIS_CLIENT_CACHE
+    is set. Use it only for keys that are read far more often than written.
+    `stream` is for subscribers that keep their connection while a client is
+    connected, they get a separate pool without limit and read timeout.
+    """
+    cached = cached and REDIS_CLIENT_CACHE > 0 and not stream
+    key = (db, decode, cached, stream)
+    if key not in pools:
+        pools[key] = createPool(db, decode, cached, stream)
+    return redis.Redis(connection_pool=pools[key])
+
+
+def pingAll():
+    """PING every pool in use, raises redis.RedisError if one is unreachable."""
+    for pool in list(pools.values()):
+        redis.Redis(connection_pool=pool).ping()
@@ -0,0 +1,214 @@
+"""Batched, resumable migrations of keys in redis.
+
+A migration walks the keys of one database with SCAN and handles them in
+batches: the reads for every key of a batch go out in one pipeline, the writes
+in a second one, so a batch costs two round trips however many keys it holds.
+SCAN filters by MATCH pattern and TYPE on the server, keys of other types are
+never sent to the script. Nothing blocks the server for longer than one batch,
+so migrations run against the live keyspace while the api keeps serving.
+
+After each batch the scan cursor and the counters are checkpointed in the
+"migration:<name>" hash of MIGRATIONS_DB. An interrupted run continues where it
+stopped; a finished run removes its checkpoint, so running it again starts over.
+SCAN may return a key more than once and a batch may be repeated after an
+interruption, so writes must be idempotent (e.g. RENAMENX, ZADD NX). Whether a
+key counts as migrated is decided from the results of its writes, a RENAMENX
+that lost against a concurrent writer is not counted; dry runs count the keys
+that would be written.
+
+Subclass `KeyMigration` and hand it to `migrationMain`, which adds the command
+line options:
+
+    --dry-run       read and report what would change, write nothing
+    --batch-size N  SCAN COUNT hint, default 500
+    --pause S       seconds to sleep between batches to go easy on the server
+    --restart       ignore a checkpoint of an earlier, interrupted run
+
+See migrate_shopping_lists.py and migrate_list_index.py.
+"""
+
+import argparse
+import time
+from abc import ABC, abstractmethod
+from typing import Any, cast
+
+import redis
+from redis.client import Pipeline
+
+from redis_clients import MIGRATIONS_DB, redisClient
+
+BATCH_SIZE = 500
+# seconds between progress reports
+REPORT_SECONDS = 5
+
+
+class KeyMigration(ABC):
+    """One migration, subclasses set `name` and `db` and implement `read` and `write`."""
+
+    # identifies the checkpoint
+    name = ""
+    db = 0
+    # SCAN MATCH pattern and TYPE, None scans everything
+    match: str | None = None
+    keyType: str | None = None
+
+    def select(self, key: str) -> bool:
+        """Whether to migrate `key`, for filters SCAN can not express."""
+        return True
+
+    @abstractmethod
+    def read(self, pipe: Pipeline, key: str):
+        """Queue the reads `write` needs for `key`."""
+
+    @abstractmethod
+    def write(self, pipe: Pipeline, key: str, values: list[Any]):
+        """Queue the writes for `key` given the results of its reads.
+
+        Queues nothing if the key needs no change. Called in dry runs too, the
+        queued writes are just never executed.
+        """
+
+    def migrated(self, key: str, results: list[Any]) -> bool:
+        """Whether the writes of `key` changed it, given their results.
+
+        Only asked for keys that queued writes, and not in dry runs.
+        """
+        return True
+
+
+class Progress:
+    def __init__(self, scanned: int = 0, migrated: int = 0):
+        self.scanned = scanned
+        self.migrated = migrated
+        self.started = time.monotonic()
+        self.startScanned = scanned
+        self.reportedAt = self.started
+
+    def report(self, name: str, final: bool = False):
+        now = time.monotonic()
+        if not final and now - self.reportedAt < REPORT_SECONDS:
+            return
+        self.reportedAt = now
+        elapsed = max(now - self.started, 1e-9)
+        rate = (self.scanned - self.startScanned) / elapsed
+        print(
+            f"{name}: {self.scanned} key(s) scanned, {self.migrated} migrated, "
+            f"{rate:.0f} keys/s"
+        )
+
+
+def checkpointKey(name: str) -> str:
+    return f"migration:{name}"
+
+
+def splitResults(results: list[Any], counts: list[int]) -> list[list[Any]]:
+    """Split a pipeline's results into those of each key, given the commands queued per key."""
+    split = []
+    offset = 0
+    for count in counts:
+        split.append(results[offset : offset + count])
+        offset += count
+    return split
+
+
+def migrateBatch(
+    r: redis.Redis, migration: KeyMigration, keys: list[str], dryRun: bool
+) -> int:
+    """Migrate one batch of keys, returns how many were changed."""
+    reads = r.pipeline(transaction=False)
+    # commands queued per key, to split the pipelines' results again
+    readCounts = []
+    for key in keys:
+        before = len(reads)
+        migration.read(reads, key)
+        readCounts.append(len(reads) - before)
+    results = reads.execute() if len(reads) else []
+
+    writes = r.pipeline(transaction=False)
+    writeCounts = []
+    for key, values in zip(keys, splitResults(results, readCounts)):
+        before = len(writes)
+        migration.write(writes, key, values)
+        writeCounts.append(len(writes) - before)
+    if dryRun:
+        return sum(1 for count in writeCounts if count)
+
+    results = writes.execute() if len(writes) else []
+    return sum(
+        1
+        for key, count, keyResults in zip(
+            keys, writeCounts, splitResults(results, writeCounts)
+        )
+        if count and migration.migrated(key, keyResults)
+    )
+
+
+def runMigration(
+    migration: KeyMigration,
+    dryRun: bool = False,
+    batchSize: int = BATCH_SIZE,
+    pause: float = 0,
+    restart: bool = False,
+) -> Progress:
+    r = redisClient(migration.db, decode=True)
+    state = redisClient(MIGRATIONS_DB, decode=True)
+    stateKey = checkpointKey(migration.name)
+
+    cursor = 0
+    progress = Progress()
+    saved = {} if restart or dryRun else state.hgetall(stateKey)
+    if saved:
+        cursor = int(saved["cursor"])
+        progress = Progress(int(saved["scanned"]), int(saved["migrated"]))
+        print(f"{migration.name}: resuming after {progress.scanned} key(s)")
+
+    while True:
+        cursor, keys = cast(
+            tuple[int, list[str]],
+            r.scan(
+                cursor, match=migration.match, count=batchSize, _type=migration.keyType
+            ),
+        )
+        progress.scanned += len(keys)
+        keys = [key for key in keys if migration.select(key)]
+        if keys:
+            progress.migrated += migrateBatch(r, migration, keys, dryRun)
+        if cursor == 0:
+            break
+        if not dryRun:
+            state.hset(
+                stateKey,
+                mapping={
+                    "cursor": cursor,
+                    "scanned": progress.scanned,
+                    "migrated": progress.migrated,
+                },
+            )
+        progress.report(migration.name)
+        if pause:
+            time.sleep(pause)
+
+    if not dryRun:
+        state.delete(stateKey)
+    progress.report(migration.name, final=True)
+    return progress
+
+
+def migrationMain(migration: KeyMigration, description: str):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only report, change nothing"
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--pause", type=float, default=0, help="seconds to sleep between batches"
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore an earlier run's checkpoint"
+    )
+    args = parser.parse_args()
+    progress = runMigration(
+        migration, args.dry_run, args.batch_size, args.pause, args.restart
+    )
+    verb = "would migrate" if args.dry_run else "migrated"
+    print(f"done, {verb} {progress.migrated} key(s)")
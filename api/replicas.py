@@ -0,0 +1,129 @@
+"""Optional read replicas for `Database`.
+
+MYSQL_REPLICA_HOSTS is a comma separated list of "host" or "host:port". Without
+it everything goes to MYSQL_HOST as before. With it, the read-only listing
+methods of `Database` connect to the replicas in turn, all writes and
+everything feeding the shared /bootstrap snapshot stay on the primary.
+
+Read-your-writes: after a commit `Database` stores the primary's @@last_gtid in
+the user's session. Primary connections are `GtidTrackingConnection`s, which
+read it from the OK packet of COMMIT when the server tracks it
+(--session-track-system-variables=last_gtid), so a write costs no extra round
+trip; without that option it is SELECTed after the commit. A replica read first waits up to REPLICA_WAIT_SECONDS for
+the replica to have applied that GTID (MASTER_GTID_WAIT) and uses the primary
+instead if it did not. A replica that can not be reached is skipped for
+REPLICA_RETRY_SECONDS.
+
+For a local test start a second MariaDB replicating the first, see
+ci/docker-compose.replica.yml.
+"""
+
+import itertools
+import os
+import threading
+import time
+
+from pymysql.connections import Connection
+from pymysql.constants import COMMAND
+
+# session key of the GTID of the user's last write
+WRITE_POSITION_KEY = "lastWriteGtid"
+
+REPLICA_WAIT_SECONDS = float(os.environ.get("REPLICA_WAIT_SECONDS", 0.1))
+REPLICA_RETRY_SECONDS = 30
+
+# OK packet status flag, session state changes follow the info (not in pymysql)
+SERVER_SESSION_STATE_CHANGED = 0x4000
+SESSION_TRACK_SYSTEM_VARIABLES = 0
+
+
+def parseHosts(value: str) -> list[tuple[str, int]]:
+    hosts = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.partition(":")
+        hosts.append((host, int(port) if port else 3306))
+    return hosts
+
+
+class ReplicaPool:
+    """Round-robin over the replicas, skipping those that recently failed."""
+
+    def __init__(self, hosts: list[tuple[str, int]]):
+        self.hosts = hosts
+        self.cycle = itertools.cycle(hosts)
+        self.downUntil: dict[tuple[str, int], float] = {}
+        self.lock = threading.Lock()
+
+    def pick(self) -> tuple[str, int] | None:
+        now = time.monotonic()
+        with self.lock:
+            for _ in self.hosts:
+                host = next(self.cycle)
+                if self.downUntil.get(host, 0) <= now:
+                    return host
+        return None
+
+    def markDown(self, host: tuple[str, int]):
+        with self.lock:
+            self.downUntil[host] = time.monotonic() + REPLICA_RETRY_SECONDS
+
+
+def replicaPoolFromEnv() -> ReplicaPool:
+    return ReplicaPool(parseHosts(os.environ.get("MYSQL_REPLICA_HOSTS", "")))
+
+
+def readLengthEncodedInt(data: bytes, pos: int) -> tuple[int, int]:
+    """(value, position after it) of a length-encoded integer at `pos`."""
+    first = data[pos]
+    if first < 0xFB:
+        return first, pos + 1
+    size = {0xFC: 2, 0xFD: 3, 0xFE: 8}[first]
+    return int.from_bytes(data[pos + 1 : pos + 1 + size], "little"), pos + 1 + size
+
+
+def readLengthEncodedBytes(data: bytes, pos: int) -> tuple[bytes, int]:
+    length, pos = readLengthEncodedInt(data, pos)
+    return data[pos : pos + length], pos + length
+
+
+def trackedGtid(serverStatus: int, rest: bytes) -> str | None:
+    """last_gtid from the session state changes of an OK packet, if it has one.
+
+    `rest` is the OK packet after its warning count: the info string and, with
+    SERVER_SESSION_STATE_CHANGED, the changes as (type, data) entries.
+    """
+    if not serverStatus & SERVER_SESSION_STATE_CHANGED:
+        return None
+    _, pos = readLengthEncodedBytes(rest, 0)
+    state, _ = readLengthEncodedBytes(rest, pos)
+    pos = 0
+    while pos < len(state):
+        kind = state[pos]
+        data, pos = readLengthEncodedBytes(state, pos + 1)
+        if kind != SESSION_TRACK_SYSTEM_VARIABLES:
+            continue
+        name, end = readLengthEncodedBytes(data, 0)
+        if name == b"last_gtid":
+            value, _ = readLengthEncodedBytes(data, end)
+            return value.decode() or None
+    return None
+
+
+class GtidTrackingConnection(Connection):
+    """Primary connection keeping the GTID of its last commit in `lastGtid`.
+
+    Opened with CLIENT.SESSION_TRACK, None if the server did not report it.
+    """
+
+    lastGtid: str | None = None
+
+    def commit(self):
+        # what Connection.commit does, keeping the OK packet it drops
+        self._execute_command(  # pyright: ignore[reportAttributeAccessIssue]
+            COMMAND.COM_QUERY, "COMMIT"
+        )
+        ok = self._read_ok_packet()  # pyright: ignore[reportAttributeAccessIssue]
+        self.lastGtid = trackedGtid(ok.server_status, ok.message)
@@ -0,0 +1,143 @@
+"""Response compression policy on top of Flask-Compress.
+
+Flask-Compress compresses every eligible response from scratch. CompressionPolicy
+keeps its configuration (COMPRESS_MIMETYPES, COMPRESS_MIN_SIZE) but
+
+- never touches streams (the shopping-list `text/event-stream`), files sent by
+  `send_file` or images, which are either already compressed or must not be
+  buffered,
+- picks brotli/gzip levels by payload size,
+- caches the compressed bytes of large bodies keyed by a hash of the body, so an
+  unchanged `/recipes` or `/bootstrap` payload is compressed once per version
+  and encoding instead of on every request.
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+import brotli
+from flask import Flask, Response, current_app, make_response, request
+from flask_compress import Compress
+
+from timing import phase
+
+# bodies at least this large are cached after compressing them
+CACHE_MIN_SIZE = 16 * 1024
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# (body size up to, brotli quality, gzip level); cached bodies are compressed
+# once per version and can afford more effort than one-off responses
+LEVELS = [
+    (CACHE_MIN_SIZE, 5, 6),
+    (2 * 1024 * 1024, 8, 6),
+    (float("inf"), 6, 5),
+]
+
+
+def chooseAlgorithm(acceptEncoding: str) -> str | None:
+    accepted = set()
+    for part in acceptEncoding.split(","):
+        coding, _, params = part.partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    for algorithm in ("br", "gzip"):
+        if algorithm in accepted or "*" in accepted:
+            return algorithm
+    return None
+
+
+def compressData(data: bytes, algorithm: str) -> bytes:
+    _, brQuality, gzipLevel = next(level for level in LEVELS if len(data) <= level[0])
+    if algorithm == "br":
+        return brotli.compress(data, quality=brQuality)
+    return gzip.compress(data, compresslevel=gzipLevel, mtime=0)
+
+
+class CompressedCache:
+    """LRU of compressed bodies, bounded by their total size."""
+
+    def __init__(self, maxBytes: int):
+        self.maxBytes = maxBytes
+        self.size = 0
+        self.entries: OrderedDict[tuple[str, bytes], bytes] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple[str, bytes]) -> bytes | None:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: tuple[str, bytes], value: bytes):
+        with self.lock:
+            if key in self.entries or len(value) > self.maxBytes:
+                return
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.maxBytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class CompressionPolicy(Compress):
+    def __init__(self, app: Flask | None = None):
+        self.compressedCache = CompressedCache(CACHE_MAX_BYTES)
+        super().__init__(app)
+
+    def after_request(self, response: Response | None) -> Response:
+        if not response:
+            return make_response("", 204)
+        with phase("compress"):
+            return self.compressResponse(response)
+
+    def compressResponse(self, response: Response) -> Response:
+        if (
+            response.is_streamed
+            or response.direct_passthrough
+            or response.mimetype is None
+            or response.mimetype.startswith("image/")
+            or response.mimetype not in self.compress_mimetypes_set
+            or not 200 <= response.status_code < 300
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+
+        vary = response.headers.get("Vary")
+        if not vary:
+            response.headers["Vary"] = "Accept-Encoding"
+        elif "accept-encoding" not in vary.lower():
+            response.headers["Vary"] = f"{vary}, Accept-Encoding"
+
+        algorithm = chooseAlgorithm(request.headers.get("Accept-Encoding", ""))
+        data = response.get_data()
+        if algorithm is None or len(data) < current_app.config["COMPRESS_MIN_SIZE"]:
+            return response
+
+        if len(data) >= CACHE_MIN_SIZE:
+            key = (algorithm, hashlib.blake2b(data, digest_size=16).digest())
+            compressed = self.compressedCache.get(key)
+            if compressed is None:
+                compressed = compressData(data, algorithm)
+                self.compressedCache.put(key, compressed)
+        else:
+            compressed = compressData(data, algorithm)
+
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = algorithm
+        response.headers["Content-Length"] = str(len(compressed))
+
+        etag, isWeak = response.get_etag()
+        if etag and not isWeak:
+            response.set_etag(f"{etag}:{algorithm}", weak=False)
+        if request.method in ("GET", "HEAD"):
+            response.make_conditional(request)
+        return response
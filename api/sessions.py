@@ -0,0 +1,109 @@
+"""Stateless session backend.
+
+With SESSION_BACKEND=redis (the default) flask-session keeps every session in
+redis, which costs a round trip to load it on every request (including every
+shopping-list SSE reconnect) and often another one to save it.
+
+SESSION_BACKEND=signed instead keeps the identity (`userName`, `id`) in a
+signed, expiring cookie (Flask's own cookie session, signed with FLASK_KEY and
+checked against PERMANENT_SESSION_LIFETIME). To still be able to log a cookie
+out, the ids of logged-out sessions go into the "revokedSessions" sorted set.
+That set is only written on logout and only read every
+REVOCATION_REFRESH_SECONDS, so a normal request does not touch redis at all.
+
+Cookies issued by the redis backend are accepted during the rollout: their
+session is loaded from redis once and re-issued as a signed cookie.
+"""
+
+import os
+import threading
+import time
+from datetime import timedelta
+
+import redis
+from flask import Flask, Request
+from flask.sessions import (
+    SecureCookieSessionInterface,
+    SessionInterface,
+    SessionMixin,
+)
+
+REVOKED_KEY = "revokedSessions"
+REVOCATION_REFRESH_SECONDS = 30
+
+
+class RevocationList:
+    """Session ids that were logged out before their cookie expired."""
+
+    def __init__(self, r: redis.StrictRedis, lifetime: timedelta):
+        self.r = r
+        self.lifetime = lifetime.total_seconds()
+        self.revoked: set[str] = set()
+        self.refreshedAt = 0.0
+        self.lock = threading.Lock()
+
+    def revoke(self, sessionId: str):
+        now = time.time()
+        # a revoked id only matters until the cookie would have expired anyway
+        self.r.zadd(REVOKED_KEY, {sessionId: now + self.lifetime})
+        self.revoked.add(sessionId)
+
+    def isRevoked(self, sessionId: str) -> bool:
+        now = time.time()
+        if now - self.refreshedAt > REVOCATION_REFRESH_SECONDS:
+            with self.lock:
+                if now - self.refreshedAt > REVOCATION_REFRESH_SECONDS:
+                    pipe = self.r.pipeline()
+                    pipe.zremrangebyscore(REVOKED_KEY, "-inf", now)
+                    pipe.zrange(REVOKED_KEY, 0, -1)
+                    _, revoked = pipe.execute()
+                    self.revoked = {x.decode() for x in revoked}
+                    self.refreshedAt = now
+        return sessionId in self.revoked
+
+
+class SignedSessionInterface(SecureCookieSessionInterface):
+    def __init__(self, legacy: SessionInterface, revocations: RevocationList):
+        self.legacy = legacy
+        self.revocations = revocations
+
+    def open_session(self, app: Flask, request: Request):
+        s = super().open_session(app, request)
+        if s is None:
+            return None
+        if len(s) > 0:
+            sessionId = s.get("id")
+            if sessionId is not None and self.revocations.isRevoked(sessionId):
+                return self.session_class()
+            return s
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        # flask-session ids never contain the "." separating a signed payload
+        if cookie and "." not in cookie:
+            legacy = self.legacy.open_session(app, request)
+            if legacy is not None and legacy.get("userName") is not None:
+                converted = self.session_class(
+                    {"userName": legacy["userName"], "id": legacy.get("id")}
+                )
+                converted.permanent = True
+                return converted
+        return s
+
+
+def configureSessions(app: Flask, r: redis.StrictRedis):
+    """Install the session backend selected by the SESSION_BACKEND env variable.
+
+    Expects flask-session's `Session(app)` to have run already, its redis
+    interface is kept to read legacy sessions.
+    """
+    if os.environ.get("SESSION_BACKEND", "redis") != "signed":
+        return None
+    revocations = RevocationList(r, app.permanent_session_lifetime)
+    app.session_interface = SignedSessionInterface(app.session_interface, revocations)
+    return revocations
+
+
+def revokeSession(revocations: RevocationList | None, session: SessionMixin):
+    """Make sure a logged-out signed cookie can not be replayed."""
+    sessionId = session.get("id")
+    if revocations is not None and sessionId is not None:
+        revocations.revoke(sessionId)
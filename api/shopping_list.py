@@ -0,0 +1,317 @@
+"""Storage of shopping lists and their items in redis (db 2).
+
+Every list is a hash keyed by the list key (bare username for private lists,
+"shared:<uuid>" for shared ones) with one field per item id. Item values use a
+compact binary encoding instead of a JSON document: the id is already the field
+name, `checked`/`position` live in a fixed header, `addedTime` is stored as
+epoch milliseconds and the text follows as raw UTF-8. Values still holding JSON
+(written before this encoding) are decoded transparently and rewritten in the
+compact form on the next write to the list.
+
+Checked items are stamped with the time they were checked; once that is older
+than SHOPPING_LIST_ARCHIVE_DAYS they are moved to the cold hash
+"archive:<key>" so the hot hash, which is sent to every device on every change,
+only holds items that are still relevant. The archive is read on request (see
+`getArchive`) and expires SHOPPING_LIST_ARCHIVE_KEEP_DAYS after the last item
+was moved into it.
+
+All keys of db 2 other than private lists carry a "<namespace>:" prefix
+("shared:", "archive:", "listNames:", "session:", ...). Usernames must not
+contain ':' (registration rejects it), so no private list key can address
+another user's archive or index.
+
+Which lists a user has opened is tracked by ShoppingListIndex below.
+"""
+
+import json
+import os
+import struct
+import time
+from datetime import datetime, timezone
+from typing import Any, cast
+
+import redis
+from redis.client import Pipeline
+
+FORMAT_VERSION = 1
+# version, flags, position, addedTime (epoch ms), checkedAt (epoch s, 0 = never)
+HEADER = struct.Struct("<BBiqI")
+FLAG_CHECKED = 1
+FLAG_JSON = 2  # item does not fit the compact form, the payload is its JSON
+
+ITEM_KEYS = {"id", "text", "checked", "position", "addedTime"}
+
+ARCHIVE_AFTER = int(os.environ.get("SHOPPING_LIST_ARCHIVE_DAYS", 30)) * 24 * 60 * 60
+ARCHIVE_KEEP = (
+    int(os.environ.get("SHOPPING_LIST_ARCHIVE_KEEP_DAYS", 365)) * 24 * 60 * 60
+)
+# optimistic retries of `maintain` when the list changes while it is checked
+MAINTAIN_ATTEMPTS = 5
+
+
+def archiveKey(key: str) -> str:
+    return f"archive:{key}"
+
+
+def formatAddedTime(ms: int) -> str:
+    dt = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.") + f"{ms % 1000:03d}Z"
+
+
+def parseAddedTime(value: Any) -> int | None:
+    """Epoch ms of an ISO timestamp, if it round-trips exactly through formatAddedTime."""
+    if not isinstance(value, str):
+        return None
+    try:
+        dt = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ")
+    except ValueError:
+        return None
+    ms = round(dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    return ms if formatAddedTime(ms) == value else None
+
+
+def encodeItem(item: dict[str, Any], checkedAt: int = 0) -> bytes:
+    """Encode an item (as sent by the client) for storage under its id."""
+    flags = FLAG_CHECKED if item["checked"] else 0
+    position = item["position"]
+    addedMs = parseAddedTime(item["addedTime"])
+    if (
+        set(item) != ITEM_KEYS
+        or not isinstance(item["text"], str)
+        or type(position) is not int
+        or not -(2**31) <= position < 2**31
+        or addedMs is None
+    ):
+        # nothing a current client sends, keep whatever it is losslessly
+        header = HEADER.pack(FORMAT_VERSION, flags | FLAG_JSON, 0, 0, checkedAt)
+        return header + json.dumps(item).encode()
+    header = HEADER.pack(FORMAT_VERSION, flags, position, addedMs, checkedAt)
+    return header + item["text"].encode()
+
+
+def decodeItem(itemId: str, value: bytes) -> tuple[dict[str, Any], int, bool]:
+    """Return (item, checkedAt, whether the stored value is legacy JSON)."""
+    if value[0] != FORMAT_VERSION:
+        return json.loads(value), 0, True
+    _, flags, position, addedMs, checkedAt = HEADER.unpack_from(value)
+    if flags & FLAG_JSON:
+        return json.loads(value[HEADER.size :]), checkedAt, False
+    item = {
+        "id": itemId,
+        "text": value[HEADER.size :].decode(),
+        "checked": bool(flags & FLAG_CHECKED),
+        "position": position,
+        "addedTime": formatAddedTime(addedMs),
+    }
+    return item, checkedAt, False
+
+
+def sortItems(items: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Open items before checked ones, each by position."""
+
+    def order(item: dict[str, Any]):
+        position = item.get("position")
+        return (
+            bool(item.get("checked")),
+            position if isinstance(position, (int, float)) else 0,
+        )
+
+    return sorted(items, key=order)
+
+
+class ShoppingListStore:
+    def __init__(self, r: redis.StrictRedis):
+        # values are binary, so this client must not decode responses
+        self.r = r
+
+    def _load(
+        self, key: str, client: redis.StrictRedis | Pipeline | None = None
+    ) -> dict[str, tuple[dict[str, Any], int, bool]]:
+        stored = cast(dict[bytes, bytes], (client or self.r).hgetall(key))
+        return {
+            field.decode(): decodeItem(field.decode(), value)
+            for field, value in stored.items()
+        }
+
+    def getItems(self, key: str) -> list[dict[str, Any]]:
+        return sortItems([item for item, _, _ in self._load(key).values()])
+
+    def setItems(self, key: str, items: list[dict[str, Any]]):
+        """Store items, stamping the time they got checked."""
+        ids = [item["id"] for item in items]
+        if not ids:
+            return
+        previous = cast(list[bytes | None], self.r.hmget(key, ids))
+        now = int(time.time())
+        mapping = {}
+        for item, stored in zip(items, previous):
+            checkedAt = 0
+            if item["checked"]:
+                if stored is not None:
+                    before, checkedAt, _ = decodeItem(item["id"], stored)
+                    if not before.get("checked"):
+                        checkedAt = 0
+                checkedAt = checkedAt or now
+            mapping[item["id"]] = encodeItem(item, checkedAt)
+        self.r.hset(key, mapping=mapping)
+
+    def deleteItems(self, key: str, ids: list[str]):
+        if ids:
+            self.r.hdel(key, *ids)
+
+    def getArchive(self, key: str) -> list[dict[str, Any]]:
+        """Archived items of a list, the most recently checked first."""
+        archived = self._load(archiveKey(key)).values()
+        return [item for item, _, _ in sorted(archived, key=lambda stored: -stored[1])]
+
+    def maintain(self, key: str) -> list[dict[str, Any]]:
+        """Migrate legacy values, archive old checked items and return the list.
+
+        Called after every write, so its result is what gets published. The list
+        is WATCHed while it is read, so an item another device changes meanwhile
+        is not overwritten or archived with its old value; the check is retried
+        then.
+        """
+        for _ in range(MAINTAIN_ATTEMPTS):
+            with self.r.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    return self._maintain(pipe, key)
+                except redis.WatchError:
+                    continue
+        # lost every race to other writers, whose own maintain covers the list
+        return self.getItems(key)
+
+    def _maintain(self, pipe: Pipeline, key: str) -> list[dict[str, Any]]:
+        now = int(time.time())
+        hot: list[dict[str, Any]] = []
+        rewrite = {}
+        archive = {}
+        for itemId, (item, checkedAt, legacy) in self._load(key, pipe).items():
+            if item.get("checked") and checkedAt == 0:
+                # legacy value without a checked time, start the clock now
+                checkedAt = now
+                legacy = True
+            if checkedAt and now - checkedAt > ARCHIVE_AFTER:
+                archive[itemId] = encodeItem(item, checkedAt)
+                continue
+            if legacy:
+                rewrite[itemId] = encodeItem(item, checkedAt)
+            hot.append(item)
+        if rewrite or archive:
+            pipe.multi()
+            if rewrite:
+                pipe.hset(key, mapping=rewrite)
+            if archive:
+                pipe.hset(archiveKey(key), mapping=archive)
+                pipe.expire(archiveKey(key), ARCHIVE_KEEP)
+                pipe.hdel(key, *archive.keys())
+            pipe.execute()
+        return sortItems(hot)
+
+
+def listIndexKeys(userName: str) -> tuple[str, str]:
+    """(hash of list id -> name, sorted set of list id by last activity).
+
+    Can not collide with a private list (keyed by the bare username), usernames
+    never contain ':'.
+    """
+    return f"listNames:{userName}", f"listActivity:{userName}"
+
+
+def legacyListsKey(userName: str) -> str:
+    return f"lists:{userName}"
+
+
+def queueLegacyMigration(pipe: Pipeline, userName: str, raw: list[str]) -> int:
+    """Queue moving the entries `raw` of "lists:<user>" into the index.
+
+    Returns the number of lists. Idempotent, lists already in the index keep
+    their activity.
+    """
+    namesKey, activityKey = listIndexKeys(userName)
+    names: dict[str, str] = {}
+    activity: dict[str, float] = {}
+    now = time.time()
+    # the legacy list was LPUSHed, so the most recent entry comes first
+    for i, entry in enumerate(raw):
+        try:
+            decoded = json.loads(entry)
+            listId = str(decoded["id"])
+        except (ValueError, KeyError, TypeError):
+            continue
+        if listId in names:
+            continue
+        names[listId] = str(decoded.get("name", ""))
+        activity[listId] = now - i
+    if names:
+        pipe.hset(namesKey, mapping=cast(dict, names))
+        pipe.zadd(activityKey, activity, nx=True)
+    pipe.delete(legacyListsKey(userName))
+    return len(names)
+
+
+class ShoppingListIndex:
+    """The shopping lists a user has opened, ordered by last activity.
+
+    Replaces the "lists:<user>" redis list of JSON strings, which could only be
+    deduplicated by exact string match. Legacy keys are converted when the index
+    is read.
+
+    The list names are read on every visit of the shopping list page but only
+    change when a list is opened, renamed or removed, so `getLists` can read them
+    through a client-side cached client (see redis_clients.py) passed as
+    `reader`. The activity is bumped by every list write and is never cached.
+    """
+
+    def __init__(self, r: redis.StrictRedis, reader: redis.StrictRedis | None = None):
+        # expects clients with decode_responses=True
+        self.r = r
+        self.reader = reader
+
+    def getLists(self, userName: str) -> list[dict[str, str]]:
+        namesKey, activityKey = listIndexKeys(userName)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.zrevrange(activityKey, 0, -1)
+        # checked on every read, not just while the index is empty: a write (e.g.
+        # opening a shared list) may have created the index before the first read
+        pipe.lrange(legacyListsKey(userName), 0, -1)
+        if self.reader is None:
+            pipe.hgetall(namesKey)
+        results = pipe.execute()
+        order, legacy = cast(list[str], results[0]), cast(list[str], results[1])
+        if legacy:
+            migrate = self.r.pipeline()
+            queueLegacyMigration(migrate, userName, legacy)
+            migrate.execute()
+            return self.getLists(userName)
+        if not order:
+            self.addList(userName, userName, "Private")
+            return self.getLists(userName)
+        if self.reader is not None:
+            # the activity changes with every list write, only the names are
+            # cached (pipelines would bypass the cache)
+            names = cast(dict[str, str], self.reader.hgetall(namesKey))
+        else:
+            names = cast(dict[str, str], results[2])
+        return [{"id": listId, "name": names.get(listId, "")} for listId in order]
+
+    def addList(self, userName: str, listId: str, name: str):
+        """Add or rename a list, which also marks it as the most recently used."""
+        namesKey, activityKey = listIndexKeys(userName)
+        pipe = self.r.pipeline()
+        pipe.hset(namesKey, listId, name)
+        pipe.zadd(activityKey, {listId: time.time()})
+        pipe.execute()
+
+    def removeList(self, userName: str, listId: str):
+        namesKey, activityKey = listIndexKeys(userName)
+        pipe = self.r.pipeline()
+        pipe.hdel(namesKey, listId)
+        pipe.zrem(activityKey, listId)
+        pipe.execute()
+
+    def touch(self, userName: str, listId: str):
+        """Bump the activity of a list the user already has in the index."""
+        _, activityKey = listIndexKeys(userName)
+        self.r.zadd(activityKey, {listId: time.time()}, xx=True)
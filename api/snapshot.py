@@ -0,0 +1,101 @@
+"""Per-group snapshot of everything the client loads on launch (/bootstrap).
+
+A snapshot holds the marshalled users, categories, recipes and comments of one
+group, keyed by id. Database mutations mark the affected ids dirty instead of
+dropping the snapshot, so the next /bootstrap only re-reads those rows. The
+encoded JSON of the snapshot is cached as well and only rebuilt after a change.
+
+The cache lives in the api process (gunicorn runs a single worker). Changes made
+to the database behind the api's back (e.g. update.sh restoring a backup) are
+picked up after SNAPSHOT_TTL at the latest.
+
+Requests are served by gevent greenlets, which switch while a refresh waits for
+the database. Refreshes of a snapshot therefore take its `refreshing` lock (a
+cooperative lock under gevent's monkey patching): two interleaved refreshes
+could otherwise apply a row re-read before a later write over the row re-read
+after it, and the snapshot would serve the stale row until SNAPSHOT_TTL.
+"""
+
+import json
+import threading
+import time
+from typing import Any
+
+KINDS = ("users", "categories", "recipes", "comments")
+SNAPSHOT_TTL = 10 * 60
+
+
+class Snapshot:
+    def __init__(self, entities: dict[str, dict[int, Any]]):
+        self.entities = entities
+        self.dirty: dict[str, set[int]] = {kind: set() for kind in KINDS}
+        self.builtAt = time.time()
+        self.encoded: bytes | None = None
+        # held from takeDirty until the re-read rows are applied and encoded
+        self.refreshing = threading.Lock()
+
+    def takeDirty(self) -> dict[str, set[int]]:
+        """Return and reset the ids that changed since the last call."""
+        dirty = {kind: ids for kind, ids in self.dirty.items() if ids}
+        self.dirty = {kind: set() for kind in KINDS}
+        return dirty
+
+    def apply(self, kind: str, ids: set[int], rows: dict[int, Any]):
+        """Replace the given ids with the re-read rows (missing ones were deleted)."""
+        for id in ids:
+            if id in rows:
+                self.entities[kind][id] = rows[id]
+            else:
+                self.entities[kind].pop(id, None)
+        self.encoded = None
+
+    def encode(self) -> bytes:
+        if self.encoded is None:
+            body = {kind: list(self.entities[kind].values()) for kind in KINDS}
+            commentCounts: dict[int, int] = {}
+            for comment in self.entities["comments"].values():
+                recipeId = comment["recipeId"]
+                commentCounts[recipeId] = commentCounts.get(recipeId, 0) + 1
+            body["recipes"] = [
+                {**recipe, "commentCount": commentCounts.get(recipe["id"], 0)}
+                for recipe in body["recipes"]
+            ]
+            self.encoded = json.dumps(body).encode()
+        return self.encoded
+
+
+class GroupSnapshots:
+    def __init__(self):
+        self.snapshots: dict[int, Snapshot] = {}
+        # bumped on every change, so a snapshot built concurrently with a write
+        # is not cached with the write missing
+        self.versions: dict[int, int] = {}
+        self.lock = threading.Lock()
+
+    def get(self, groupId: int) -> Snapshot | None:
+        snapshot = self.snapshots.get(groupId)
+        if snapshot is not None and time.time() - snapshot.builtAt > SNAPSHOT_TTL:
+            self.invalidate(groupId)
+            return None
+        return snapshot
+
+    def version(self, groupId: int) -> int:
+        return self.versions.get(groupId, 0)
+
+    def put(self, groupId: int, snapshot: Snapshot, version: int):
+        """Cache a snapshot built while `version(groupId)` was `version`."""
+        with self.lock:
+            if self.version(groupId) == version:
+                self.snapshots[groupId] = snapshot
+
+    def markDirty(self, groupId: int, kind: str, id: int):
+        with self.lock:
+            self.versions[groupId] = self.versions.get(groupId, 0) + 1
+            snapshot = self.snapshots.get(groupId)
+            if snapshot is not None:
+                snapshot.dirty[kind].add(id)
+
+    def invalidate(self, groupId: int):
+        with self.lock:
+            self.versions[groupId] = self.versions.get(groupId, 0) + 1
+            self.snapshots.pop(groupId, None)
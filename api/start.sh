@@ -2,4 +2,5 @@
 echo "[$(date +"%Y-%m-%d %H:%M:%S %z")] Starting in 3s (waiting for db)"
 sleep 3 # wait for db to come up?
 source $(poetry env info --path)/bin/activate
+python3 migrations.py || exit 1
 [[ -n $DEBUG ]] && exec python3 app.py || exec gunicorn app:app
\ No newline at end of file
@@ -0,0 +1,166 @@
+"""Fixtures shared by the api's tests.
+
+The tests import the api's modules flat, as the container does (see
+`pythonpath` in pyproject.toml). Redis is replaced by fakeredis; MariaDB is
+replaced by `FakeConnection`, which answers each statement from a script. No
+test talks to a server.
+"""
+
+import os
+from typing import Any, Callable, cast
+
+import fakeredis
+import pymysql
+import pytest
+
+from query_profile import ProfiledCursor
+
+# read when a connection is opened, the fake connections ignore them
+for name in ("MYSQL_HOST", "MYSQL_USER", "MYSQL_PASSWORD", "MYSQL_DATABASE"):
+    os.environ.setdefault(name, "test")
+
+
+class ScriptedCursor(pymysql.cursors.DictCursor):
+    """Answers statements from the connection's script instead of a server.
+
+    A result set is a list of rows or, for writes, the number of affected rows.
+    """
+
+    def execute(self, query, args=None):
+        conn = cast(FakeConnection, self.connection)
+        conn.executed.append(query)
+        conn.args.append(args)
+        self.resultSets = list(conn.answer(query, args))
+        return self.nextResult()
+
+    def nextset(self):
+        if not self.resultSets:
+            return None
+        self.nextResult()
+        return True
+
+    def nextResult(self):
+        conn = cast(FakeConnection, self.connection)
+        result = self.resultSets.pop(0) if self.resultSets else []
+        rows = [] if isinstance(result, int) else result
+        self._rows = tuple(rows)
+        self.rownumber = 0
+        self.rowcount = result if isinstance(result, int) else len(rows)
+        self.lastrowid = conn.lastrowid
+        self._executed = True
+        return self.rowcount
+
+
+class FakeCursor(ProfiledCursor, ScriptedCursor):
+    """ProfiledCursor, its DictCursor base answering from the script."""
+
+
+class FakeConnection:
+    """Stands in for every pymysql connection the api opens during a test.
+
+    `script` holds (statement start, result sets) pairs, the result sets may
+    also be a function of the statement's arguments. `executed` and `args`
+    record every statement in order.
+    """
+
+    def __init__(self):
+        self.script: list[tuple[str, list | Callable[[Any], list]]] = []
+        self.executed: list[str] = []
+        self.args: list[Any] = []
+        self.commits = 0
+        # the AUTO_INCREMENT id every INSERT reports
+        self.lastrowid = 1
+
+    def answer(self, query, args):
+        for start, resultSets in self.script:
+            if query.lstrip().startswith(start):
+                return resultSets(args) if callable(resultSets) else resultSets
+        raise AssertionError(f"unexpected statement: {query}")
+
+    def cursor(self, cursor=None):
+        return FakeCursor(cast(Any, self))
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(scope="session")
+def fakeServer():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def redisServer(fakeServer):
+    fakeredis.FakeRedis(server=fakeServer).flushall()
+    return fakeServer
+
+
+@pytest.fixture
+def redisClient(redisServer):
+    """Stand-in for redis_clients.redisClient, all databases on one fake server."""
+
+    def client(db, decode=False, cached=False, stream=False):
+        return fakeredis.FakeRedis(server=redisServer, db=db, decode_responses=decode)
+
+    return client
+
+
+@pytest.fixture(scope="session")
+def connections():
+    """Patches pymysql.connect, `connections.current` is what it returns."""
+
+    class Connections:
+        current = FakeConnection()
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(pymysql, "connect", lambda **kwargs: Connections.current)
+        yield Connections
+
+
+@pytest.fixture
+def mysql(connections):
+    connections.current = FakeConnection()
+    return connections.current
+
+
+@pytest.fixture(scope="session")
+def apiModule(fakeServer, connections):
+    """The api's app module, imported once on fakeredis and FakeConnection."""
+
+    def client(db, decode=False, cached=False, stream=False):
+        return fakeredis.FakeRedis(server=fakeServer, db=db, decode_responses=decode)
+
+    with pytest.MonkeyPatch.context() as mp:
+        for name in (
+            "FLASK_KEY",
+            "EXPRESS_SECRET",
+            "PUSH_PUBLIC_KEY",
+            "PUSH_PRIVATE_KEY",
+        ):
+            mp.setenv(name, "test")
+        mp.delenv("MYSQL_REPLICA_HOSTS", raising=False)
+        mp.delenv("SESSION_BACKEND", raising=False)
+        import redis_clients
+
+        mp.setattr(redis_clients, "redisClient", client)
+        import util
+
+        mp.setattr(util, "redisClient", client)
+        import app
+
+        yield app
+
+
+@pytest.fixture
+def apiClient(apiModule, redisServer, mysql):
+    """Test client of the api, logged in as alice."""
+    apiModule.app.config["TESTING"] = True
+    client = apiModule.app.test_client()
+    client.environ_base["wsgi.url_scheme"] = "https"
+    with client.session_transaction() as s:
+        s["userName"] = "alice"
+        s["id"] = "test-session"
+    return client
@@ -0,0 +1,67 @@
+import pytest
+
+from changes import ChangeLog, changeKey, parseVersion
+from redis_clients import CHANGES_DB
+
+
+@pytest.fixture
+def log(redisClient):
+    return ChangeLog(redisClient(CHANGES_DB, decode=True))
+
+
+def testParseVersion():
+    assert parseVersion("1700000000000-3") == (1700000000000, 3)
+    assert parseVersion("1700000000000") == (1700000000000, 0)
+    assert parseVersion("0-0") == (0, 0)
+    for invalid in ("", "-", "abc", "1-x", "x-1", "1-2-3", " 1-2"):
+        assert parseVersion(invalid) is None, invalid
+
+
+def testVersionsCompareInOrder():
+    assert parseVersion("9-0") < parseVersion("10-0")  # type: ignore
+    assert parseVersion("10-2") < parseVersion("10-10")  # type: ignore
+
+
+def testSinceNothingLogged(log):
+    assert log.since(1, "0-0") == []
+
+
+def testSince(log):
+    first = log.append(1, "recipes", "insert", 10)
+    second = log.append(1, "recipes", "update", 10)
+    log.append(2, "comments", "insert", 3)
+    third = log.append(1, "comments", "delete", 4)
+
+    changes = log.since(1, "0-0")
+    assert [(c.kind, c.op, c.id) for c in changes] == [
+        ("recipes", "insert", 10),
+        ("recipes", "update", 10),
+        ("comments", "delete", 4),
+    ]
+    assert [c.version for c in changes] == [first, second, third]
+    # exclusive, the version the client already has is not sent again
+    assert [c.version for c in log.since(1, first)] == [second, third]
+    assert log.since(1, third) == []
+    assert log.latest(1) == third
+
+
+def testSinceInvalidVersion(log):
+    log.append(1, "recipes", "insert", 10)
+    assert log.since(1, "not-a-version") is None
+
+
+def testSinceTrimmed(log, monkeypatch):
+    log.append(1, "recipes", "insert", 10)
+    # fakeredis does not track trimmed entries, XINFO STREAM reports them
+    monkeypatch.setattr(
+        log.r, "xinfo_stream", lambda key: {"max-deleted-entry-id": "99-0"}
+    )
+    assert log.since(1, "98-5") is None
+    assert log.since(1, "99-0") is not None
+
+
+def testAppendCountsPerGroup(log):
+    log.append(1, "recipes", "insert", 10)
+    log.append(1, "recipes", "delete", 10)
+    assert log.appended == {1: 2}
+    assert log.r.xlen(changeKey(1)) == 2
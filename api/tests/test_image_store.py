@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import image_store
+from image_store import collectGarbage, storeImagePath
+from redis_clients import UNIQUE_RECIPES_DB
+from unique_recipes import packUniqueRecipe, sharedRecipeImages
+
+SHARED = "ab" + "0" * 62 + ".jpg"
+UNUSED = "cd" + "0" * 62 + ".jpg"
+
+
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_store, "IMAGE_FOLDER", str(tmp_path) + "/")
+    return tmp_path
+
+
+def testSharedRecipeImages(redisClient):
+    r = redisClient(UNIQUE_RECIPES_DB)
+    for i in range(5):
+        recipe = json.dumps({"title": f"Brot {i}", "image": f"{i}.jpg"}).encode()
+        r.set(f"compressed{i}", packUniqueRecipe(recipe))
+    # written before compression
+    r.set("legacy", json.dumps({"image": "legacy.jpg"}))
+    r.set("noImage", packUniqueRecipe(json.dumps({"image": ""}).encode()))
+    r.set("notARecipe", packUniqueRecipe(b"[1, 2]"))
+    r.set("broken", b"\x01not zlib")
+
+    assert sharedRecipeImages(r, batchSize=2) == {
+        "0.jpg",
+        "1.jpg",
+        "2.jpg",
+        "3.jpg",
+        "4.jpg",
+        "legacy.jpg",
+    }
+
+
+def testCollectGarbageKeepsMarked(folder, redisClient):
+    r = redisClient(UNIQUE_RECIPES_DB)
+    # the recipe was deleted, the shared copy still shows its image
+    r.set("shared", packUniqueRecipe(json.dumps({"image": SHARED}).encode()))
+    for name in (SHARED, UNUSED):
+        with open(storeImagePath(name), "wb") as f:
+            f.write(b"jpg")
+
+    removed, reclaimed = collectGarbage(sharedRecipeImages(r), graceSeconds=-60)
+
+    assert (removed, reclaimed) == (1, 3)
+    assert image_store.locateImage(SHARED) is not None
+    assert image_store.locateImage(UNUSED) is None
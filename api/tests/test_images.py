@@ -0,0 +1,40 @@
+import io
+
+import pytest
+from PIL import Image
+
+import image_store
+
+NAME = "ab" + "0" * 62 + ".jpg"
+
+
+@pytest.fixture
+def image(apiModule, tmp_path, monkeypatch):
+    folder = str(tmp_path) + "/"
+    monkeypatch.setattr(image_store, "IMAGE_FOLDER", folder)
+    monkeypatch.setattr(apiModule, "IMAGE_FOLDER", folder)
+    Image.new("RGB", (3000, 2000), "#a0522d").save(image_store.storeImagePath(NAME))
+    return NAME
+
+
+def resized(response):
+    assert response.status_code == 200
+    return Image.open(io.BytesIO(response.data)).size
+
+
+def testResize(apiClient, image):
+    assert resized(apiClient.get(f"/images/{image}?w=300&h=300")) == (300, 200)
+
+
+def testResizeClampsTheBox(apiClient, image):
+    response = apiClient.get(f"/images/{image}?w=100000&h=100000")
+
+    assert resized(response) == (2048, 1365)
+    assert response.headers["ETag"] == f'"{"ab" + "0" * 62}-2048x2048-r1"'
+
+
+@pytest.mark.parametrize(
+    "query", ["w=0&h=300", "w=300&h=-1", "w=-5&h=-5", "w=abc&h=300", "w=300", "h=1.5"]
+)
+def testInvalidSize(apiClient, image, query):
+    assert apiClient.get(f"/images/{image}?{query}").status_code == 400
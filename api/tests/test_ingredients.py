@@ -0,0 +1,44 @@
+from ingredients import NAME_LENGTH, Ingredient, normaliseName, parseIngredients
+
+
+def testParseIngredients():
+    text = (
+        "Teig:\n"
+        "- 1 1/2 EL Olivenöl, kalt gepresst\n"
+        "2-3 Zehen Knoblauch\r\n"
+        "½ TL Salz\n"
+        "Pfeffer (frisch gemahlen)\n"
+        "\n"
+        "1,5 kg Mehl\n"
+        "2 Eier\n"
+        "* 1½ cups Milk\n"
+    )
+    assert parseIngredients(text) == [
+        Ingredient("olivenöl", 1.5, "el"),
+        # a range counts with its upper bound
+        Ingredient("knoblauch", 3.0, "zehen"),
+        Ingredient("salz", 0.5, "tl"),
+        Ingredient("pfeffer", None, None),
+        Ingredient("mehl", 1.5, "kg"),
+        Ingredient("eier", 2.0, None),
+        Ingredient("milk", 1.5, "cups"),
+    ]
+
+
+def testUnitWithoutName():
+    # a lone word is the name, even if it is also a unit
+    assert parseIngredients("2 Dosen") == [Ingredient("dosen", 2.0, None)]
+
+
+def testSkipsHeadingsAndEmptyLines():
+    assert parseIngredients("Für die Soße:\n\n  \n- \n") == []
+
+
+def testZeroDenominator():
+    assert parseIngredients("1/0 Tasse Zucker") == [Ingredient("zucker", 0.0, "tasse")]
+
+
+def testNormaliseName():
+    assert normaliseName("  Tomaten (geschält),  gewürfelt") == "tomaten"
+    assert normaliseName("Salz & Pfeffer!") == "salz & pfeffer"
+    assert len(normaliseName("x" * (NAME_LENGTH + 10))) == NAME_LENGTH
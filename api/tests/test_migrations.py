@@ -0,0 +1,22 @@
+from migrations import renameColonUsers
+
+
+def testRenameColonUsers(mysql):
+    taken = {"archive_alice", "alice"}
+    mysql.script = [
+        (
+            "SELECT `id`, `user` FROM `user` WHERE `user` LIKE",
+            [[{"id": 3, "user": "archive:alice"}, {"id": 4, "user": "a:b"}]],
+        ),
+        ("SELECT COUNT(*)", lambda args: [[{"c": int(args[0] in taken)}]]),
+        ("UPDATE `user`", [1]),
+    ]
+
+    renameColonUsers(mysql)
+
+    renames = [
+        args for query, args in zip(mysql.executed, mysql.args) if "UPDATE" in query
+    ]
+    # the first free name, without a suffix if it is not taken
+    assert renames == [["archive_alice_2", 3], ["a_b", 4]]
+    assert mysql.commits == 1
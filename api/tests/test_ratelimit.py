@@ -0,0 +1,98 @@
+import logging
+
+import pytest
+from flask import Flask
+
+from ratelimit import STATS_KEY, Limit, RateLimiter, clientIp, parseLimit
+from redis_clients import RATE_LIMIT_DB
+
+app = Flask(__name__)
+logger = logging.getLogger("recipes.tests")
+
+
+@pytest.fixture
+def limiter(redisClient):
+    return RateLimiter(redisClient(RATE_LIMIT_DB), logger)
+
+
+def request(forwardedFor=None, remoteAddr="10.0.0.1"):
+    headers = {"X-Forwarded-For": forwardedFor} if forwardedFor else {}
+    return app.test_request_context(
+        headers=headers, environ_base={"REMOTE_ADDR": remoteAddr}
+    )
+
+
+def testParseLimit():
+    assert parseLimit("10/60") == Limit(10, 60.0)
+    assert parseLimit("3/0.5") == Limit(3, 0.5)
+    # disabled
+    assert parseLimit("0/0") == Limit(0, 0.0)
+
+
+@pytest.mark.parametrize("value", ["", "10", "10/60/1", "ten/60", "1.5/60", "10/x"])
+def testParseLimitFormat(value):
+    with pytest.raises(ValueError, match="expected '<burst>/<period seconds>'"):
+        parseLimit(value)
+
+
+@pytest.mark.parametrize("value", ["5/0", "5/-1", "-1/60"])
+def testParseLimitRange(value):
+    with pytest.raises(ValueError, match="period > 0"):
+        parseLimit(value)
+
+
+def testInvalidOverrideStopsStartup(redisClient, monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_LOGIN", "5/0")
+    with pytest.raises(ValueError, match="^RATE_LIMIT_LOGIN: "):
+        RateLimiter(redisClient(RATE_LIMIT_DB), logger)
+
+
+def testOverride(redisClient, monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_REGISTER", "0/0")
+    limiter = RateLimiter(redisClient(RATE_LIMIT_DB), logger)
+    assert limiter.limits["register"] == Limit(0, 0.0)
+
+
+def testClientIp():
+    with request("203.0.113.9, 198.51.100.7, 172.18.0.1"):
+        assert clientIp(1) == "172.18.0.1"
+        assert clientIp(2) == "198.51.100.7"
+        # fewer entries than proxies, the leftmost is the closest we know
+        assert clientIp(5) == "203.0.113.9"
+        assert clientIp(0) == "10.0.0.1"
+    with request():
+        assert clientIp(2) == "10.0.0.1"
+
+
+def testCheck(limiter):
+    limiter.limits["login"] = Limit(2, 60)
+    with request("203.0.113.9"):
+        assert limiter.check("login") is None
+        assert limiter.check("login") is None
+        response = limiter.check("login")
+        assert response is not None
+        assert response.status_code == 429
+        assert 0 < int(response.headers["Retry-After"]) <= 30
+    # another client has its own bucket
+    with request("203.0.113.10"):
+        assert limiter.check("login") is None
+    assert limiter.stats() == {"login:allowed": 3, "login:rejected": 1}
+
+
+def testUserBucket(limiter):
+    limiter.limits["addRecipe"] = Limit(1, 60)
+    with request("203.0.113.9"):
+        assert limiter.check("addRecipe", "alice") is None
+    # the user's bucket is empty, whatever address they come from
+    with request("203.0.113.10"):
+        assert limiter.check("addRecipe", "alice") is not None
+        assert limiter.check("addRecipe", "bob") is None
+
+
+def testDisabledAndUnknownRoutes(limiter):
+    limiter.limits["login"] = Limit(0, 0)
+    with request("203.0.113.9"):
+        for _ in range(3):
+            assert limiter.check("login") is None
+        assert limiter.check("unknown") is None
+    assert limiter.r.exists(STATS_KEY) == 0
@@ -0,0 +1,150 @@
+import json
+
+import pytest
+
+import redis_migration
+from migrate_list_index import ListIndexMigration
+from migrate_shopping_lists import SharedListMigration
+from redis_clients import MIGRATIONS_DB, SHOPPING_LISTS_DB
+from redis_migration import KeyMigration, checkpointKey, runMigration
+from shopping_list import legacyListsKey, listIndexKeys
+
+LIST_IDS = [f"0000000{i}-aaaa-bbbb-cccc-dddddddddddd" for i in range(5)]
+
+
+@pytest.fixture
+def r(redisClient, monkeypatch):
+    monkeypatch.setattr(redis_migration, "redisClient", redisClient)
+    return redisClient(SHOPPING_LISTS_DB, decode=True)
+
+
+@pytest.fixture
+def state(redisClient):
+    return redisClient(MIGRATIONS_DB, decode=True)
+
+
+@pytest.fixture
+def sharedLists(r):
+    for listId in LIST_IDS:
+        r.hset(listId, "item", "x")
+    # not migrated: a private list, a session and a list id that is no hash
+    r.hset("alice", "item", "x")
+    r.set("session:abc", "x")
+    r.set("00000009-aaaa-bbbb-cccc-dddddddddddd", "x")
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptedMigration(SharedListMigration):
+    """Stops in the batch after `batches` completed ones."""
+
+    def __init__(self, batches):
+        self.batches = batches
+
+    def write(self, pipe, key, values):
+        if self.batches == 0:
+            raise Interrupted()
+        super().write(pipe, key, values)
+
+
+def testAbstract():
+    with pytest.raises(TypeError):
+        KeyMigration()  # type: ignore
+
+
+def testSharedLists(r, state, sharedLists):
+    progress = runMigration(SharedListMigration(), batchSize=2)
+
+    assert progress.migrated == len(LIST_IDS)
+    for listId in LIST_IDS:
+        assert not r.exists(listId)
+        assert r.hgetall(f"shared:{listId}") == {"item": "x"}
+    assert r.exists("alice", "session:abc", "00000009-aaaa-bbbb-cccc-dddddddddddd") == 3
+    assert not state.exists(checkpointKey("shared-lists"))
+    # a second run finds nothing left to do
+    assert runMigration(SharedListMigration()).migrated == 0
+
+
+def testDryRun(r, state, sharedLists):
+    keys = sorted(r.keys())
+
+    assert runMigration(SharedListMigration(), dryRun=True).migrated == len(LIST_IDS)
+    assert sorted(r.keys()) == keys
+    assert state.keys() == []
+
+
+def testExistingTargetIsSkipped(r, sharedLists):
+    r.hset(f"shared:{LIST_IDS[0]}", "newer", "y")
+
+    assert runMigration(SharedListMigration()).migrated == len(LIST_IDS) - 1
+    assert r.hgetall(f"shared:{LIST_IDS[0]}") == {"newer": "y"}
+    assert r.exists(LIST_IDS[0])
+
+
+def testRenameLostAgainstConcurrentWrite(r, sharedLists):
+    class Racing(SharedListMigration):
+        def write(self, pipe, key, values):
+            super().write(pipe, key, values)
+            if key == LIST_IDS[1]:
+                # the list was shared again between the read and the write
+                r.hset(f"shared:{key}", "newer", "y")
+
+    # counted from the RENAMENX results, not from what was queued
+    assert runMigration(Racing()).migrated == len(LIST_IDS) - 1
+    assert r.hgetall(f"shared:{LIST_IDS[1]}") == {"newer": "y"}
+
+
+def testResume(r, state, sharedLists, monkeypatch):
+    migration = InterruptedMigration(batches=1)
+    migrateBatch = redis_migration.migrateBatch
+
+    def countBatches(*args):
+        migrated = migrateBatch(*args)
+        migration.batches -= 1
+        return migrated
+
+    monkeypatch.setattr(redis_migration, "migrateBatch", countBatches)
+    with pytest.raises(Interrupted):
+        runMigration(migration, batchSize=2)
+    saved = state.hgetall(checkpointKey("shared-lists"))
+    assert 0 < int(saved["migrated"]) < len(LIST_IDS)
+
+    monkeypatch.setattr(redis_migration, "migrateBatch", migrateBatch)
+    progress = runMigration(SharedListMigration(), batchSize=2)
+    # continues with the counters of the interrupted run
+    assert progress.migrated == len(LIST_IDS)
+    assert all(r.exists(f"shared:{listId}") for listId in LIST_IDS)
+    assert not state.exists(checkpointKey("shared-lists"))
+
+
+def testRestartIgnoresCheckpoint(r, state, sharedLists):
+    state.hset(
+        checkpointKey("shared-lists"),
+        mapping={"cursor": 12345, "scanned": 100, "migrated": 50},
+    )
+
+    progress = runMigration(SharedListMigration(), restart=True)
+
+    assert progress.migrated == len(LIST_IDS)
+    assert not state.exists(checkpointKey("shared-lists"))
+
+
+def testListIndex(r):
+    for user in ("alice", "bob", "carol"):
+        r.lpush(legacyListsKey(user), json.dumps({"id": user, "name": "Private"}))
+
+    class Racing(ListIndexMigration):
+        def write(self, pipe, key, values):
+            super().write(pipe, key, values)
+            if key == legacyListsKey("carol"):
+                # the api converted the key between the read and the write
+                r.delete(key)
+
+    assert runMigration(Racing()).migrated == 2
+    for user in ("alice", "bob", "carol"):
+        namesKey, activityKey = listIndexKeys(user)
+        assert r.hgetall(namesKey) == {user: "Private"}
+        assert r.zrange(activityKey, 0, -1) == [user]
+        assert not r.exists(legacyListsKey(user))
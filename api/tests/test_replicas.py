@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+
+from replicas import (
+    SERVER_SESSION_STATE_CHANGED,
+    GtidTrackingConnection,
+    parseHosts,
+    trackedGtid,
+)
+
+AUTOCOMMIT = 0x0002
+
+
+def lengthEncoded(data: bytes) -> bytes:
+    assert len(data) < 0xFB
+    return bytes([len(data)]) + data
+
+
+def okRest(*changes: tuple[int, bytes], info=b"") -> bytes:
+    """An OK packet after the warning count, as MariaDB sends it."""
+    state = b"".join(bytes([kind]) + lengthEncoded(data) for kind, data in changes)
+    return lengthEncoded(info) + lengthEncoded(state)
+
+
+def variable(name: bytes, value: bytes) -> tuple[int, bytes]:
+    return 0, lengthEncoded(name) + lengthEncoded(value)
+
+
+def testTrackedGtid():
+    rest = okRest(
+        # the schema and another variable come first
+        (1, lengthEncoded(b"recipes")),
+        variable(b"autocommit", b"OFF"),
+        variable(b"last_gtid", b"0-1-42"),
+    )
+
+    assert trackedGtid(AUTOCOMMIT | SERVER_SESSION_STATE_CHANGED, rest) == "0-1-42"
+
+
+def testNotTracked():
+    assert trackedGtid(AUTOCOMMIT, okRest()) is None
+    rest = okRest(variable(b"autocommit", b"OFF"))
+    assert trackedGtid(SERVER_SESSION_STATE_CHANGED, rest) is None
+    rest = okRest(variable(b"last_gtid", b""))
+    assert trackedGtid(SERVER_SESSION_STATE_CHANGED, rest) is None
+
+
+def testLongLengths():
+    gtid = b"0-1-" + b"9" * 300
+    data = b"\x09last_gtid" + b"\xfc" + len(gtid).to_bytes(2, "little") + gtid
+    state = b"\x00" + b"\xfc" + len(data).to_bytes(2, "little") + data
+    rest = b"\x00" + b"\xfc" + len(state).to_bytes(2, "little") + state
+
+    assert trackedGtid(SERVER_SESSION_STATE_CHANGED, rest) == gtid.decode()
+
+
+@pytest.mark.parametrize(
+    "rest, expected", [(okRest(variable(b"last_gtid", b"0-1-7")), "0-1-7"), (b"", None)]
+)
+def testCommitReadsTheOkPacket(rest, expected):
+    conn = GtidTrackingConnection.__new__(GtidTrackingConnection)
+    sent = []
+    status = SERVER_SESSION_STATE_CHANGED if rest else 0
+    conn._execute_command = lambda command, sql: sent.append(sql)  # type: ignore
+    conn._read_ok_packet = lambda: SimpleNamespace(  # type: ignore
+        server_status=status, message=rest
+    )
+    conn.lastGtid = "0-1-1"
+
+    conn.commit()
+
+    assert sent == ["COMMIT"]
+    assert conn.lastGtid == expected
+
+
+def testParseHosts():
+    assert parseHosts(" db-replica, 10.0.0.2:3307,") == [
+        ("db-replica", 3306),
+        ("10.0.0.2", 3307),
+    ]
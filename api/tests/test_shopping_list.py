@@ -0,0 +1,189 @@
+import itertools
+import json
+
+import pytest
+
+import shopping_list
+from redis_clients import SHOPPING_LISTS_DB
+from shopping_list import (
+    ARCHIVE_AFTER,
+    ARCHIVE_KEEP,
+    ShoppingListIndex,
+    ShoppingListStore,
+    archiveKey,
+    legacyListsKey,
+    listIndexKeys,
+    queueLegacyMigration,
+)
+
+LIST_ID = "00000000-aaaa-bbbb-cccc-dddddddddddd"
+
+
+@pytest.fixture
+def store(redisClient):
+    return ShoppingListStore(redisClient(SHOPPING_LISTS_DB))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    class Clock:
+        now = 1_700_000_000
+
+    monkeypatch.setattr(shopping_list.time, "time", lambda: Clock.now)
+    return Clock
+
+
+def item(itemId, checked=False, position=0):
+    return {
+        "id": itemId,
+        "text": itemId.capitalize(),
+        "checked": checked,
+        "position": position,
+        "addedTime": "2026-01-01T10:00:00.000Z",
+    }
+
+
+def testMaintainArchivesCheckedItems(store, clock):
+    store.setItems("alice", [item("milch", checked=True), item("brot")])
+    clock.now += 60
+    store.setItems("alice", [item("eier", checked=True, position=1)])
+    clock.now += ARCHIVE_AFTER + 30
+
+    assert store.maintain("alice") == [item("brot")]
+    # the most recently checked first
+    assert store.getArchive("alice") == [
+        item("eier", checked=True, position=1),
+        item("milch", checked=True),
+    ]
+    assert 0 < store.r.ttl(archiveKey("alice")) <= ARCHIVE_KEEP
+
+
+def testMaintainKeepsRecentlyChecked(store, clock):
+    store.setItems("alice", [item("milch", checked=True)])
+    clock.now += ARCHIVE_AFTER - 30
+
+    assert store.maintain("alice") == [item("milch", checked=True)]
+    assert store.getArchive("alice") == []
+
+
+def testArchiveEndpoints(apiClient, apiModule, clock):
+    store = apiModule.shoppingListStore
+    for key in ("alice", f"shared:{LIST_ID}"):
+        store.setItems(key, [item("milch", checked=True)])
+    clock.now += ARCHIVE_AFTER + 30
+    for key in ("alice", f"shared:{LIST_ID}"):
+        store.maintain(key)
+
+    assert apiClient.get("/shoppingList/archive").json == [item("milch", True)]
+    assert apiClient.get(f"/shoppingLists/{LIST_ID}/archive").json == [
+        item("milch", True)
+    ]
+    # neither another user's private list nor an arbitrary key
+    assert apiClient.get("/shoppingLists/bob/archive").status_code == 401
+    assert apiClient.get("/shoppingLists/session:x/archive").status_code == 401
+
+
+def testRegisterRejectsColon(apiClient, mysql):
+    response = apiClient.post(
+        "/users", json={"username": "archive:alice", "password": "correct horse"}
+    )
+
+    assert response.status_code == 400
+    assert mysql.executed == []
+
+
+@pytest.fixture
+def r(redisClient):
+    return redisClient(SHOPPING_LISTS_DB, decode=True)
+
+
+def legacyEntries(*lists):
+    return [json.dumps({"id": listId, "name": name}) for listId, name in lists]
+
+
+def testQueueLegacyMigration(r):
+    raw = legacyEntries(("b", "Baumarkt"), ("a", "Aldi"), ("b", "stale name"))
+    raw.insert(1, "not json")
+    raw.append(json.dumps({"name": "no id"}))
+    r.rpush(legacyListsKey("alice"), *raw)
+
+    pipe = r.pipeline()
+    assert queueLegacyMigration(pipe, "alice", raw) == 2
+    pipe.execute()
+
+    namesKey, activityKey = listIndexKeys("alice")
+    # the first (most recently pushed) entry of a list wins
+    assert r.hgetall(namesKey) == {"b": "Baumarkt", "a": "Aldi"}
+    assert r.zrevrange(activityKey, 0, -1) == ["b", "a"]
+    assert not r.exists(legacyListsKey("alice"))
+
+
+def testQueueLegacyMigrationKeepsActivity(r):
+    namesKey, activityKey = listIndexKeys("alice")
+    r.zadd(activityKey, {"a": 5})
+
+    pipe = r.pipeline()
+    queueLegacyMigration(pipe, "alice", legacyEntries(("a", "Aldi"), ("b", "Bio")))
+    pipe.execute()
+
+    assert r.zscore(activityKey, "a") == 5
+    assert r.hget(namesKey, "b") == "Bio"
+
+
+def testQueueLegacyMigrationNothingValid(r):
+    r.rpush(legacyListsKey("alice"), "garbage")
+
+    pipe = r.pipeline()
+    assert queueLegacyMigration(pipe, "alice", ["garbage"]) == 0
+    pipe.execute()
+
+    assert r.keys() == []
+
+
+def testGetListsCreatesPrivateList(r):
+    assert ShoppingListIndex(r).getLists("alice") == [
+        {"id": "alice", "name": "Private"}
+    ]
+
+
+def testGetListsMigratesLegacyNextToIndex(r):
+    index = ShoppingListIndex(r)
+    # e.g. a shared list opened before the index was ever read
+    index.addList("alice", "shared", "Shared")
+    r.rpush(legacyListsKey("alice"), *legacyEntries(("alice", "Private")))
+
+    lists = index.getLists("alice")
+
+    assert {"id": "alice", "name": "Private"} in lists
+    assert {"id": "shared", "name": "Shared"} in lists
+    assert not r.exists(legacyListsKey("alice"))
+
+
+def testGetListsWithReader(r, redisClient, monkeypatch):
+    clock = itertools.count(1)
+    monkeypatch.setattr(shopping_list.time, "time", lambda: next(clock))
+    reader = redisClient(SHOPPING_LISTS_DB, decode=True)
+    index = ShoppingListIndex(r, reader)
+    index.addList("alice", "a", "Aldi")
+    index.addList("alice", "b", "Bio")
+    index.touch("alice", "a")
+
+    assert index.getLists("alice") == [
+        {"id": "a", "name": "Aldi"},
+        {"id": "b", "name": "Bio"},
+    ]
+
+
+@pytest.mark.parametrize("key", listIndexKeys("alice"))
+def testUsernameOfAnotherUsersIndex(apiClient, mysql, r, key):
+    ShoppingListIndex(r).addList("alice", "a", "Aldi")
+    index = {k: r.dump(k) for k in listIndexKeys("alice")}
+
+    response = apiClient.post(
+        "/users", json={"username": key, "password": "correct horse"}
+    )
+
+    # such a user would stream the index as its private list and write into it
+    assert response.status_code == 400
+    assert mysql.executed == []
+    assert {k: r.dump(k) for k in listIndexKeys("alice")} == index
@@ -0,0 +1,91 @@
+import datetime
+import json
+import threading
+
+import pytest
+
+from snapshot import GroupSnapshots
+
+GROUP_ID = 7
+
+
+@pytest.fixture
+def db(apiModule, mysql, monkeypatch):
+    monkeypatch.setattr(apiModule.db, "snapshots", GroupSnapshots())
+    return apiModule.db
+
+
+def recipeRow(title):
+    return {
+        "id": 42,
+        "title": title,
+        "categoryId": 1,
+        "ingredients": "",
+        "description": "",
+        "image": "",
+        "date": datetime.datetime(2026, 1, 1),
+        "userId": 3,
+        "groupId": GROUP_ID,
+        **{
+            f"imageMeta_{field}": None
+            for field in ("width", "height", "bytes", "color", "placeholder")
+        },
+    }
+
+
+def titles(body):
+    return [recipe["title"] for recipe in json.loads(body)["recipes"]]
+
+
+def testRefreshesDoNotInterleave(db, mysql):
+    """A refresh re-reading a row before a write must not overwrite a later one."""
+    current = {"title": "v1"}
+    reading = threading.Event()
+    release = threading.Event()
+    blockNextRead = False
+
+    def recipes(args):
+        nonlocal blockNextRead
+        rows = [recipeRow(current["title"])]
+        if blockNextRead:
+            blockNextRead = False
+            reading.set()
+            release.wait(5)
+        return [rows]
+
+    mysql.script = [
+        ("SELECT `groupId`, `readOnly`", [[{"groupId": GROUP_ID, "readOnly": 0}]]),
+        ("SELECT `id`, `user`, `readOnly`", [[]]),
+        ("SELECT * FROM `category`", [[]]),
+        ("SELECT `recipe`.*", recipes),
+        ("SELECT * FROM `comment`", [[]]),
+        # the blocked re-read is slow enough to be explained
+        ("EXPLAIN", [[]]),
+    ]
+    assert titles(db.getBootstrap("alice")) == ["v1"]
+
+    current["title"] = "v2"
+    db.snapshots.markDirty(GROUP_ID, "recipes", 42)
+    blockNextRead = True
+    bodies = []
+
+    def bootstrap():
+        bodies.append(titles(db.getBootstrap("alice")))
+
+    first = threading.Thread(target=bootstrap)
+    first.start()
+    assert reading.wait(5)
+    # written while the first refresh still holds the row as "v2"
+    current["title"] = "v3"
+    db.snapshots.markDirty(GROUP_ID, "recipes", 42)
+    second = threading.Thread(target=bootstrap)
+    second.start()
+    second.join(0.2)
+    # waits for the first refresh instead of re-reading concurrently
+    assert second.is_alive()
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    assert bodies == [["v2"], ["v3"]]
+    assert titles(db.getBootstrap("alice")) == ["v3"]
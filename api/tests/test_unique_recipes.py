@@ -0,0 +1,24 @@
+from redis_clients import UNIQUE_RECIPES_DB
+
+RECIPE = {"title": "Brot", "ingredients": "500 g Mehl", "description": ""}
+
+
+def testShareAgainRefreshesTtlOnly(apiClient, apiModule, redisClient):
+    r = redisClient(UNIQUE_RECIPES_DB)
+    createdId = apiClient.post("/uniqueRecipes", json=RECIPE).json["createdId"]
+    # stands for an entry shared a while ago
+    r.set(createdId, b"stored", ex=60)
+
+    # the same content, in another key order
+    shared = apiClient.post("/uniqueRecipes", json=dict(reversed(RECIPE.items())))
+
+    assert shared.json["createdId"] == createdId
+    assert r.get(createdId) == b"stored"
+    assert r.ttl(createdId) > apiModule.UNIQUE_RECIPE_TTL - 60
+
+
+def testSharedRecipeRoundTrip(apiClient):
+    createdId = apiClient.post("/uniqueRecipes", json=RECIPE).json["createdId"]
+
+    assert apiClient.get(f"/uniqueRecipes/{createdId}").json == RECIPE
+    assert apiClient.get("/uniqueRecipes/unknown").status_code == 404
@@ -0,0 +1,241 @@
+"""Statements per write request, counted on a fake MariaDB connection.
+
+Every write endpoint is meant to cost a fixed number of round trips to the
+database, whatever the recipe or the user. The requests go through the Flask
+test client, so the count covers everything the endpoint runs (identity and
+access checks included), not just the `Database` method.
+"""
+
+import datetime
+import io
+
+import pytest
+from PIL import Image
+
+from changes import changeKey
+from query_profile import fingerprint, profiler
+from redis_clients import CHANGES_DB
+
+GROUP_ID = 7
+
+RECIPE_ROW = {
+    "id": 42,
+    "title": "Brot",
+    "categoryId": 1,
+    "ingredients": "500 g Mehl\n1 TL Salz",
+    "description": "",
+    "image": "abc.jpg",
+    "date": datetime.datetime(2026, 1, 1),
+    "userId": 3,
+    "groupId": GROUP_ID,
+    "imageMeta_width": 800,
+    "imageMeta_height": 600,
+    "imageMeta_bytes": 12345,
+    "imageMeta_color": "#a0522d",
+    "imageMeta_placeholder": "data:image/jpeg;base64,AAAA",
+}
+
+RECIPE = {
+    "title": "Brot",
+    "categoryId": 1,
+    "ingredients": RECIPE_ROW["ingredients"],
+    "description": "",
+    "image": "abc.jpg",
+}
+
+# an UPDATE can not return the group of its row, it is the writer's
+WRITER_GROUP = ("SELECT `groupId` FROM `user`", [[{"groupId": GROUP_ID}]])
+# answers the access check that follows a write matching no row
+READ_ONLY = ("SELECT `readOnly` FROM `user`", [[{"readOnly": 1}]])
+
+
+@pytest.fixture(autouse=True)
+def noPush(apiModule, monkeypatch):
+    # new recipes are pushed from a thread, outside of the request
+    monkeypatch.setattr(apiModule, "notifyNewRecipe", lambda **kwargs: None)
+
+
+@pytest.fixture
+def changes(redisClient):
+    r = redisClient(CHANGES_DB, decode=True)
+    return lambda: [
+        (fields["kind"], fields["op"]) for _, fields in r.xrange(changeKey(GROUP_ID))
+    ]
+
+
+def testInsertRecipe(apiClient, mysql, changes):
+    mysql.script = [
+        ("INSERT INTO recipe(", [[dict(RECIPE_ROW)]]),
+        ("INSERT INTO `recipe_ingredient`", [2]),
+    ]
+
+    response = apiClient.post("/recipes", json=RECIPE)
+
+    assert response.status_code == 200
+    assert len(mysql.executed) == 2
+    assert "insertRecipe" in profiler.statements[fingerprint(mysql.executed[0])].methods
+    assert response.json["id"] == 42
+    assert response.json["imageMeta"] == {
+        "width": 800,
+        "height": 600,
+        "bytes": 12345,
+        "color": "#a0522d",
+        "placeholder": "data:image/jpeg;base64,AAAA",
+    }
+    assert changes() == [("recipes", "insert")]
+
+
+def testInsertRecipeWithoutIngredients(apiClient, mysql):
+    row = {**RECIPE_ROW, "ingredients": "", "image": ""}
+    for key in row:
+        if key.startswith("imageMeta_"):
+            row[key] = None
+    mysql.script = [("INSERT INTO recipe(", [[row]])]
+
+    response = apiClient.post("/recipes", json={**RECIPE, "ingredients": ""})
+
+    # nothing to index
+    assert len(mysql.executed) == 1
+    assert response.json["imageMeta"] is None
+
+
+def testInsertRecipeReadOnly(apiClient, mysql, changes):
+    mysql.script = [("INSERT INTO recipe(", [[]])]
+
+    assert apiClient.post("/recipes", json=RECIPE).status_code == 403
+    assert len(mysql.executed) == 1
+    assert changes() == []
+
+
+def testUpdateRecipe(apiClient, mysql, changes):
+    mysql.script = [
+        ("UPDATE `recipe`", [1]),
+        WRITER_GROUP,
+        ("DELETE FROM `recipe_ingredient`", [2]),
+        ("INSERT INTO `recipe_ingredient`", [2]),
+    ]
+
+    assert apiClient.put("/recipes/42", json=RECIPE).status_code == 200
+    assert len(mysql.executed) == 4
+    assert changes() == [("recipes", "update")]
+
+
+def testUpdateRecipeReadOnly(apiClient, mysql, changes):
+    mysql.script = [("UPDATE `recipe`", [0]), READ_ONLY]
+
+    assert apiClient.put("/recipes/42", json=RECIPE).status_code == 403
+    assert len(mysql.executed) == 2
+    assert changes() == []
+
+
+def testDeleteRecipe(apiClient, mysql, changes):
+    mysql.script = [
+        ("DELETE FROM `recipe`", [[{"image": "abc.jpg", "groupId": GROUP_ID}]]),
+        # the image is still used by another recipe
+        ("SELECT COUNT(*)", [[{"c": 1}]]),
+    ]
+
+    assert apiClient.delete("/recipes/42").status_code == 204
+    assert len(mysql.executed) == 2
+    assert changes() == [("recipes", "delete")]
+
+
+def testDeleteRecipeWithoutImage(apiClient, mysql, changes):
+    mysql.script = [("DELETE FROM `recipe`", [[{"image": "", "groupId": GROUP_ID}]])]
+
+    assert apiClient.delete("/recipes/42").status_code == 204
+    assert len(mysql.executed) == 1
+
+
+def testDeleteRecipeNotFound(apiClient, mysql, changes):
+    mysql.script = [
+        ("DELETE FROM `recipe`", [[]]),
+        ("SELECT `readOnly` FROM `user`", [[{"readOnly": 0}]]),
+    ]
+
+    assert apiClient.delete("/recipes/42").status_code == 404
+    assert len(mysql.executed) == 2
+    assert changes() == []
+
+
+def testAddComment(apiClient, mysql, changes):
+    row = {"id": 5, "text": "lecker", "userId": 3, "recipeId": 42, "groupId": GROUP_ID}
+    mysql.script = [("INSERT INTO comment(", [[row]])]
+
+    response = apiClient.post("/comments", json={"text": "lecker", "recipeId": 42})
+
+    assert response.status_code == 200
+    assert len(mysql.executed) == 1
+    assert response.json["id"] == 5
+    assert changes() == [("comments", "insert")]
+
+
+def testUpdateComment(apiClient, mysql, changes):
+    mysql.script = [("UPDATE `comment`", [1]), WRITER_GROUP]
+
+    assert apiClient.put("/comments/5", json={"text": "sehr lecker"}).status_code == 200
+    assert len(mysql.executed) == 2
+    assert changes() == [("comments", "update")]
+
+
+def testUpdateCommentReadOnly(apiClient, mysql, changes):
+    # the writer's group is not looked up for an update that matched nothing
+    mysql.script = [("UPDATE `comment`", [0]), READ_ONLY]
+
+    assert apiClient.put("/comments/5", json={"text": "sehr lecker"}).status_code == 403
+    assert len(mysql.executed) == 2
+    assert changes() == []
+
+
+def testDeleteComment(apiClient, mysql, changes):
+    mysql.script = [("DELETE FROM `comment`", [[{"groupId": GROUP_ID}]])]
+
+    assert apiClient.delete("/comments/5").status_code == 204
+    assert len(mysql.executed) == 1
+    assert changes() == [("comments", "delete")]
+
+
+def testDeleteCommentReadOnly(apiClient, mysql, changes):
+    mysql.script = [("DELETE FROM `comment`", [[]]), READ_ONLY]
+
+    assert apiClient.delete("/comments/5").status_code == 403
+    assert len(mysql.executed) == 2
+    assert changes() == []
+
+
+def testInsertCategory(apiClient, mysql, changes):
+    mysql.script = [("INSERT INTO category(", [[{"id": 9, "groupId": GROUP_ID}]])]
+
+    response = apiClient.post("/categories", json={"name": "Brot"})
+
+    assert response.json == {"id": 9}
+    assert len(mysql.executed) == 1
+    assert changes() == [("categories", "insert")]
+
+
+def testRegister(apiClient, mysql):
+    mysql.script = [("INSERT INTO `user`", [1])]
+
+    response = apiClient.post(
+        "/users", json={"username": "carol", "password": "correct horse"}
+    )
+
+    assert response.status_code == 200
+    assert len(mysql.executed) == 1
+
+
+def testUploadImage(apiClient, apiModule, mysql, tmp_path, monkeypatch):
+    monkeypatch.setattr(apiModule, "storeImagePath", lambda name: str(tmp_path / name))
+    mysql.script = [
+        ("SELECT `readOnly` FROM `user`", [[{"readOnly": 0}]]),
+        ("INSERT INTO `image`", [1]),
+    ]
+    image = io.BytesIO()
+    Image.new("RGB", (4, 3), "#a0522d").save(image, format="JPEG")
+    image.seek(0)
+
+    response = apiClient.post("/images", data={"image": (image, "brot.jpg")})
+
+    assert response.status_code == 201
+    # the access check and the image's metadata
+    assert len(mysql.executed) == 2
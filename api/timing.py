@@ -0,0 +1,127 @@
+"""Per-request phase timing, reported as a Server-Timing header.
+
+A sampled fraction of requests (SERVER_TIMING_SAMPLE_RATE, 0..1, default 0)
+records how long each phase took: session load, auth (PBKDF2), db connect and
+identity lookup, every SQL statement, marshal, JSON encoding, compression and
+image decode/resize/encode. Repeated phases are summed and counted. The result
+is sent as `Server-Timing` (visible in the browser's network tab) and logged as
+one JSON line.
+
+For requests that are not sampled `phase` only checks a flag on `g`, so the
+instrumentation can stay in place.
+"""
+
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Flask, g, has_app_context, request
+from flask.json.provider import DefaultJSONProvider
+from rich.console import Console
+from rich.logging import RichHandler
+
+SAMPLE_RATE = float(os.environ.get("SERVER_TIMING_SAMPLE_RATE", 0))
+
+logger = logging.getLogger("recipes.timing")
+logger.handlers = [RichHandler(logging.INFO, markup=True, console=Console(width=250))]
+logger.setLevel(logging.INFO)
+
+
+def startTiming():
+    """Decide once per request whether it is sampled."""
+    if "timings" not in g:
+        g.timings = {} if random.random() < SAMPLE_RATE else None
+        g.timingStart = time.perf_counter()
+
+
+@contextmanager
+def phase(name: str):
+    if not has_app_context():
+        yield
+        return
+    startTiming()
+    if g.timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        total, count = g.timings.get(name, (0.0, 0))
+        g.timings[name] = (total + time.perf_counter() - start, count + 1)
+
+
+def timed(name: str):
+    """Decorator form of `phase`."""
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return f(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        with phase("json"):
+            return super().dumps(obj, **kwargs)
+
+
+def serverTimingHeader(timings: dict[str, tuple[float, int]], total: float) -> str:
+    metrics = []
+    for name, (duration, count) in timings.items():
+        metric = f"{name};dur={duration * 1000:.1f}"
+        if count > 1:
+            metric += f';desc="{count}x"'
+        metrics.append(metric)
+    metrics.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(metrics)
+
+
+def initTiming(app: Flask):
+    """Hook the session interface and register the reporting after_request.
+
+    Has to run before compression is registered (after_request handlers run in
+    reverse order, so reporting then sees the compression phase) and after
+    the session interface is configured.
+    """
+    sessionInterface = app.session_interface
+    openSession = sessionInterface.open_session
+
+    def timedOpenSession(app, request):
+        startTiming()
+        with phase("session"):
+            return openSession(app, request)
+
+    sessionInterface.open_session = timedOpenSession  # type: ignore
+
+    @app.after_request
+    def reportTiming(response):
+        timings = g.get("timings")
+        if timings is None:
+            return response
+        total = time.perf_counter() - g.timingStart
+        response.headers["Server-Timing"] = serverTimingHeader(timings, total)
+        logger.info(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "total": round(total * 1000, 1),
+                    "phases": {
+                        name: round(duration * 1000, 1)
+                        for name, (duration, _) in timings.items()
+                    },
+                }
+            )
+        )
+        return response
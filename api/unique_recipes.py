@@ -0,0 +1,55 @@
+"""Shared ("unique") recipes, stored in redis db 1.
+
+A shared recipe is a copy of the recipe the client posted, keyed by a hash of
+its canonical JSON and kept for UNIQUE_RECIPE_TTL after it was last shared. It
+outlives the recipe it was copied from, so its image does too: the image
+garbage collector (manage_images.py gc) marks the images of shared recipes as
+referenced.
+"""
+
+import json
+import zlib
+from typing import cast
+
+import redis
+
+# Shared recipes are stored zlib-compressed behind this marker byte (which can
+# never start a JSON document) so entries written before compression still load.
+UNIQUE_RECIPE_COMPRESSED = b"\x01"
+UNIQUE_RECIPE_TTL = 60 * 60 * 24 * 30  # 30 days valid
+
+
+def packUniqueRecipe(payload: bytes) -> bytes:
+    return UNIQUE_RECIPE_COMPRESSED + zlib.compress(payload, 9)
+
+
+def unpackUniqueRecipe(stored: bytes) -> bytes:
+    if stored.startswith(UNIQUE_RECIPE_COMPRESSED):
+        return zlib.decompress(stored[len(UNIQUE_RECIPE_COMPRESSED) :])
+    return stored
+
+
+def sharedRecipeImages(r: redis.StrictRedis, batchSize: int = 500) -> set[str]:
+    """The image names of all shared recipes."""
+    images = set()
+    batch: list[bytes] = []
+
+    def readBatch():
+        for stored in cast(list[bytes | None], r.mget(batch)):
+            if stored is None:
+                continue  # expired since the scan
+            try:
+                image = json.loads(unpackUniqueRecipe(stored)).get("image")
+            except (ValueError, zlib.error, AttributeError):
+                continue
+            if isinstance(image, str) and image:
+                images.add(image)
+        batch.clear()
+
+    for key in r.scan_iter(count=batchSize):
+        batch.append(key)
+        if len(batch) >= batchSize:
+            readBatch()
+    if batch:
+        readBatch()
+    return images
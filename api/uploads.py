@@ -0,0 +1,165 @@
+"""Resumable, size-capped image uploads.
+
+Large photos over mobile connections often fail halfway. Instead of one
+multipart POST they can be uploaded with an offset-based protocol:
+
+    POST   /uploads       {"size": <bytes>}    -> 201 {"id": ..., "offset": 0}
+    PATCH  /uploads/<id>  Upload-Offset: <n>, body: the file's bytes from n on
+                          -> 204 with the new Upload-Offset header, or
+                             201 {"name": ...} once all bytes arrived
+    GET    /uploads/<id>  -> {"offset": ..., "size": ...} to resume after an error
+    DELETE /uploads/<id>
+
+The request body is streamed into UPLOAD_FOLDER/<id> and never parsed or held in
+memory. Whatever arrived before a connection dropped is kept, so the client asks
+for the offset and continues from there. Uploads larger than UPLOAD_MAX_BYTES are
+refused when they are created, and a file not starting with the magic bytes of a
+supported image format is rejected as soon as its first bytes arrived.
+Unfinished uploads are removed after UPLOAD_TTL.
+"""
+
+import fcntl
+import json
+import os
+import re
+import time
+from typing import IO
+from uuid import uuid4
+
+from werkzeug.exceptions import ClientDisconnected
+
+UPLOAD_FOLDER = "../uploads/"
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 30 * 1024 * 1024))
+UPLOAD_TTL = 24 * 60 * 60
+CHUNK_SIZE = 64 * 1024
+
+UPLOAD_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+# bytes needed to recognise every format below
+MAGIC_LENGTH = 12
+
+
+class UploadError(Exception):
+    def __init__(self, message: str, status: int):
+        super().__init__(message, status)
+        self.message = message
+        self.status = status
+
+
+def isImageHeader(head: bytes) -> bool:
+    """Whether `head` starts like a JPEG, PNG, GIF or WebP file."""
+    return (
+        head.startswith(b"\xff\xd8\xff")
+        or head.startswith(b"\x89PNG\r\n\x1a\n")
+        or head.startswith((b"GIF87a", b"GIF89a"))
+        or (head.startswith(b"RIFF") and head[8:12] == b"WEBP")
+    )
+
+
+def partPath(uploadId: str) -> str:
+    return UPLOAD_FOLDER + uploadId
+
+
+def metaPath(uploadId: str) -> str:
+    return UPLOAD_FOLDER + uploadId + ".json"
+
+
+def expireUploads():
+    """Remove uploads that were not finished within UPLOAD_TTL."""
+    cutoff = time.time() - UPLOAD_TTL
+    with os.scandir(UPLOAD_FOLDER) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+
+
+def createUpload(userName: str, size: int) -> str:
+    if size <= 0:
+        raise UploadError("Empty upload", 400)
+    if size > UPLOAD_MAX_BYTES:
+        raise UploadError(f"Images are limited to {UPLOAD_MAX_BYTES} bytes", 413)
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    expireUploads()
+    uploadId = uuid4().hex
+    with open(metaPath(uploadId), "w") as f:
+        json.dump({"user": userName, "size": size}, f)
+    open(partPath(uploadId), "wb").close()
+    return uploadId
+
+
+def getUpload(userName: str, uploadId: str) -> tuple[int, int]:
+    """(bytes received, total size) of one of the user's uploads."""
+    if not UPLOAD_ID_RE.fullmatch(uploadId):
+        raise UploadError("Not found", 404)
+    try:
+        with open(metaPath(uploadId)) as f:
+            meta = json.load(f)
+        offset = os.path.getsize(partPath(uploadId))
+    except (OSError, ValueError):
+        raise UploadError("Not found", 404)
+    if meta["user"] != userName:
+        raise UploadError("Not found", 404)
+    return offset, meta["size"]
+
+
+def appendUpload(
+    userName: str,
+    uploadId: str,
+    offset: int,
+    stream: IO[bytes],
+    contentLength: int | None,
+) -> tuple[int, int]:
+    """Write the request body at `offset`, returns (bytes received, total size).
+
+    A dropped connection ends the write early, the bytes read so far are kept.
+    """
+    received, size = getUpload(userName, uploadId)
+    if offset != received:
+        raise UploadError(f"Upload is at offset {received}", 409)
+    if contentLength is not None and offset + contentLength > size:
+        raise UploadError("More bytes than announced", 413)
+    with open(partPath(uploadId), "ab") as f:
+        try:
+            # a retry may arrive while the dropped request is still being read
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError("Upload is in progress", 409)
+        try:
+            while received < size:
+                try:
+                    chunk = stream.read(min(CHUNK_SIZE, size - received))
+                except (ClientDisconnected, OSError):
+                    # client disconnected, keep what arrived (a body over the
+                    # size limit raises RequestEntityTooLarge, which propagates)
+                    break
+                if not chunk:
+                    break
+                start = received
+                f.write(chunk)
+                received += len(chunk)
+                # checked once, as soon as the header is complete
+                if start < MAGIC_LENGTH and (
+                    received >= MAGIC_LENGTH or received == size
+                ):
+                    f.flush()
+                    with open(partPath(uploadId), "rb") as head:
+                        if not isImageHeader(head.read(MAGIC_LENGTH)):
+                            discardUpload(uploadId)
+                            raise UploadError("File isn't an image", 400)
+        finally:
+            f.flush()
+            fcntl.flock(f, fcntl.LOCK_UN)
+    return received, size
+
+
+def removeUpload(userName: str, uploadId: str):
+    getUpload(userName, uploadId)
+    discardUpload(uploadId)
+
+
+def discardUpload(uploadId: str):
+    for path in (partPath(uploadId), metaPath(uploadId)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
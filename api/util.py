@@ -1,20 +1,47 @@
+import json
 import logging
 import os
 
 import pymysql
-from flask import make_response
-from flask_restful import fields, marshal
+from flask import has_request_context, make_response, session
+from flask_restful import fields
+from flask_restful import marshal as _marshal
 from passlib.hash import pbkdf2_sha256
+from pymysql.constants import CLIENT
 from rich.console import Console
 from rich.logging import RichHandler
 
+from changes import ChangeLog
+from image_store import removeImage
+from ingredients import NAME_LENGTH, UNIT_LENGTH, parseIngredients
+from query_profile import ProfiledCursor
+from redis_clients import CHANGES_DB, redisClient
+from replicas import (
+    REPLICA_WAIT_SECONDS,
+    WRITE_POSITION_KEY,
+    GtidTrackingConnection,
+    replicaPoolFromEnv,
+)
+from snapshot import KINDS, GroupSnapshots, Snapshot
+from timing import phase, timed
+
 logger = logging.getLogger("recipes.util")
 logger.handlers = [RichHandler(logging.INFO, markup=True, console=Console(width=250))]
 logger.setLevel(logging.INFO)
 
+marshal = timed("marshal")(_marshal)
+
 
 class Database:
 
+    __imageMetaFields = {
+        "width": fields.Integer,
+        "height": fields.Integer,
+        "bytes": fields.Integer,
+        "color": fields.String,
+        "placeholder": fields.String,
+    }
+
     __recipeFields = {
         "id": fields.Integer,
         "title": fields.String,
@@ -24,6 +51,24 @@ class Database:
         "image": fields.String,
         "date": fields.DateTime,
         "userId": fields.Integer,
+        # null for recipes without image or before the image's metadata is known
+        "imageMeta": fields.Nested(__imageMetaFields, allow_null=True),
+    }
+
+    # joined into recipe queries as `recipe`.*, {__imageMetaColumns} ... {__imageMetaJoin}
+    __imageMetaColumns = ", ".join(
+        f"`im`.`{field}` as `imageMeta_{field}`" for field in __imageMetaFields
+    )
+    __imageMetaJoin = "LEFT JOIN `image` AS `im` ON `im`.`name` = `recipe`.`image`"
+    # RETURNING can not join, every column is looked up by the image name instead
+    __imageMetaReturning = ", ".join(
+        f"(SELECT `{field}` FROM `image` WHERE `name` = %s) as `imageMeta_{field}`"
+        for field in __imageMetaFields
+    )
+
+    __recipeListFields = {
+        **__recipeFields,
+        "commentCount": fields.Integer(default=0),
     }
 
     __categoryFields = {
@@ -47,34 +92,211 @@ class Database:
         "editedDate": fields.DateTime,
     }
 
+    # what /bootstrap returns per group, getBootstrap appends an `id` IN (...)
+    # condition to re-read the rows marked dirty
+    __snapshotQueries = {
+        "users": "SELECT `id`, `user`, `readOnly` FROM `user` WHERE `groupId` = %s",
+        "categories": "SELECT * FROM `category` WHERE `groupId` = %s",
+        "recipes": f"SELECT `recipe`.*, {__imageMetaColumns} FROM `recipe` {__imageMetaJoin} WHERE `recipe`.`groupId` = %s",
+        "comments": "SELECT * FROM `comment` WHERE `groupId` = %s",
+    }
+    __snapshotTables = {
+        "users": "user",
+        "categories": "category",
+        "recipes": "recipe",
+        "comments": "comment",
+    }
+
     def __init__(self):
+        self.snapshots = GroupSnapshots()
+        self.changes = ChangeLog(redisClient(CHANGES_DB, decode=True))
+        self.replicas = replicaPoolFromEnv()
         self.connect()
 
-    def connect(self, username=None):
-        conn = pymysql.connect(
-            host=os.environ["MYSQL_HOST"],
-            user=os.environ["MYSQL_USER"],
-            passwd=os.environ["MYSQL_PASSWORD"],
-            db=os.environ["MYSQL_DATABASE"],
-            charset="utf8mb4",
-            cursorclass=pymysql.cursors.DictCursor,
-        )
+    def __snapshotFields(self, kind):
+        return {
+            "users": self.__userFields,
+            "categories": self.__categoryFields,
+            "recipes": self.__recipeFields,
+            "comments": self.__commentFields,
+        }[kind]
+
+    def __nestImageMeta(self, res):
+        """Move the joined `image` columns into the nested imageMeta."""
+        meta = {
+            field: res.pop(f"imageMeta_{field}", None)
+            for field in self.__imageMetaFields
+        }
+        res["imageMeta"] = meta if meta["width"] is not None else None
+        return res
+
+    def __snapshotRow(self, kind, res):
+        if kind == "recipes":
+            self.__nestImageMeta(res)
+        return marshal(res, self.__snapshotFields(kind))
+
+    def __commitChange(self, conn, groupId, kind, op, id):
+        """Commit, let the group's /bootstrap snapshot re-read the row and log the change."""
+        conn.commit()
+        self.__recordWritePosition(conn)
+        self.snapshots.markDirty(groupId, kind, id)
+        self.changes.append(groupId, kind, op, id)
+
+    # Write statements resolve the author inline instead of looking them up
+    # first, every round trip to the database host adds to the write latency.
+    # Users without write access match no row.
+    __writer = "SELECT `id`, `groupId` FROM `user` WHERE `user` = %s AND `readOnly` = 0"
+    __writerId = "(SELECT `id` FROM `user` WHERE `user` = %s AND `readOnly` = 0)"
+    __writerGroup = "SELECT `groupId` FROM `user` WHERE `user` = %s AND `readOnly` = 0;"
+
+    def __updateAsWriter(self, cur, query, args, username):
+        """Run an UPDATE restricted to the writer's rows, returns the writer's groupId
+        if it matched a row, else None.
+
+        UPDATE can not return the row's group (MariaDB has no UPDATE ... RETURNING),
+        but it only matches rows of the writer, which are in the writer's group.
+        That is selected afterwards, only for an update that matched.
+        """
+        if cur.execute(query, args) != 1:
+            return None
+        cur.execute(self.__writerGroup, [username])
+        res = cur.fetchone()
+        return res["groupId"] if res is not None else None
+
+    def getBootstrap(self, username):
+        """Status, users, categories, recipes and comments in one response body."""
+        conn, _, _ = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT `groupId`, `readOnly` FROM `user` WHERE `user` = %s;",
+                [username],
+            )
+            user = cur.fetchone()
+            if user is None:
+                return None
+            groupId = user["groupId"]
+            snapshot = self.snapshots.get(groupId)
+            if snapshot is None:
+                version = self.snapshots.version(groupId)
+                entities = {}
+                for kind in KINDS:
+                    cur.execute(self.__snapshotQueries[kind] + ";", [groupId])
+                    entities[kind] = {
+                        res["id"]: self.__snapshotRow(kind, res)
+                        for res in cur.fetchall()
+                    }
+                snapshot = Snapshot(entities)
+                self.snapshots.put(groupId, snapshot, version)
+                encoded = snapshot.encode()
+            else:
+                # a concurrent refresh could apply older rows over ours, see snapshot.py
+                with snapshot.refreshing:
+                    try:
+                        for kind, ids in snapshot.takeDirty().items():
+                            table = self.__snapshotTables[kind]
+                            placeholders = ", ".join(["%s"] * len(ids))
+                            cur.execute(
+                                self.__snapshotQueries[kind]
+                                + f" AND `{table}`.`id` IN ({placeholders});",
+                                [groupId, *ids],
+                            )
+                            rows = {
+                                res["id"]: self.__snapshotRow(kind, res)
+                                for res in cur.fetchall()
+                            }
+                            snapshot.apply(kind, ids, rows)
+                    except Exception:
+                        # the dirty ids are gone, so this snapshot can not be trusted
+                        self.snapshots.invalidate(groupId)
+                        raise
+                    encoded = snapshot.encode()
+            status = json.dumps(
+                {"username": username, "write": user["readOnly"] == 0}
+            ).encode()
+            return b'{"status": ' + status + b", " + encoded[1:]
+        finally:
+            conn.close()
+
+    def __open(self, host, port=3306, trackGtid=False, **kwargs):
+        # with replicas, commits report their GTID (see __recordWritePosition)
+        connect = GtidTrackingConnection if trackGtid else pymysql.connect
+        with phase("connect"):
+            return connect(
+                host=host,
+                port=port,
+                user=os.environ["MYSQL_USER"],
+                passwd=os.environ["MYSQL_PASSWORD"],
+                db=os.environ["MYSQL_DATABASE"],
+                charset="utf8mb4",
+                cursorclass=ProfiledCursor,
+                # UPDATE reports matched instead of changed rows
+                client_flag=CLIENT.FOUND_ROWS
+                | (CLIENT.SESSION_TRACK if trackGtid else 0),
+                **kwargs,
+            )
+
+    def __recordWritePosition(self, conn):
+        """Remember the GTID of the session's last write for replica reads."""
+        if not self.replicas.hosts or not has_request_context():
+            return
+        gtid = conn.lastGtid
+        if gtid is None:
+            # the server does not track last_gtid, ask for it
+            cur = conn.cursor()
+            cur.execute("SELECT @@last_gtid as gtid;")
+            gtid = cur.fetchone()["gtid"]
+        if gtid:
+            session[WRITE_POSITION_KEY] = gtid
+
+    def __connectReplica(self):
+        """A replica that has the session's last write, None to use the primary."""
+        host = self.replicas.pick()
+        if host is None:
+            return None
+        try:
+            conn = self.__open(*host, connect_timeout=2)
+        except pymysql.MySQLError as e:
+            logger.error(f"replica {host[0]}:{host[1]} unavailable: {e}")
+            self.replicas.markDown(host)
+            return None
+        position = session.get(WRITE_POSITION_KEY) if has_request_context() else None
+        if position:
+            cur = conn.cursor()
+            with phase("replicaWait"):
+                cur.execute(
+                    "SELECT MASTER_GTID_WAIT(%s, %s) as w;",
+                    [position, REPLICA_WAIT_SECONDS],
+                )
+                caughtUp = cur.fetchone()["w"] == 0
+            if not caughtUp:
+                conn.close()
+                return None
+        return conn
+
+    def connect(self, username=None, replica=False):
+        """Connection (and the user's id and groupId if `username` is given).
+
+        `replica` allows a read replica, only for methods that never write.
+        """
+        conn = self.__connectReplica() if replica and self.replicas.hosts else None
+        if conn is None:
+            conn = self.__open(
+                os.environ["MYSQL_HOST"], trackGtid=bool(self.replicas.hosts)
+            )
         if username is not None:
             cur = conn.cursor()
-            cur.execute("SELECT id, user, groupId FROM user;")
-            userId = -1
-            groupId = -1
-            for res in cur.fetchall():
-                if res["user"] == username:
-                    userId = res["id"]
-                    groupId = res["groupId"]
-                    break
-            return conn, userId, groupId
+            with phase("identity"):
+                cur.execute("SELECT id, groupId FROM user WHERE user = %s;", [username])
+                res = cur.fetchone()
+            if res is None:
+                return conn, -1, -1
+            return conn, res["id"], res["groupId"]
         else:
             return conn, -1, -1
 
     def getUsers(self, username, lastChecksum):
-        conn, _, groupId = self.connect(username)
+        conn, _, groupId = self.connect(username, replica=True)
         try:
             cur = conn.cursor()
             cur.execute("CHECKSUM TABLE `user`")
@@ -91,65 +313,126 @@ class Database:
             for res in cur.fetchall():
                 users.append(marshal(res, self.__userFields))
 
-            cur.execute("CHECKSUM TABLE `user`;")
-            res = cur.fetchone()
-            checksum = res["Checksum"]
             return {"users": users, "checksum": checksum}
         finally:
             conn.close()
 
+    def __recipeListChecksum(self, cur):
+        # the listing embeds comment counts, so it changes with either table
+        cur.execute("CHECKSUM TABLE `recipe`, `comment`;")
+        checksum = 0
+        for res in cur.fetchall():
+            checksum ^= res["Checksum"] or 0
+        return checksum
+
     def getRecipes(self, username, lastChecksum):
-        conn, userId, groupId = self.connect(username)
+        conn, userId, groupId = self.connect(username, replica=True)
         try:
             cur = conn.cursor()
-            cur.execute("CHECKSUM TABLE `recipe`")
-            res = cur.fetchone()
-            checksum = res["Checksum"]
+            checksum = self.__recipeListChecksum(cur)
             if lastChecksum == checksum:
                 return make_response("", 204)
 
             cur.execute(
-                "SELECT `recipe`.* FROM `recipe` JOIN `user` ON `recipe`.`userId` = `user`.`id` WHERE `groupId` = %s;",
+                "SELECT `recipeId`, COUNT(*) as c FROM `comment` WHERE `groupId` = %s GROUP BY `recipeId`;",
+                [groupId],
+            )
+            commentCounts = {res["recipeId"]: res["c"] for res in cur.fetchall()}
+            cur.execute(
+                f"SELECT `recipe`.*, {self.__imageMetaColumns} FROM `recipe` {self.__imageMetaJoin} WHERE `recipe`.`groupId` = %s;",
                 [groupId],
             )
             recipes = []
             for res in cur.fetchall():
-                recipes.append(marshal(res, self.__recipeFields))
+                res["commentCount"] = commentCounts.get(res["id"], 0)
+                self.__nestImageMeta(res)
+                recipes.append(marshal(res, self.__recipeListFields))
 
-            cur.execute("CHECKSUM TABLE `recipe`;")
-            res = cur.fetchone()
-            checksum = res["Checksum"]
             return {"recipes": recipes, "checksum": checksum}
         finally:
             conn.close()
 
     def getRecipe(self, recipeId):
-        conn, _, _ = self.connect()
+        conn, _, _ = self.connect(replica=True)
         try:
             cur = conn.cursor()
             cur.execute(
-                "SELECT * FROM `recipe`  WHERE `id` = %s;",
+                f"SELECT `recipe`.*, {self.__imageMetaColumns} FROM `recipe` {self.__imageMetaJoin} WHERE `recipe`.`id` = %s;",
                 [recipeId],
             )
-            return marshal(cur.fetchone(), self.__recipeFields)
+            res = cur.fetchone()
+            if res is None:
+                return None
+            return marshal(self.__nestImageMeta(res), self.__recipeFields)
+        finally:
+            conn.close()
+
+    def __indexIngredients(self, cur, recipeId, ingredients):
+        """Store the parsed ingredients, in the transaction writing the recipe."""
+        parsed = parseIngredients(ingredients)
+        if not parsed:
+            return
+        # the rows are passed as one JSON array, the group is taken from the recipe
+        cur.execute(
+            "INSERT INTO `recipe_ingredient` (`recipeId`, `position`, `groupId`, `name`, `quantity`, `unit`) "
+            "SELECT `recipe`.`id`, i.`position`, `recipe`.`groupId`, i.`name`, i.`quantity`, i.`unit` "
+            "FROM `recipe`, JSON_TABLE(%s, '$[*]' COLUMNS ("
+            f"`position` FOR ORDINALITY, `name` VARCHAR({NAME_LENGTH}) PATH '$[0]', "
+            f"`quantity` DOUBLE PATH '$[1]', `unit` VARCHAR({UNIT_LENGTH}) PATH '$[2]'"
+            ")) AS i WHERE `recipe`.`id` = %s;",
+            [json.dumps(parsed), recipeId],
+        )
+
+    def getRecipesByIngredients(self, username, names, limit):
+        """The group's recipes using any of `names`, by the share of their ingredients covered."""
+        conn, _, groupId = self.connect(username, replica=True)
+        try:
+            cur = conn.cursor()
+            placeholders = ", ".join(["%s"] * len(names))
+            # candidates come from the (groupId, name) index, only their
+            # ingredient rows are read to count the totals
+            cur.execute(
+                f"SELECT `recipeId`, COUNT(*) as total, SUM(`name` IN ({placeholders})) as matched, "
+                f"GROUP_CONCAT(IF(`name` IN ({placeholders}), NULL, `name`) ORDER BY `position` SEPARATOR '\\n') as missing "
+                "FROM `recipe_ingredient` WHERE `groupId` = %s AND `recipeId` IN ("
+                f"SELECT `recipeId` FROM `recipe_ingredient` WHERE `groupId` = %s AND `name` IN ({placeholders})"
+                ") GROUP BY `recipeId` ORDER BY matched / total DESC, matched DESC, `recipeId` DESC LIMIT %s;",
+                [*names, *names, groupId, groupId, *names, limit],
+            )
+            return {
+                "recipes": [
+                    {
+                        "id": res["recipeId"],
+                        "matched": int(res["matched"]),
+                        "total": res["total"],
+                        "coverage": round(int(res["matched"]) / res["total"], 3),
+                        "missing": res["missing"].split("\n") if res["missing"] else [],
+                    }
+                    for res in cur.fetchall()
+                ]
+            }
         finally:
             conn.close()
 
     def insertRecipe(self, username, title, category, ingredients, description, image):
-        conn, userId, _ = self.connect(username)
+        """Insert and return the recipe, None if the user has no write access."""
+        conn, _, _ = self.connect()
         try:
             cur = conn.cursor()
             if not image:
                 image = ""
-            query = "INSERT INTO recipe(title, categoryId, ingredients, description, image, userId) VALUES (%s, %s, %s, %s, %s, %s);"
+            query = f"INSERT INTO recipe(title, categoryId, ingredients, description, image, userId, groupId) SELECT %s, %s, %s, %s, %s, `id`, `groupId` FROM ({self.__writer}) AS w RETURNING *, {self.__imageMetaReturning};"
             cur.execute(
-                query, [title, category, ingredients, description, image, userId]
+                query,
+                [title, category, ingredients, description, image, username]
+                + [image] * len(self.__imageMetaFields),
             )
-            cur.execute("SELECT LAST_INSERT_ID() as id;")
-            id = cur.fetchone()["id"]
-            cur.execute("SELECT * FROM recipe WHERE id = %s;", [id])
             res = cur.fetchone()
-            return marshal(res, self.__recipeFields)
+            if res is None:
+                return None
+            self.__indexIngredients(cur, res["id"], ingredients)
+            self.__commitChange(conn, res["groupId"], "recipes", "insert", res["id"])
+            return marshal(self.__nestImageMeta(res), self.__recipeFields)
         finally:
             conn.commit()
             conn.close()
@@ -157,59 +440,66 @@ class Database:
     def updateRecipe(
         self, recipeId, username, title, category, ingredients, description, image
     ):
-        conn, userId, _ = self.connect(username)
+        conn, _, _ = self.connect()
         try:
             cur = conn.cursor()
-            query = "UPDATE `recipe` SET `title` = %s, `categoryId` = %s, `ingredients` = %s,`description` = %s, `image` = %s WHERE `id` = %s AND `userId` = %s;"
-            if (
-                cur.execute(
-                    query,
-                    [
-                        title,
-                        category,
-                        ingredients,
-                        description,
-                        image,
-                        recipeId,
-                        userId,
-                    ],
-                )
-                == 1
-            ):
-                return True
-            else:
-                cur.execute(
-                    "SELECT COUNT(*) as c FROM `recipe` WHERE `id` = %s AND `userId` = %s;",
-                    [recipeId, userId],
-                )
-                return cur.fetchone()["c"] == 1
+            # the connection counts matched rows, so an unchanged recipe counts too
+            query = f"UPDATE `recipe` SET `title` = %s, `categoryId` = %s, `ingredients` = %s,`description` = %s, `image` = %s WHERE `id` = %s AND `userId` = {self.__writerId};"
+            groupId = self.__updateAsWriter(
+                cur,
+                query,
+                [
+                    title,
+                    category,
+                    ingredients,
+                    description,
+                    image,
+                    recipeId,
+                    username,
+                ],
+                username,
+            )
+            if groupId is None:
+                return False
+            cur.execute(
+                "DELETE FROM `recipe_ingredient` WHERE `recipeId` = %s;", [recipeId]
+            )
+            self.__indexIngredients(cur, recipeId, ingredients)
+            self.__commitChange(conn, groupId, "recipes", "update", recipeId)
+            return True
         finally:
             conn.commit()
             conn.close()
 
-    def deleteRecipe(self, username, _id, IMAGE_FOLDER):
-        conn, userId, _ = self.connect(username)
+    def deleteRecipe(self, username, _id):
+        conn, _, _ = self.connect()
         try:
             cur = conn.cursor()
-            cur.execute(
-                "SELECT `image` FROM `recipe` WHERE `id` = %s AND userId = %s;",
-                [_id, userId],
-            )
-            try:
-                img = cur.fetchone()["image"]
-                if os.path.exists(IMAGE_FOLDER + img):
-                    os.remove(IMAGE_FOLDER + img)
-            except Exception as e:
-                logger.info(e)
-            return cur.execute(
-                "DELETE FROM `recipe` WHERE `id` = %s AND `userId` = %s", [_id, userId]
+            deleted = cur.execute(
+                f"DELETE FROM `recipe` WHERE `id` = %s AND `userId` = {self.__writerId} RETURNING `image`, `groupId`;",
+                [_id, username],
             )
+            res = cur.fetchone()
+            if res is not None:
+                self.__commitChange(conn, res["groupId"], "recipes", "delete", _id)
+            # images are content-addressed, another recipe may share the file
+            if res is not None and res["image"]:
+                cur.execute(
+                    "SELECT COUNT(*) as c FROM `recipe` WHERE `image` = %s;",
+                    [res["image"]],
+                )
+                if cur.fetchone()["c"] == 0:
+                    try:
+                        removeImage(res["image"])
+                    except OSError as e:
+                        logger.info(e)
+            return deleted
         finally:
             conn.commit()
             conn.close()
 
     def getComments(self, username, lastChecksum):
-        conn, userId, groupId = self.connect(username)
+        conn, userId, groupId = self.connect(username, replica=True)
         try:
             cur = conn.cursor()
             cur.execute("CHECKSUM TABLE `comment`")
@@ -219,26 +509,23 @@ class Database:
                 return make_response("", 204)
 
             cur.execute(
-                "SELECT `comment`.* FROM `comment` JOIN `user` ON `comment`.`userId` = `user`.`id` WHERE `groupId` = %s;",
+                "SELECT * FROM `comment` WHERE `groupId` = %s;",
                 [groupId],
             )
             comments = []
             for res in cur.fetchall():
                 comments.append(marshal(res, self.__commentFields))
 
-            cur.execute("CHECKSUM TABLE `comment`;")
-            res = cur.fetchone()
-            checksum = res["Checksum"]
             return {"comments": comments, "checksum": checksum}
         finally:
             conn.close()
 
     def getComment(self, username, commentId):
-        conn, userId, groupId = self.connect(username)
+        conn, userId, groupId = self.connect(username, replica=True)
         try:
             cur = conn.cursor()
             cur.execute(
-                "SELECT `comment`.* FROM `comment` JOIN `user` ON `comment`.`userId` = `user`.`id` WHERE `groupId` = %s and `comment`.`id` = %s;",
+                "SELECT * FROM `comment` WHERE `groupId` = %s AND `id` = %s;",
                 [groupId, commentId],
             )
             comment = None
@@ -251,54 +538,77 @@ class Database:
         finally:
             conn.close()
 
+    def getRecipeComments(self, username, recipeId, after, limit):
+        """One page of a recipe's comments, oldest first, starting after id `after`."""
+        conn, _, groupId = self.connect(username, replica=True)
+        try:
+            cur = conn.cursor()
+            # served by the `recipeId` index, whose entries are ordered by id
+            cur.execute(
+                "SELECT * FROM `comment` WHERE `recipeId` = %s AND `id` > %s AND `groupId` = %s ORDER BY `id` LIMIT %s;",
+                [recipeId, after, groupId, limit + 1],
+            )
+            rows = cur.fetchall()
+            comments = [marshal(res, self.__commentFields) for res in rows[:limit]]
+            nextAfter = comments[-1]["id"] if len(rows) > limit else None
+            return {"comments": comments, "next": nextAfter}
+        finally:
+            conn.close()
+
     def addComment(self, username, text, recipeId):
-        conn, userId, _ = self.connect(username)
+        """Insert and return the comment, None if the user has no write access."""
+        conn, _, _ = self.connect()
         try:
             cur = conn.cursor()  # todo: check if we are in the group
             cur.execute(
-                "INSERT INTO comment(text, userId, recipeId) VALUES (%s, %s, %s);",
-                [text, userId, recipeId],
+                f"INSERT INTO comment(text, userId, recipeId, groupId) SELECT %s, `id`, %s, `groupId` FROM ({self.__writer}) AS w RETURNING *;",
+                [text, recipeId, username],
             )
-            cur.execute("SELECT LAST_INSERT_ID() as id;")
-            id = cur.fetchone()["id"]
-            cur.execute("SELECT * FROM comment WHERE id = %s;", [id])
             res = cur.fetchone()
+            if res is None:
+                return None
+            self.__commitChange(conn, res["groupId"], "comments", "insert", res["id"])
             return marshal(res, self.__commentFields)
         finally:
             conn.commit()
             conn.close()
 
     def updateComment(self, username, commentId, text):
-        conn, userId, _ = self.connect(username)
+        conn, _, _ = self.connect()
         try:
             cur = conn.cursor()
-            query = "UPDATE `comment` SET `text` = %s, `editedDate` = CURRENT_TIMESTAMP() WHERE `id` = %s AND `userId` = %s;"
-            logger.info(f"{query=}, {text=}, {commentId=}, {userId=}")
-            if cur.execute(query, [text, commentId, userId]) == 1:
-                return True
-            else:
-                cur.execute(
-                    "SELECT COUNT(*) as c FROM `recipe` WHERE `id` = %s AND `userId` = %s;",
-                    [commentId, userId],
-                )
-                return cur.fetchone()["c"] == 1
+            query = f"UPDATE `comment` SET `text` = %s, `editedDate` = CURRENT_TIMESTAMP() WHERE `id` = %s AND `userId` = {self.__writerId};"
+            logger.info(f"{query=}, {text=}, {commentId=}, {username=}")
+            groupId = self.__updateAsWriter(
+                cur, query, [text, commentId, username], username
+            )
+            if groupId is None:
+                return False
+            self.__commitChange(conn, groupId, "comments", "update", commentId)
+            return True
         finally:
             conn.commit()
             conn.close()
 
     def deleteComment(self, username, id):
-        conn, userId, _ = self.connect(username)
+        conn, _, _ = self.connect()
         try:
             cur = conn.cursor()
-            return cur.execute(
-                "DELETE FROM `comment` WHERE `id` = %s AND `userId` = %s", [id, userId]
+            deleted = cur.execute(
+                f"DELETE FROM `comment` WHERE `id` = %s AND `userId` = {self.__writerId} RETURNING `groupId`;",
+                [id, username],
             )
+            if deleted == 1:
+                self.__commitChange(
+                    conn, cur.fetchone()["groupId"], "comments", "delete", id
+                )
+            return deleted
         finally:
             conn.commit()
             conn.close()
 
     def getCategories(self, username, lastChecksum):
-        conn, userId, groupId = self.connect(username)
+        conn, userId, groupId = self.connect(username, replica=True)
         try:
             cur = conn.cursor()
             cur.execute("CHECKSUM TABLE `category`")
@@ -308,36 +618,37 @@ class Database:
                 return make_response("", 204)
 
             cur.execute(
-                "SELECT `category`.* FROM `category` JOIN `user` ON `category`.`userId`= `user`.`id` WHERE `user`.`groupId` = %s;",
+                "SELECT * FROM `category` WHERE `groupId` = %s;",
                 [groupId],
             )
             categories = []
             for res in cur.fetchall():
                 categories.append(marshal(res, self.__categoryFields))
 
-            cur.execute("CHECKSUM TABLE `category`;")
-            res = cur.fetchone()
-            checksum = res["Checksum"]
             return {"categories": categories, "checksum": checksum}
         finally:
             conn.close()
 
     def insertCategory(self, username, name):
-        conn, userId, _ = self.connect(username)
+        """Insert a category and return its id, None if the user has no write access."""
+        conn, _, _ = self.connect()
         try:
             cur = conn.cursor()
-            query = "INSERT INTO category(name, userId) VALUES (%s, %s);"
-            logger.info(f"{query=}, [{name=}, {userId=}]")
-            cur.execute(query, [name, userId])
-            cur.execute("SELECT LAST_INSERT_ID() as id;")
-            return {"id": cur.fetchone()["id"]}
+            query = f"INSERT INTO category(name, userId, groupId) SELECT %s, `id`, `groupId` FROM ({self.__writer}) AS w RETURNING `id`, `groupId`;"
+            logger.info(f"{query=}, [{name=}, {username=}]")
+            cur.execute(query, [name, username])
+            res = cur.fetchone()
+            if res is None:
+                return None
+            self.__commitChange(conn, res["groupId"], "categories", "insert", res["id"])
+            return {"id": res["id"]}
         finally:
             conn.commit()
             conn.close()
 
     # authentication
     def getPasswordHash(self, username):
-        conn, _, _ = self.connect()
+        conn, _, _ = self.connect(replica=True)
         try:
             cur = conn.cursor()
             cur.execute("SELECT `encrypted` FROM `user` WHERE `user` = %s;", [username])
@@ -356,6 +667,7 @@ class Database:
                 "VALUES (%s, %s, '0', 0);"
             )
             if cur.execute(query, [username, hash]) == 1:
+                self.__commitChange(conn, 0, "users", "insert", cur.lastrowid)
                 return True
         finally:
             conn.commit()
@@ -373,6 +685,72 @@ class Database:
         finally:
             conn.close()
 
+    def getImageDeletion(self, username, image):
+        """Whether the user may delete images and whether a recipe still uses `image`."""
+        conn, _, _ = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT EXISTS(SELECT 1 FROM `user` WHERE `user` = %s AND `readOnly` = 0) as w, "
+                "EXISTS(SELECT 1 FROM `recipe` WHERE `image` = %s) as referenced;",
+                [username, image],
+            )
+            res = cur.fetchone()
+            return res["w"] == 1, res["referenced"] == 1
+        finally:
+            conn.close()
+
+    def addImageMeta(self, name, meta):
+        conn, _, _ = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO `image` (`name`, `width`, `height`, `bytes`, `color`, `placeholder`) "
+                "VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE "
+                "`width` = VALUES(`width`), `height` = VALUES(`height`), `bytes` = VALUES(`bytes`), "
+                "`color` = VALUES(`color`), `placeholder` = VALUES(`placeholder`);",
+                [
+                    name,
+                    meta["width"],
+                    meta["height"],
+                    meta["bytes"],
+                    meta["color"],
+                    meta["placeholder"],
+                ],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def getImageMetaNames(self):
+        """Names of all images with metadata."""
+        conn, _, _ = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT `name` FROM `image`;")
+            return {res["name"] for res in cur.fetchall()}
+        finally:
+            conn.close()
+
+    def deleteImageMeta(self, names):
+        conn, _, _ = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.executemany("DELETE FROM `image` WHERE `name` = %s;", list(names))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def getReferencedImages(self):
+        """Return every image name used by any recipe (the GC marks shared recipes' too)."""
+        conn, _, _ = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT DISTINCT `image` FROM `recipe` WHERE `image` != '';")
+            return {res["image"] for res in cur.fetchall()}
+        finally:
+            conn.close()
+
     def getUserGroups(self):
         """Return a {username: groupId} map for scoping notifications by group."""
         conn, _, _ = self.connect()
@@ -382,3 +760,9 @@ class Database:
             return {res["user"]: res["groupId"] for res in cur.fetchall()}
         finally:
             conn.close()
+
+    def getGroupId(self, username):
+        """The user's groupId, -1 for unknown users."""
+        conn, _, groupId = self.connect(username, replica=True)
+        conn.close()
+        return groupId
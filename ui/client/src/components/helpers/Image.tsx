@@ -34,9 +34,28 @@ export function MyImage(props: IProps) {
     })
     .reduce((p, c, i) => (i === 0 ? c : `${p}, ${c}`), '');
 
+  // painted until the image itself has loaded
+  const meta = props.recipe.imageMeta;
+  const placeholderStyle: React.CSSProperties = meta
+    ? {
+        backgroundColor: meta.color,
+        backgroundImage: `url(${meta.placeholder})`,
+        backgroundSize: 'cover',
+        backgroundPosition: 'center',
+        // reserves the image's box before it has loaded, so the layout does not shift
+        aspectRatio: `${meta.width} / ${meta.height}`,
+      }
+    : {};
+  // the api fits the image into size x size keeping its aspect ratio, never enlarging it
+  const width = meta
+    ? Math.round(meta.width * Math.min(props.size / meta.width, props.size / meta.height, 1))
+    : undefined;
+
   return (
     <img
+      width={width}
       {...props.imageProps}
+      style={{ ...placeholderStyle, ...props.imageProps?.style }}
       alt={t('altImage')}
       loading="lazy"
       srcSet={srcSet}
@@ -15,6 +15,7 @@ const RECIPE_CACHE = 'recipes';
 const CATEGORY_CACHE = 'categories';
 const USER_CACHE = 'users';
 const COMMENT_CACHE = 'DBchecksum';
+const UPLOAD_CHUNK_SIZE = 1024 * 1024;
 
 export const emptyRecipe: IRecipe & IRecipeWithIngredientId = {
   title: '',
@@ -56,12 +57,21 @@ export interface IApiComment {
   editedDate?: string;
 }
 
+export interface IImageMeta {
+  width: number;
+  height: number;
+  bytes: number;
+  color: string;
+  placeholder: string;
+}
+
 export interface IRecipe {
   title: string;
   category: ICategory;
   ingredients: string[];
   description: string;
   image: string;
+  imageMeta?: IImageMeta | null;
   date: string;
   id: number;
   user: IUser;
@@ -77,6 +87,7 @@ export interface IRecipeWithIngredientId {
   ingredients: IIngredient[];
   description: string;
   image: string;
+  imageMeta?: IImageMeta | null;
   date: string;
   id: number;
   user: IUser;
@@ -89,6 +100,7 @@ interface IApiRecipe {
   ingredients: string;
   description: string;
   image: string;
+  imageMeta?: IImageMeta | null;
   date: string;
   id: number;
   userId: number;
@@ -152,6 +164,7 @@ function apiToRecipe(
       .filter((v) => v.trim().length > 0),
     description: r.description,
     image: r.image,
+    imageMeta: r.imageMeta,
     date: dayjs(r.date).toString(),
     id: r.id,
     user: {
@@ -216,6 +229,9 @@ class Recipes {
 
   private callbacks: ICallBack[] = [];
 
+  private changeFeed: EventSource | undefined;
+  private changeTimeout: ReturnType<typeof setTimeout> | undefined;
+
   constructor() {
     void get<IRecipe[]>(RECIPE_CACHE).then(async (result) => {
       if (!result) {
@@ -237,7 +253,10 @@ class Recipes {
   public subscribe(callback: ICallBack) {
     this.callbacks.push(callback);
     callback(this.recipeCache, this.categoryCache, this.userCache, typeof userInfo !== 'undefined');
-    void this.fetchData();
+    // with the change feed connected the caches are current already
+    if (this.changeFeed?.readyState !== EventSource.OPEN) {
+      void this.fetchData();
+    }
     return () => {
       recipesHandler.unsubscribe(callback);
     };
@@ -255,18 +274,55 @@ class Recipes {
     return this.recipeCache.find((r) => r.id === id);
   }
 
+  /**
+   * Uploads with the resumable /api/uploads protocol: the file is sent in chunks
+   * and after a failed request the upload continues at the offset the api has.
+   */
   public uploadImage(image: File, callbacks: IUploadCallbacks) {
-    const form = new FormData();
-    form.append('image', image);
-    axios
-      .post('/api/images', form, {
-        headers: {
-          'Content-Type': 'multipart/form-data',
-        },
-        onUploadProgress: callbacks.onUploadProgress,
-      })
-      .then(callbacks.onSuccess)
-      .catch((r) => callbacks.onFailure(r));
+    void this.uploadResumable(image, callbacks).then(callbacks.onSuccess, callbacks.onFailure);
+  }
+
+  private async uploadResumable(image: File, callbacks: IUploadCallbacks): Promise<AxiosResponse> {
+    const created = await axios.post<{ id: string; offset: number }>('/api/uploads', {
+      size: image.size,
+    });
+    const url = `/api/uploads/${created.data.id}`;
+    let offset = created.data.offset;
+    let failures = 0;
+    for (;;) {
+      const start = offset;
+      try {
+        const response = await axios.patch(url, image.slice(start, start + UPLOAD_CHUNK_SIZE), {
+          headers: {
+            'Content-Type': 'application/offset+octet-stream',
+            'Upload-Offset': String(start),
+          },
+          onUploadProgress: (event) =>
+            callbacks.onUploadProgress({
+              ...event,
+              loaded: start + event.loaded,
+              total: image.size,
+            }),
+        });
+        if (response.status === 201) {
+          return response;
+        }
+        offset = Number(response.headers['upload-offset']);
+        failures = 0;
+      } catch (e) {
+        // client errors (not an image, too large) won't go away by retrying
+        const status = axios.isAxiosError(e) ? e.response?.status : undefined;
+        if ((status !== undefined && status !== 409 && status < 500) || ++failures > 5) {
+          throw e;
+        }
+        await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** failures));
+        try {
+          offset = (await axios.get<{ offset: number }>(url)).data.offset;
+        } catch {
+          // still offline, a wrong offset is answered with 409 and asked for again
+        }
+      }
+    }
   }
 
   public async deleteComment(comment: IComment): Promise<boolean> {
@@ -371,6 +427,32 @@ class Recipes {
     return result.status === 204;
   }
 
+  // live changes of the group's users, categories, comments and recipes (api/changes.py),
+  // each refetch only downloads the tables whose checksum changed
+  private followChanges() {
+    if (this.changeFeed || typeof EventSource === 'undefined') {
+      return;
+    }
+    const feed = new EventSource('/api/changes');
+    const refetch = () => {
+      // a burst of changes causes a single fetch
+      clearTimeout(this.changeTimeout);
+      this.changeTimeout = setTimeout(() => void this.fetchData(), 200);
+    };
+    feed.addEventListener('change', refetch);
+    // the feed lost changes, e.g. after being offline for long
+    feed.addEventListener('reset', refetch);
+    // changes made while (re)connecting
+    feed.onopen = refetch;
+    feed.onerror = () => {
+      // the browser retries on network errors, not on error responses (e.g. logged out)
+      if (feed.readyState === EventSource.CLOSED) {
+        this.changeFeed = undefined;
+      }
+    };
+    this.changeFeed = feed;
+  }
+
   private notify() {
     // console.debug('notifying', this.callbacks);
     for (const callback of this.callbacks) {
@@ -492,6 +574,7 @@ class Recipes {
         );
         await set(RECIPE_CACHE, this.recipeCache);
       }
+      this.followChanges();
     } catch (e) {
       console.error('failed to fetch, offline', e);
     } finally {